@@ -0,0 +1,3 @@
+# DiGear Jam Studio engine
+# everything in here imports without touching the display, the sound card or the disk,
+# main.py is the gui that drives it
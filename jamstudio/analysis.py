@@ -0,0 +1,306 @@
+# guesses bpm and key for songs that dont have (all of) a meta.json
+#
+#   python -m jamstudio.analysis            songs missing meta.json info
+#   python -m jamstudio.analysis --all      every song, even ones with a meta.json
+#
+# results go in analysis.json next to the stems with a confidence for each guess.
+# whatever is in meta.json always wins over these
+#
+# the key is a best fit of the notes played against a major/minor profile, so a song
+# that leans on a note from outside its key comes out a fifth off. the stock house
+# song is like that, its in C (meta.json) but plays Bb all through, which fits F
+# major better
+
+import argparse
+import json
+import logging
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import numpy as np
+import soundfile as sf
+
+from . import logs
+from .library import get_song_list, meta_complete
+from .music import KEYS_SHARP
+
+log = logging.getLogger(__name__)
+
+ANALYSIS_FILE = "analysis.json"
+ANALYSIS_VERSION = 1
+
+# everything gets looked at at half rate, plenty for onsets and chroma
+ANALYSIS_RATE = 22050
+
+BPM_MIN = 60
+BPM_MAX = 200
+
+# krumhansl-schmuckler key profiles, index 0 is the tonic
+MAJOR_PROFILE = np.array(
+    [6.35, 2.23, 3.48, 2.33, 4.38, 4.09, 2.52, 5.19, 2.39, 3.66, 2.29, 2.88]
+)
+MINOR_PROFILE = np.array(
+    [6.33, 2.68, 3.52, 5.38, 2.60, 3.53, 2.54, 4.75, 3.98, 2.69, 3.34, 3.17]
+)
+
+
+def read_mono(path):
+    # mono at ANALYSIS_RATE, cheap two tap average instead of a proper resample
+    audio, sr = sf.read(path, dtype="float32", always_2d=True)
+    mono = audio.mean(axis=1)
+    step = max(1, int(round(sr / ANALYSIS_RATE)))
+    if step > 1:
+        n = len(mono) // step * step
+        mono = mono[:n].reshape(-1, step).mean(axis=1)
+    return mono, sr / step
+
+
+def frame_spectra(mono, n_fft, hop, chunk=1024):
+    # |stft|, a chunk of frames at a time so a long file doesnt blow up memory
+    if len(mono) < n_fft:
+        mono = np.pad(mono, (0, n_fft - len(mono)))
+    frames = np.lib.stride_tricks.sliding_window_view(mono, n_fft)[::hop]
+    window = np.hanning(n_fft).astype(np.float32)
+    for start in range(0, len(frames), chunk):
+        yield np.abs(np.fft.rfft(frames[start : start + chunk] * window, axis=1))
+
+
+def onset_envelope(mono, n_fft=1024, hop=256):
+    # log spectral flux, positive changes only, with the slow trend taken out
+    flux = []
+    prev = None
+    for mag in frame_spectra(mono, n_fft, hop):
+        logmag = np.log1p(100 * mag)
+        if prev is not None:
+            logmag = np.vstack((prev, logmag))
+        flux.append(np.maximum(np.diff(logmag, axis=0), 0).sum(axis=1))
+        prev = logmag[-1:]
+    env = np.concatenate(flux) if flux else np.zeros(1)
+
+    trend = np.convolve(env, np.ones(16) / 16, mode="same")
+    return np.maximum(env - trend, 0)
+
+
+def estimate_bpm(mono, sr, hop=256):
+    # autocorrelation of the onset envelope, scored over a grid of tempos with the
+    # double tempo lag added in and a soft pull towards 120 so it doesnt flip octaves
+    env = onset_envelope(mono, hop=hop)
+    env = env - env.mean()
+    n = len(env)
+    if n < 4:
+        return None, 0.0
+
+    spec = np.fft.rfft(env, 2 * n)
+    ac = np.fft.irfft(spec * np.conj(spec))[:n]
+    if ac[0] <= 0:
+        return None, 0.0
+    ac /= ac[0]
+
+    fps = sr / hop
+    bpms = np.arange(BPM_MIN, BPM_MAX + 0.05, 0.1)
+    lags = 60 * fps / bpms
+    score = np.interp(lags, np.arange(n), ac) + 0.5 * np.interp(
+        2 * lags, np.arange(n), ac
+    )
+    prior = np.exp(-0.5 * (np.log2(bpms / 120) / 0.9) ** 2)
+    best = int(np.argmax(score * prior))
+
+    bpm = float(bpms[best])
+    confidence = float(np.clip(score[best] / 1.5, 0, 1))
+
+    # stems are chopped to whole bars, if a whole number of 4/4 bars fits the loop
+    # at almost this tempo thats the real one
+    seconds = len(mono) / sr
+    for bars in (1, 2, 4, 8, 16, 32, 64, 128):
+        exact = bars * 4 * 60 / seconds
+        if abs(exact - bpm) / bpm < 0.02:
+            bpm = exact
+            confidence = min(1.0, confidence + 0.25)
+            break
+
+    return round(bpm, 2), round(confidence, 3)
+
+
+def chroma(mono, sr, n_fft=8192, hop=4096):
+    # energy per pitch class between ~A1 and ~C7
+    freqs = np.fft.rfftfreq(n_fft, 1 / sr)
+    use = (freqs > 50) & (freqs < 2100)
+    pitch_class = np.round(12 * np.log2(freqs[use] / 440) + 69).astype(int) % 12
+
+    power = np.zeros(use.sum())
+    for mag in frame_spectra(mono, n_fft, hop):
+        power += (mag[:, use] ** 2).sum(axis=0)
+
+    return np.bincount(pitch_class, weights=power, minlength=12)
+
+
+def estimate_key(mono, sr, scales=("major", "minor")):
+    # correlate the chroma with all 24 rotated profiles at once
+    c = chroma(mono, sr)
+    if not c.any():
+        return None, None, 0.0
+    c = (c - c.mean()) / (c.std() or 1)
+
+    names = []
+    templates = []
+    for scale in scales:
+        profile = MAJOR_PROFILE if scale == "major" else MINOR_PROFILE
+        for tonic in range(12):
+            names.append((KEYS_SHARP[tonic], scale))
+            templates.append(np.roll(profile, tonic))
+    templates = np.array(templates)
+    templates = (templates - templates.mean(axis=1, keepdims=True)) / templates.std(
+        axis=1, keepdims=True
+    )
+
+    corr = templates @ c / 12
+    order = np.argsort(corr)[::-1]
+    key, scale = names[order[0]]
+    return key, scale, round(float(corr[order[0]]), 3)
+
+
+def song_sources(song_folder):
+    # file -> mtime for the stems the analysis looks at
+    sources = {}
+    for f in sorted(os.listdir(song_folder)):
+        if f.endswith(".ogg") or f.endswith(".wav") or f.endswith(".flac"):
+            sources[f] = os.path.getmtime(os.path.join(song_folder, f))
+    return sources
+
+
+def mix_files(song_folder, files):
+    mix = None
+    sr = ANALYSIS_RATE
+    for f in files:
+        mono, sr = read_mono(os.path.join(song_folder, f))
+        if mix is None:
+            mix = mono
+        else:
+            n = min(len(mix), len(mono))
+            mix = mix[:n] + mono[:n]
+    return mix, sr
+
+
+def analyze_song(song_folder):
+    sources = song_sources(song_folder)
+    if not sources:
+        raise FileNotFoundError(f"no audio in {song_folder}")
+    stems = list(sources)
+    # any case, like library.stem_files
+    drums = [f for f in stems if f.lower().startswith("drums")]
+
+    # tempo off the drums if theres a drum stem, otherwise everything
+    rhythm = drums or stems
+    mono, sr = mix_files(song_folder, rhythm)
+    bpm, bpm_conf = estimate_bpm(mono, sr)
+
+    # key off the tonal stems. they come as <type>_major/<type>_minor in the same
+    # tonic, so if only one mode is there that decides the scale
+    major = [f for f in stems if "_major" in f.lower()]
+    minor = [f for f in stems if "_minor" in f.lower()]
+    if major and not minor:
+        files, scales = major, ("major",)
+    elif minor and not major:
+        files, scales = minor, ("minor",)
+    else:
+        files = major or [f for f in stems if f not in drums] or stems
+        scales = ("major", "minor")
+    mono, sr = mix_files(song_folder, files)
+    key, scale, key_conf = estimate_key(mono, sr, scales)
+
+    return {
+        "version": ANALYSIS_VERSION,
+        "bpm": bpm,
+        "bpm_confidence": bpm_conf,
+        "key": key,
+        "scale": scale,
+        "key_confidence": key_conf,
+        "sources": sources,
+    }
+
+
+def cached_analysis(song_folder):
+    # the sidecar if its there and none of the stems changed since
+    try:
+        with open(os.path.join(song_folder, ANALYSIS_FILE), "r") as f:
+            data = json.load(f)
+    except Exception:
+        return None
+    if data.get("version") != ANALYSIS_VERSION:
+        return None
+    if data.get("sources") != song_sources(song_folder):
+        return None
+    return data
+
+
+def song_analysis(song_folder):
+    data = cached_analysis(song_folder)
+    if data is None:
+        log.info("Analyzing %s...", os.path.basename(song_folder))
+        data = analyze_song(song_folder)
+        save_analysis(song_folder, data)
+    return data
+
+
+def save_analysis(song_folder, data):
+    try:
+        with open(os.path.join(song_folder, ANALYSIS_FILE), "w") as f:
+            json.dump(data, f, indent=4)
+    except Exception as e:
+        log.error("Could not save analysis: %s", e)
+
+
+def needs_analysis(song_folder):
+    try:
+        with open(os.path.join(song_folder, "meta.json"), "r") as f:
+            meta = json.load(f)
+        return not meta_complete(meta)
+    except Exception:
+        return True
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        prog="python -m jamstudio.analysis",
+        description="Guess bpm and key for songs without a complete meta.json.",
+    )
+    parser.add_argument(
+        "--all", action="store_true", help="analyze every song, not just missing ones"
+    )
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1)
+    args = parser.parse_args(argv)
+    # the cli prints its own report, logs.setup() is for what the modules say
+    logs.setup()
+
+    songs = [
+        s
+        for s in get_song_list()
+        if (args.all or needs_analysis(s)) and cached_analysis(s) is None
+    ]
+    print(f"{len(songs)} songs to analyze.")
+    if not songs:
+        return
+
+    t0 = time.perf_counter()
+    with ProcessPoolExecutor(max_workers=args.workers) as pool:
+        futures = {pool.submit(analyze_song, s): s for s in songs}
+        for future in as_completed(futures):
+            song = futures[future]
+            name = os.path.basename(song)
+            try:
+                data = future.result()
+            except Exception as e:
+                print(f"  {name}: failed ({e})")
+                continue
+            save_analysis(song, data)
+            print(
+                f"  {name}: {data['bpm']} bpm ({data['bpm_confidence']:.2f}), "
+                f"{data['key']} {data['scale']} ({data['key_confidence']:.2f})"
+            )
+
+    print(f"Done in {time.perf_counter() - t0:.1f} s.")
+
+
+if __name__ == "__main__":
+    main()
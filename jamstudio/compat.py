@@ -0,0 +1,184 @@
+# how well every song fits the master, for sorting the stem select list
+#
+# SongIndex reads each songs meta.json once (the analysis sidecar fills in whats
+# missing, nothing gets analyzed here) and which stem files it has, and keeps it all
+# in numpy arrays. rank() then works out the stretch and shift plan_stem would pick
+# for every song at once, so sorting the whole library against a new master is well
+# under a millisecond and never touches the disk
+#
+# cost is in semitones: the pitch shift, plus the tempo change as the semitones the
+# same speed change would be (12 * log2(ratio), 6% faster is about 1), plus
+# FALLBACK_COST when theres no file in the masters mode and the relative one gets used
+
+import json
+import logging
+import os
+import threading
+import time
+
+import numpy as np
+
+from .analysis import cached_analysis
+from .library import REQUIRED_META, meta_complete, stem_files
+from .music import KEY_TO_INT
+
+log = logging.getLogger(__name__)
+
+# the multiples match_bpm_timescale tries
+TIMESCALES = 2.0 ** np.arange(-4, 5)
+# on top of the +-3 semitones the relative mode costs
+FALLBACK_COST = 1.0
+STEM_TYPES = ["vocals", "bass", "lead", "drums"]
+SCALES = ["major", "minor"]
+
+
+def song_info(folder):
+    # (bpm, key, {stem: scales it has a file for}), bpm/key None if theres no telling
+    try:
+        with open(os.path.join(folder, "meta.json"), "r") as f:
+            meta = json.load(f)
+    except Exception:
+        meta = {}
+    if meta.get("key") not in KEY_TO_INT:
+        meta.pop("key", None)
+    if not meta_complete(meta):
+        guessed = cached_analysis(folder) or {}
+        for name in REQUIRED_META:
+            if name not in meta:
+                meta[name] = guessed.get(name)
+
+    stems = {}
+    for stem_type, scale in stem_files(folder):
+        stems.setdefault(stem_type, set()).add(scale)
+    return meta.get("bpm"), meta.get("key"), stems
+
+
+class SongIndex:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.folders = []
+        self.position = {}  # folder -> row
+        self.bpms = np.zeros(0)
+        self.keys = np.zeros(0, np.int64)  # key class 0-11, -1 unknown
+        self.name_order = np.zeros(0, np.int64)  # alphabetical place, for ties
+        # (stem, scale) -> bool per song, drums just use "neutral"
+        self.has = {}
+
+    def update(self, folders):
+        # adds the songs it hasnt seen, the ones it has keep whatever was read
+        new = [f for f in folders if f not in self.position]
+        if not new:
+            return
+        t0 = time.perf_counter()
+        infos = []
+        for folder in new:
+            try:
+                infos.append(song_info(folder))
+            except OSError as e:
+                log.warning("Could not index %s: %s", folder, e)
+                infos.append((None, None, {}))
+
+        with self.lock:
+            # another update might have got some of them in first
+            infos = [x for f, x in zip(new, infos) if f not in self.position]
+            new = [f for f in new if f not in self.position]
+            start = len(self.folders)
+            folders = self.folders + new
+            bpms = np.concatenate(
+                (self.bpms, [float(b) if b else np.nan for b, _, _ in infos])
+            )
+            keys = np.concatenate(
+                (self.keys, [KEY_TO_INT.get(k, -1) for _, k, _ in infos])
+            ).astype(np.int64)
+            has = {}
+            for stem_type in STEM_TYPES:
+                for scale in ["neutral"] if stem_type == "drums" else SCALES:
+                    old = self.has.get((stem_type, scale), np.zeros(start, bool))
+                    added = [scale in stems.get(stem_type, ()) for _, _, stems in infos]
+                    has[(stem_type, scale)] = np.concatenate((old, added)).astype(bool)
+
+            names = [os.path.basename(f).lower() for f in folders]
+            name_order = np.empty(len(folders), np.int64)
+            name_order[np.argsort(names, kind="stable")] = np.arange(len(folders))
+
+            self.folders = folders
+            self.position = {f: i for i, f in enumerate(folders)}
+            self.bpms = bpms
+            self.keys = keys
+            self.has = has
+            self.name_order = name_order
+        log.debug(
+            "Indexed %d songs in %.1f ms.",
+            len(new),
+            (time.perf_counter() - t0) * 1000,
+        )
+
+    def snapshot(self):
+        # update() swaps in new arrays, it never changes the old ones
+        with self.lock:
+            return self.position, self.bpms, self.keys, self.has, self.name_order
+
+    def costs(self, master, stem_type, snapshot=None):
+        # arrays over every indexed song: stretch ratio, semitones, relative mode
+        # used, cost. nan cost if the song has no file for stem_type or no bpm/key
+        master_bpm, master_key, master_scale = master
+        master_scale = (master_scale or "major").lower()
+        _, bpms, keys, has, _ = snapshot or self.snapshot()
+
+        # same pick as match_bpm_timescale
+        family = bpms[:, None] * TIMESCALES
+        nearest = np.argmin(np.abs(family - master_bpm), axis=1)
+        adjusted = family[np.arange(len(bpms)), nearest]
+        ratio = master_bpm / adjusted
+
+        if stem_type == "drums":
+            semis = np.zeros(len(bpms))
+            fallback = np.zeros(len(bpms), bool)
+            usable = has.get(("drums", "neutral"), np.zeros(len(bpms), bool))
+        else:
+            # same as key_shift_semitones, then the relative mode offset
+            raw = KEY_TO_INT[master_key] - keys
+            semis = np.select([raw > 6, raw < -6], [raw - 12, raw + 12], raw)
+            other = "minor" if master_scale == "major" else "major"
+            in_mode = has.get((stem_type, master_scale), np.zeros(len(bpms), bool))
+            fallback = ~in_mode & has.get((stem_type, other), np.zeros(len(bpms), bool))
+            semis = semis + np.where(fallback, -3 if other == "minor" else 3, 0)
+            usable = (in_mode | fallback) & (keys >= 0)
+
+        cost = 12 * np.abs(np.log2(ratio)) + np.abs(semis) + fallback * FALLBACK_COST
+        cost = np.where(usable & ~np.isnan(bpms), cost, np.nan)
+        return ratio, semis, fallback, cost
+
+    def rank(self, folders, master, stem_type):
+        # folders that have stem_type, cheapest first (ties by name). songs that
+        # arent indexed or have no bpm/key go at the end, ones without the stem
+        # are left out
+        snapshot = self.snapshot()
+        position, bpms, keys, _, name_order = snapshot
+        cost = self.costs(master, stem_type, snapshot)[3]
+        if not len(cost):
+            return list(folders)
+
+        rows = np.fromiter((position.get(f, -1) for f in folders), np.int64)
+        known = (rows >= 0) & ~np.isnan(bpms[rows]) & (keys[rows] >= 0)
+        usable = np.flatnonzero(known & ~np.isnan(cost[rows]))
+        order = usable[np.lexsort((name_order[rows[usable]], cost[rows[usable]]))]
+        return [folders[i] for i in order] + [
+            folders[i] for i in np.flatnonzero(~known)
+        ]
+
+    def describe(self, folder, master, stem_type):
+        # "+2 st, tempo -3.1%, relative mode" for one song, None if it cant be told
+        snapshot = self.snapshot()
+        i = snapshot[0].get(folder)
+        if i is None:
+            return None
+        ratio, semis, fallback, cost = self.costs(master, stem_type, snapshot)
+        if np.isnan(cost[i]):
+            return None
+        parts = [f"{semis[i]:+.0f} st" if semis[i] else "no shift"]
+        tempo = (ratio[i] - 1) * 100
+        parts.append(f"tempo {tempo:+.1f}%" if abs(tempo) >= 0.05 else "no stretch")
+        if fallback[i]:
+            parts.append("relative mode")
+        return ", ".join(parts)
@@ -0,0 +1,451 @@
+# osc over udp on localhost so a controller (or a script) can drive the jam
+#
+#   /jam/slot/<n>/load     s:song s:stem [s:profile]
+#   /jam/slot/<n>/clear
+#   /jam/slot/<n>/volume   f:0..1
+#   /jam/slot/<n>/mute     i:0/1
+#   /jam/slot/<n>/solo     i:0/1
+#   /jam/slot/<n>/half     i:0/1
+#   /jam/master/bpm        f
+#   /jam/master/key        s:key [s:scale]
+#   /jam/master/volume     f:0..1
+#   /jam/transport/play, /pause, /toggle, /restart
+#   /jam/subscribe [i:port]  state changes get sent back to the sender (or port)
+#   /jam/unsubscribe [i:port]
+#   /jam/state               everything sent back once
+#   /jam/memory              s:json of memory.report() sent back
+#   /jam/record/start, /jam/record/stop [s:wav]  the wav gets rendered after stopping
+#
+# a message that cant be done (no such slot) gets /jam/error s:message sent back
+# mixer stuff goes through the engines command queue and lands on the next block,
+# loads and retunes run one at a time on a worker so the socket never waits on them.
+# state goes out as /jam/slot/<n> s:song s:stem f:volume i:mute i:solo i:half s:status
+# and /jam/master f:bpm s:key s:scale f:volume i:playing
+#
+#   python -m jamstudio.control /jam/slot/0/volume 0.5      a quick client to poke it with
+
+import argparse
+import asyncio
+import logging
+import socket
+import struct
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from . import memory, record
+from .library import find_song
+from .music import KEY_TO_INT
+
+log = logging.getLogger(__name__)
+
+CONTROL_ENABLED = False
+CONTROL_HOST = "127.0.0.1"
+CONTROL_PORT = 9000
+
+# how often slot/master state is checked for changes to send out
+STATE_INTERVAL = 0.05
+
+
+# -------------------- osc messages --------------------
+
+
+def pad(data):
+    return data + b"\0" * (4 - len(data) % 4)
+
+
+def encode_message(address, *args):
+    tags = ","
+    body = b""
+    for arg in args:
+        if isinstance(arg, bool):
+            tags += "i"
+            body += struct.pack(">i", int(arg))
+        elif isinstance(arg, int):
+            tags += "i"
+            body += struct.pack(">i", arg)
+        elif isinstance(arg, float):
+            tags += "f"
+            body += struct.pack(">f", arg)
+        else:
+            tags += "s"
+            body += pad(str(arg).encode())
+    return pad(address.encode()) + pad(tags.encode()) + body
+
+
+def read_string(data, pos):
+    end = data.index(b"\0", pos)
+    return data[pos:end].decode(), (end // 4 + 1) * 4
+
+
+def decode_messages(data):
+    # [(address, args)], bundles get flattened (their time tags are ignored)
+    if data.startswith(b"#bundle\0"):
+        messages = []
+        pos = 16
+        while pos + 4 <= len(data):
+            (size,) = struct.unpack(">i", data[pos : pos + 4])
+            messages.extend(decode_messages(data[pos + 4 : pos + 4 + size]))
+            pos += 4 + size
+        return messages
+
+    address, pos = read_string(data, 0)
+    if pos >= len(data):
+        return [(address, [])]
+    tags, pos = read_string(data, pos)
+
+    args = []
+    for tag in tags[1:]:
+        if tag == "i":
+            args.append(struct.unpack(">i", data[pos : pos + 4])[0])
+            pos += 4
+        elif tag == "f":
+            args.append(struct.unpack(">f", data[pos : pos + 4])[0])
+            pos += 4
+        elif tag == "s":
+            value, pos = read_string(data, pos)
+            args.append(value)
+        elif tag == "T":
+            args.append(True)
+        elif tag == "F":
+            args.append(False)
+        else:
+            raise ValueError(f"unsupported osc type '{tag}'")
+    return [(address, args)]
+
+
+# -------------------- the server --------------------
+
+
+class ControlProtocol(asyncio.DatagramProtocol):
+    def __init__(self, server):
+        self.server = server
+
+    def connection_made(self, transport):
+        self.server.transport = transport
+
+    def datagram_received(self, data, addr):
+        try:
+            messages = decode_messages(data)
+        except Exception as e:
+            log.warning("Bad osc packet from %s: %s", addr, e)
+            return
+        for address, args in messages:
+            try:
+                self.server.handle(address, args, addr)
+            except Exception as e:
+                log.error("Control error on %s: %s", address, e)
+
+
+class ControlServer(threading.Thread):
+    def __init__(self, session, host=None, port=None):
+        super().__init__()
+        self.daemon = True
+        self.name = "control"
+        self.session = session
+        self.host = host or CONTROL_HOST
+        self.port = CONTROL_PORT if port is None else port
+        self.loop = None
+        self.transport = None
+        self.ready = threading.Event()
+        self.subscribers = set()
+        self.sent = {}  # address -> last args sent, so only changes go out
+        self.pending = {}  # master bpm/key sent before anything was loaded
+        # loads and retunes, in the order they came in
+        self.worker = ThreadPoolExecutor(max_workers=1, thread_name_prefix="control")
+
+    def run(self):
+        self.loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self.loop)
+        try:
+            self.loop.run_until_complete(
+                self.loop.create_datagram_endpoint(
+                    lambda: ControlProtocol(self), local_addr=(self.host, self.port)
+                )
+            )
+        except OSError as e:
+            log.error(
+                "Control server could not listen on %s:%d: %s", self.host, self.port, e
+            )
+            self.ready.set()
+            return
+        # port 0 picks a free one
+        self.port = self.transport.get_extra_info("sockname")[1]
+        log.info("Control server listening on %s:%d.", self.host, self.port)
+        self.ready.set()
+        watcher = self.loop.create_task(self.watch_state())
+        self.loop.run_forever()
+
+        # stopped, let the watcher finish cancelling before the loop goes away
+        watcher.cancel()
+        try:
+            self.loop.run_until_complete(watcher)
+        except asyncio.CancelledError:
+            pass
+        self.transport.close()
+        self.loop.close()
+
+    def stop(self):
+        if self.loop is not None and self.loop.is_running():
+            self.loop.call_soon_threadsafe(self.loop.stop)
+            self.join(1.0)
+        self.worker.shutdown(wait=False, cancel_futures=True)
+
+    def send(self, addr, address, *args):
+        if self.transport is not None:
+            self.transport.sendto(encode_message(address, *args), addr)
+
+    # -------------------- incoming --------------------
+
+    def handle(self, address, args, addr):
+        parts = address.strip("/").split("/")
+        if not parts or parts[0] != "jam":
+            return
+        parts = parts[1:]
+
+        if parts[:1] == ["slot"] and len(parts) == 3:
+            i = self.slot_index(parts[1])
+            if i is None:
+                self.error(
+                    addr,
+                    f"No slot {parts[1]}, slots are 0-{len(self.session.slots) - 1}.",
+                )
+                return
+            self.slot_command(i, parts[2], args)
+        elif parts[:1] == ["master"] and len(parts) == 2:
+            self.master_command(parts[1], args)
+        elif parts[:1] == ["transport"] and len(parts) == 2:
+            self.transport_command(parts[1])
+        elif parts[:1] == ["record"] and len(parts) == 2:
+            self.record_command(parts[1], args)
+        elif parts == ["subscribe"]:
+            self.subscribers.add(self.reply_addr(addr, args))
+            self.send_state(self.reply_addr(addr, args))
+        elif parts == ["unsubscribe"]:
+            self.subscribers.discard(self.reply_addr(addr, args))
+        elif parts == ["state"]:
+            self.send_state(addr)
+        elif parts == ["memory"]:
+            self.send(addr, "/jam/memory", memory.report_json(self.session))
+        else:
+            log.warning("Unknown control address: %s", address)
+
+    def slot_index(self, text):
+        # None unless its one of the slots, -1 is not the last one
+        try:
+            i = int(text)
+        except ValueError:
+            return None
+        return i if 0 <= i < len(self.session.slots) else None
+
+    def error(self, addr, message):
+        log.warning("Control: %s", message)
+        self.send(addr, "/jam/error", message)
+
+    def reply_addr(self, addr, args):
+        return (addr[0], int(args[0])) if args else addr
+
+    def slot_command(self, i, command, args):
+        session = self.session
+        slot = session.slots[i]
+        engine = session.engine
+
+        if command == "load":
+            song = find_song(args[0]) or args[0]
+            profile = args[2] if len(args) > 2 else None
+            self.worker.submit(
+                self.guarded, session.add_stem_to_slot, i, song, args[1], profile
+            )
+        elif command == "clear":
+            self.worker.submit(self.guarded, session.clear_slot, i)
+        elif command == "volume":
+            volume = max(0.0, min(1.0, float(args[0])))
+
+            def set_volume():
+                # target too or the ui would glide it back
+                slot.volume = slot.target_volume = volume
+
+            engine.post(set_volume)
+        elif command == "mute":
+            engine.post(lambda: setattr(slot, "mute", bool(args[0])))
+        elif command == "solo":
+
+            def set_solo():
+                # one solo at a time, same as clicking S
+                if args[0]:
+                    for s in session.slots:
+                        s.solo = False
+                slot.solo = bool(args[0])
+
+            engine.post(set_solo)
+        elif command == "half":
+            engine.post(lambda: setattr(slot, "half", 1 if args[0] else 0))
+        else:
+            log.warning("Unknown slot command: %s", command)
+
+    def master_command(self, command, args):
+        session = self.session
+        if command == "volume":
+            volume = max(0.0, min(1.0, float(args[0])))
+            session.engine.post(
+                lambda: setattr(session.engine, "master_volume", volume)
+            )
+        elif command == "bpm":
+            self.worker.submit(self.guarded, self.retune, None, None, float(args[0]))
+        elif command == "key":
+            if args[0] not in KEY_TO_INT:
+                log.warning("Unknown key: %s", args[0])
+                return
+            scale = args[1] if len(args) > 1 else None
+            self.worker.submit(self.guarded, self.retune, args[0], scale, None)
+        else:
+            log.warning("Unknown master command: %s", command)
+
+    def retune(self, key, scale, bpm):
+        session = self.session
+        if session.master_bpm is None:
+            # nothing loaded yet, once theres a bpm and a key it becomes the tuning
+            # the first stem fits to
+            if key:
+                self.pending["key"] = key
+                self.pending["scale"] = scale or self.pending.get("scale", "major")
+            if bpm:
+                self.pending["bpm"] = bpm
+            if "key" in self.pending and "bpm" in self.pending:
+                session.master_key = self.pending["key"]
+                session.master_scale = self.pending["scale"]
+                session.master_bpm = self.pending.pop("bpm")
+                self.pending = {}
+            return
+        session.retune(key or session.master_key, scale or session.master_scale, bpm)
+
+    def transport_command(self, command):
+        engine = self.session.engine
+        if command == "play":
+            if not engine.is_playing():
+                self.worker.submit(self.guarded, engine.start)
+        elif command == "pause":
+            if engine.is_playing():
+                self.worker.submit(self.guarded, engine.stop)
+        elif command == "toggle":
+            self.worker.submit(self.guarded, self.session.toggle_playback)
+        elif command == "restart":
+            engine.post(lambda: setattr(engine, "position", 0))
+            if not engine.is_playing():
+                self.worker.submit(self.guarded, engine.start)
+        else:
+            log.warning("Unknown transport command: %s", command)
+
+    def record_command(self, command, args):
+        if command == "start":
+            if self.session.engine.recorder is None:
+                record.start(self.session)
+        elif command == "stop":
+            recording = record.stop(self.session)
+            if recording is not None and recording.frames:
+                filename = args[0] if args else "performance.wav"
+                record.render_in_background(recording, filename)
+        else:
+            log.warning("Unknown record command: %s", command)
+
+    def guarded(self, fn, *args):
+        try:
+            fn(*args)
+        except Exception as e:
+            log.error("Control command failed: %s", e)
+
+    # -------------------- outgoing --------------------
+
+    def state(self):
+        # address -> args for everything subscribers get told about
+        session = self.session
+        state = {}
+        for slot in session.slots:
+            status = session.load_status.get(slot.idx) or slot.tier or ""
+            if slot.join_stem is not None:
+                status = "joining"
+            state[f"/jam/slot/{slot.idx}"] = (
+                slot.song_name or "",
+                slot.type or "",
+                float(slot.target_volume),
+                int(slot.mute),
+                int(slot.solo),
+                int(slot.half),
+                "empty" if slot.empty and not status else status,
+            )
+        state["/jam/master"] = (
+            float(session.master_bpm or 0.0),
+            session.master_key or "",
+            session.master_scale or "",
+            float(session.engine.master_volume),
+            int(session.engine.is_playing()),
+        )
+        return state
+
+    def send_state(self, addr):
+        for address, args in self.state().items():
+            self.send(addr, address, *args)
+
+    async def watch_state(self):
+        while True:
+            await asyncio.sleep(STATE_INTERVAL)
+            if not self.subscribers:
+                self.sent = {}
+                continue
+            for address, args in self.state().items():
+                if self.sent.get(address) == args:
+                    continue
+                self.sent[address] = args
+                for addr in list(self.subscribers):
+                    self.send(addr, address, *args)
+
+
+def start_server(session, host=None, port=None):
+    server = ControlServer(session, host, port)
+    server.start()
+    server.ready.wait(2.0)
+    return server
+
+
+# -------------------- the little client --------------------
+
+
+def parse_arg(text):
+    for kind in (int, float):
+        try:
+            return kind(text)
+        except ValueError:
+            pass
+    return text
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        prog="python -m jamstudio.control",
+        description="Send one osc message to a running jam and print what comes back.",
+    )
+    parser.add_argument("address", help="e.g. /jam/slot/0/volume")
+    parser.add_argument("args", nargs="*", help="ints, floats or strings")
+    parser.add_argument("--host", default=CONTROL_HOST)
+    parser.add_argument("--port", type=int, default=CONTROL_PORT)
+    parser.add_argument(
+        "--listen", type=float, default=0.5, help="seconds to wait for replies"
+    )
+    args = parser.parse_args(argv)
+
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    sock.settimeout(args.listen)
+    sock.sendto(
+        encode_message(args.address, *[parse_arg(a) for a in args.args]),
+        (args.host, args.port),
+    )
+    try:
+        while True:
+            data, _ = sock.recvfrom(65536)
+            for address, values in decode_messages(data):
+                print(address, *values)
+    except socket.timeout:
+        pass
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,184 @@
+# cue: hear a stem before loading it, straight off the disk
+#
+# a Cue streams the source ogg as it is, no stretch and no shift, only converted to
+# the engine rate (linear, its just for listening). a thread of its own reads it in
+# BLOCK_FRAMES pieces with soundfile and keeps about QUEUE_FRAMES queued, the mixer
+# takes what each block needs (engine.cue) and adds it to the mix at CUE_GAIN.
+# the file loops. nothing gets decoded up front so it starts as soon as the first
+# piece is read, and the queue is all it holds in memory
+#
+# its a listening aid, recordings (record.py) and exports dont have it
+
+import collections
+import logging
+import os
+import threading
+import time
+
+import numpy as np
+import soundfile as sf
+
+from . import loudness, trace
+from .engine import CHANNELS
+from .session import pick_stem_file
+
+log = logging.getLogger(__name__)
+
+# set from config.json "cue_gain", on top of the stems loudness match (if its known)
+CUE_GAIN = 0.5
+
+BLOCK_FRAMES = 4096
+QUEUE_FRAMES = 4 * BLOCK_FRAMES
+# how long a full queue sleeps before it looks again, the mixer wakes it early
+WAIT_SECONDS = 0.1
+
+
+class Cue(threading.Thread):
+    def __init__(self, path, samplerate, gain=1.0):
+        super().__init__(name="cue", daemon=True)
+        self.path = path
+        self.sr = samplerate
+        self.gain = np.float32(gain)
+        self.chunks = collections.deque()
+        # one writer each, so neither needs a lock
+        self.written = 0  # reader
+        self.consumed = 0  # mixer
+        self.wake = threading.Event()
+        self.stopping = False
+        self.chunk = None
+        self.chunk_pos = 0
+        self.underruns = 0
+        self.started = time.perf_counter()
+        self.first_audio = None  # seconds from start to the first piece queued
+        # streaming resample state
+        self.src_rate = None
+        self.tail = None
+        self.phase = 0.0
+
+    def run(self):
+        try:
+            with trace.span("cue", path=os.path.basename(self.path)):
+                self.stream()
+        except Exception as e:
+            log.warning(
+                "Could not cue %s: %s",
+                os.path.basename(self.path),
+                e,
+                extra={"path": self.path},
+            )
+
+    def stream(self):
+        with sf.SoundFile(self.path) as f:
+            if not f.frames:
+                return
+            self.src_rate = f.samplerate
+            while not self.stopping:
+                self.wake.clear()
+                if self.written - self.consumed >= QUEUE_FRAMES:
+                    self.wake.wait(WAIT_SECONDS)
+                    continue
+                block = f.read(BLOCK_FRAMES, dtype="float32", always_2d=True)
+                if len(block) < BLOCK_FRAMES:
+                    f.seek(0)
+                    if not len(block):
+                        continue
+                if block.shape[1] == 1:
+                    block = np.repeat(block, CHANNELS, axis=1)
+                elif block.shape[1] > CHANNELS:
+                    block = block[:, :CHANNELS]
+                if self.src_rate != self.sr:
+                    block = self.convert(block)
+                block *= self.gain
+                self.chunks.append(block)
+                self.written += len(block)
+                if self.first_audio is None:
+                    self.first_audio = time.perf_counter() - self.started
+
+    def convert(self, block):
+        # linear, the last frame and how far past it the next one falls carry over
+        # to the next block so the pieces join up
+        data = block if self.tail is None else np.concatenate((self.tail, block))
+        step = self.src_rate / self.sr
+        pos = np.arange(self.phase, len(data) - 1, step)
+        self.tail = data[-1:]
+        if not len(pos):
+            self.phase -= len(data) - 1
+            return data[:0].copy()
+        self.phase = pos[-1] + step - (len(data) - 1)
+        i = pos.astype(np.int64)
+        frac = (pos - i).astype(np.float32)[:, None]
+        return data[i] * (1 - frac) + data[i + 1] * frac
+
+    def mix_into(self, mix, frames):
+        # called from the mixer: adds the next frames to mix, never waits. once
+        # stopped it fades out over this block and returns False
+        done = 0
+        while done < frames:
+            if self.chunk is None:
+                if not self.chunks:
+                    if self.first_audio is not None and not self.stopping:
+                        self.underruns += 1
+                    break
+                self.chunk = self.chunks.popleft()
+                self.chunk_pos = 0
+            n = min(frames - done, len(self.chunk) - self.chunk_pos)
+            piece = self.chunk[self.chunk_pos : self.chunk_pos + n]
+            if self.stopping:
+                ramp = np.linspace(1.0, 0.0, frames, dtype=np.float32)
+                piece = piece * ramp[done : done + n, None]
+            mix[done : done + n] += piece
+            done += n
+            self.chunk_pos += n
+            if self.chunk_pos == len(self.chunk):
+                self.chunk = None
+        self.consumed += done
+        self.wake.set()
+        return not self.stopping
+
+    def stop(self):
+        self.stopping = True
+        self.wake.set()
+
+
+def start(session, song_folder, stem_type):
+    # cues the file a load would pick right now, stops whatever was cued before.
+    # returns the Cue, None if the song has no file for stem_type
+    name, _ = pick_stem_file(song_folder, stem_type, session.master_scale)
+    if name is None:
+        log.warning("No %s file to cue in %s.", stem_type, song_folder)
+        return None
+    path = os.path.join(song_folder, name)
+    gain = CUE_GAIN
+    try:
+        # only if its been measured already, a cue never waits on a scan
+        entry = loudness.cached_loudness(path)
+        if entry is not None:
+            gain *= loudness.gain_for(entry)
+    except OSError:
+        pass
+
+    engine = session.engine
+    cue = Cue(path, engine.sr, gain)
+    cue.start()
+
+    def swap():
+        # on a block boundary, the one playing before just gets cut
+        if engine.cue is not None:
+            engine.cue.stop()
+        engine.cue = cue
+
+    # engine.cue only ever changes in the mixer (or with it stopped)
+    engine.post(swap)
+    log.info("Cueing %s.", os.path.basename(path), extra={"path": path})
+    return cue
+
+
+def stop(session):
+    # fades out over the next block
+    engine = session.engine
+
+    def stop_cue():
+        if engine.cue is not None:
+            engine.cue.stop()
+
+    engine.post(stop_cue)
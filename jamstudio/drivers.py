@@ -0,0 +1,243 @@
+# where the engines output goes. "sounddevice" is the sound card, "null" runs the
+# callback off a clock (real time or as fast as it can) with no hardware at all,
+# keeps what came out in memory or a wav and can fake late callbacks, for testing
+# and benchmarking the mixer
+#
+#   python -m jamstudio.drivers "Song Name" --seconds 60 --out mix.wav
+#
+# plays a song through the null driver flat out and prints how fast the mixer went
+
+import argparse
+import logging
+import threading
+import time
+
+import numpy as np
+import soundfile as sf
+
+from . import logs
+
+log = logging.getLogger(__name__)
+
+# set from config.json "output_driver"
+OUTPUT_DRIVER = "sounddevice"
+
+
+def sounddevice_stream(samplerate, channels, blocksize, callback, **options):
+    import sounddevice as sd
+
+    return sd.OutputStream(
+        samplerate=samplerate,
+        channels=channels,
+        blocksize=blocksize,
+        dtype="float32",
+        callback=callback,
+        **options,
+    )
+
+
+class NullStream:
+    # same start/stop/close/active as a sounddevice stream
+    #   realtime  pace blocks at the sample rate, False runs them back to back
+    #   capture   True keeps every block in memory (see captured()), a path writes a wav
+    #   late_every/late_by  every nth block shows up late_by seconds late with an
+    #             underflow status, like a real card would report it
+    #   max_blocks  stops by itself after this many blocks
+    #   latency   taken so the engine can pass the same options to any driver,
+    #             theres no device buffer so its not used
+    def __init__(
+        self,
+        samplerate,
+        channels,
+        blocksize,
+        callback,
+        realtime=True,
+        capture=None,
+        late_every=0,
+        late_by=0.0,
+        max_blocks=None,
+        latency=None,
+    ):
+        self.samplerate = samplerate
+        self.channels = channels
+        self.blocksize = blocksize
+        self.callback = callback
+        self.realtime = realtime
+        self.capture = capture
+        self.late_every = late_every
+        self.late_by = late_by
+        self.max_blocks = max_blocks
+        self.latency = latency
+
+        self.active = False
+        self.thread = None
+        self.blocks = 0
+        self.late = 0
+        self.timings = []  # seconds each callback took
+        self.chunks = []
+        self.wav = None
+        self.outdata = np.zeros((blocksize, channels), np.float32)
+
+    def start(self):
+        if isinstance(self.capture, str):
+            self.wav = sf.SoundFile(
+                self.capture, "w", self.samplerate, self.channels, "FLOAT"
+            )
+        self.active = True
+        self.thread = threading.Thread(target=self.run, name="null-audio", daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        self.active = False
+        if self.thread is not None and self.thread is not threading.current_thread():
+            self.thread.join()
+        self.thread = None
+
+    def close(self):
+        if self.wav is not None:
+            self.wav.close()
+            self.wav = None
+
+    def run_block(self):
+        # one callback, also usable straight from a test without start()
+        status = None
+        if self.late_every and (self.blocks + 1) % self.late_every == 0:
+            if self.realtime:
+                time.sleep(self.late_by)
+            status = "output underflow"
+            self.late += 1
+
+        out = self.outdata
+        out.fill(0)
+        t0 = time.perf_counter()
+        self.callback(out, self.blocksize, None, status)
+        self.timings.append(time.perf_counter() - t0)
+        self.blocks += 1
+
+        if self.capture is True:
+            self.chunks.append(out.copy())
+        elif self.wav is not None:
+            self.wav.write(out)
+
+    def run(self):
+        period = self.blocksize / self.samplerate
+        next_time = time.perf_counter()
+        while self.active:
+            if self.max_blocks is not None and self.blocks >= self.max_blocks:
+                self.active = False
+                break
+            self.run_block()
+            if self.realtime:
+                next_time += period
+                wait = next_time - time.perf_counter()
+                if wait > 0:
+                    time.sleep(wait)
+                else:
+                    # fell behind, dont try to catch up with a burst
+                    next_time = time.perf_counter()
+
+    def wait(self, timeout=None):
+        # until max_blocks is reached (or stop)
+        if self.thread is not None:
+            self.thread.join(timeout)
+
+    def captured(self):
+        if not self.chunks:
+            return np.zeros((0, self.channels), np.float32)
+        return np.concatenate(self.chunks)
+
+
+def native_rate(driver=None):
+    # the rate the output device runs at by itself, None if theres no device to ask
+    if (driver or OUTPUT_DRIVER) != "sounddevice":
+        return None
+    try:
+        import sounddevice as sd
+
+        return int(sd.query_devices(kind="output")["default_samplerate"])
+    except Exception as e:
+        log.warning("Could not ask the output device for its sample rate: %s", e)
+        return None
+
+
+DRIVERS = {
+    "sounddevice": sounddevice_stream,
+    "null": NullStream,
+}
+DRIVER_CHOICES = list(DRIVERS)
+
+
+def open_stream(samplerate, channels, blocksize, callback, driver=None, **options):
+    return DRIVERS[driver or OUTPUT_DRIVER](
+        samplerate, channels, blocksize, callback, **options
+    )
+
+
+def timing_summary(stream):
+    t = np.array(stream.timings) * 1000
+    period = stream.blocksize / stream.samplerate * 1000
+    return (
+        f"{stream.blocks} blocks, callback mean {t.mean():.3f} ms, "
+        f"p99 {np.percentile(t, 99):.3f} ms, max {t.max():.3f} ms "
+        f"({t.mean() / period * 100:.1f}% of the {period:.1f} ms block)"
+    )
+
+
+def main(argv=None):
+    from .library import find_song
+    from .session import JamSession
+
+    parser = argparse.ArgumentParser(
+        prog="python -m jamstudio.drivers",
+        description="Play a song through the null driver and time the mixer.",
+    )
+    parser.add_argument("song", help="song folder name")
+    parser.add_argument(
+        "--stems", nargs="+", default=["drums", "bass", "vocals", "lead"]
+    )
+    parser.add_argument("--seconds", type=float, default=60.0)
+    parser.add_argument("--realtime", action="store_true")
+    parser.add_argument("--blocksize", type=int, help="default is engine.BUFFER_SIZE")
+    parser.add_argument("--out", help="write what came out to this wav")
+    args = parser.parse_args(argv)
+    # the cli prints its own report, logs.setup() is for what the modules say
+    logs.setup()
+
+    folder = find_song(args.song)
+    if not folder:
+        print(f"'{args.song}' not found.")
+        return
+
+    session = JamSession()
+    for i, stem_type in enumerate(args.stems):
+        session.add_stem_to_slot(i, folder, stem_type)
+    session.finish_renders()
+
+    engine = session.engine
+    if args.blocksize:
+        engine.blocksize = args.blocksize
+    blocks = int(args.seconds * engine.sr / engine.blocksize)
+    engine.driver = "null"
+    engine.driver_options = {
+        "realtime": args.realtime,
+        "capture": args.out,
+        "max_blocks": blocks,
+    }
+
+    t0 = time.perf_counter()
+    engine.start()
+    engine.stream.wait()
+    wall = time.perf_counter() - t0
+    stream = engine.stream
+    engine.stop()
+
+    print(timing_summary(stream))
+    print(
+        f"{args.seconds:.0f} s of audio in {wall:.2f} s, {args.seconds / wall:.1f}x real time."
+    )
+    if args.out:
+        print(f"Written to: {args.out}")
+
+
+if __name__ == "__main__":
+    main()
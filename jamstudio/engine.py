@@ -0,0 +1,420 @@
+# the realtime side: slots, the mixer and the output stream
+# sounddevice only gets imported when the stream actually opens, see drivers.py
+
+import collections
+import logging
+import math
+import threading
+from time import perf_counter
+
+import numpy as np
+
+from . import drivers
+from .logs import rt_log
+
+log = logging.getLogger(__name__)
+
+# the rate the engine runs at. main.py sets it at startup from RATE_SETTING, every
+# source gets converted to it once when its decoded (see library.load_audio_data)
+SAMPLE_RATE = 44100
+# set from config.json "sample_rate", "native" is whatever the output device runs at
+RATE_SETTING = "native"
+BUFFER_SIZE = 2048
+CHANNELS = 2
+
+# how processed stems are kept in memory
+# "float16" halves the memory, "int16" halves it too but with a fixed step size
+STEM_STORAGE = "float32"
+STORAGE_CHOICES = ["float32", "float16", "int16"]
+
+# how many blocks of levels the meter ring keeps, a few seconds at BUFFER_SIZE
+METER_BLOCKS = 128
+# how many callback durations are kept for the headroom numbers, see latency.py
+TIMING_BLOCKS = 512
+
+
+def valid_rate_setting(value):
+    # what config.json "sample_rate" can be, "native" or a whole number of Hz
+    if value == "native":
+        return True
+    return isinstance(value, int) and not isinstance(value, bool) and value > 0
+
+
+class PackedStem:
+    # a stem as its kept in memory, float32 or squashed down to float16/int16
+    # with a per stem scale. the mixer only ever dequantizes the bit it plays
+    def __init__(self, data, scale=1.0):
+        self.data = data
+        self.scale = np.float32(scale)
+        self.data.flags.writeable = False
+        self.peaks = None  # for drawing, see waveform.py
+
+    def __len__(self):
+        return len(self.data)
+
+    @property
+    def nbytes(self):
+        return self.data.nbytes
+
+    def read_into(self, start, stop, out):
+        src = self.data[start:stop]
+        if self.scale == 1.0:
+            out[:] = src
+        else:
+            np.multiply(src, self.scale, out=out, casting="unsafe")
+
+    def to_array(self):
+        if self.data.dtype == np.float32 and self.scale == 1.0:
+            return self.data
+        return self.data.astype(np.float32) * self.scale
+
+
+def pack_stem(audio, mode=None):
+    mode = mode or STEM_STORAGE
+    if mode == "int16":
+        peak = float(np.max(np.abs(audio))) if len(audio) else 0.0
+        scale = peak / 32767 if peak else 1.0
+        data = np.round(audio / scale).astype(np.int16)
+        return PackedStem(data, scale)
+    if mode == "float16":
+        return PackedStem(audio.astype(np.float16))
+    return PackedStem(np.ascontiguousarray(audio, dtype=np.float32))
+
+
+class MeterRing:
+    # levels for every block the callback mixes, rms and peak per column
+    # (one per slot, then master left/right). the callback is the only writer and
+    # fills a row before bumping count, so the ui can read without a lock
+    def __init__(self, columns, size=METER_BLOCKS):
+        self.rows = np.zeros((size, columns, 2), np.float32)
+        self.count = 0
+
+    def next_row(self):
+        row = self.rows[self.count % len(self.rows)]
+        row.fill(0)
+        return row
+
+    def publish(self):
+        self.count += 1
+
+    def read(self, since):
+        # (rows written after since, oldest first, and the count to pass next time)
+        count = self.count
+        n = min(count - since, len(self.rows) - 1)
+        if n <= 0:
+            return self.rows[:0], count
+        idx = np.arange(count - n, count) % len(self.rows)
+        return self.rows[idx], count
+
+
+class Slot(threading.Thread):
+    def __init__(self, idx):
+        super().__init__()
+        self.idx = idx
+        self.daemon = True  # ensure thread dies when app closes
+
+        # audio state
+        self.empty = True
+        self.stem = None
+        self.song_name = None
+        self.type = None
+        self.key = None
+        self.scale = None
+        self.bpm = None
+        self.profile = None
+        self.volume = 1.0
+        self.target_volume = 1.0
+        # loudness match for the file the stem came from, on top of volume
+        self.gain = 1.0
+        self.offset = 0
+        self.half = 0
+        self.mute = False
+        self.solo = False
+
+        # progressive loading, a cheap preview plays right away and the hq render
+        # gets swapped in at the loop point once its done
+        self.tier = None  # "preview" or "hq"
+        self.pending_stem = None
+        self.render_cancel = None
+        self.render_future = None
+        self.pool_key = None
+        self.plan_key = None  # the transform the slot is (or will be) playing
+        # a stem loaded while the jam plays waits here and comes in on the next
+        # loop boundary so it starts on the one
+        self.join_stem = None
+
+        # thread synchronization
+        self.start_event = threading.Event()
+        self.done_event = threading.Event()
+        self.output_buffer = None
+        self.scratch = None
+
+        self.req_pos = 0
+        self.req_frames = 0
+        self.req_channels = 2
+        self.req_loop = 0
+
+    def run(self):
+        while True:
+            self.start_event.wait()
+            self.start_event.clear()
+
+            self.process_audio()
+
+            self.done_event.set()
+
+    def process_audio(self):
+        # the block gets built in a reused scratch buffer, only the slice we
+        # actually play gets dequantized
+        frames = self.req_frames
+        out = self.scratch
+        if out is None or out.shape != (frames, self.req_channels):
+            out = self.scratch = np.zeros((frames, self.req_channels), np.float32)
+        self.output_buffer = out
+
+        boundary = 0
+        # read once, drop_slot_stem can clear it from another thread meanwhile
+        join = self.join_stem
+        if self.empty and join is not None:
+            boundary = self.req_loop - self.req_pos
+            if boundary < frames:
+                self.stem = join
+                self.join_stem = None
+                self.empty = False
+
+        stem = self.stem
+        if self.empty or stem is None or len(stem) == 0:
+            # silence mega mayhem
+            out.fill(0)
+            return
+
+        length = len(stem)
+        current_offset = (length // 2) if self.half == 1 else 0
+        offset_pos = (self.req_pos + current_offset) % length
+
+        end = offset_pos + frames
+
+        if end <= length:
+            stem.read_into(offset_pos, end, out)
+        else:
+            split = length - offset_pos
+            stem.read_into(offset_pos, length, out[:split])
+            # loop point, if the hq render is ready it starts right here
+            pending = self.pending_stem
+            if pending is not None:
+                self.pending_stem = None
+                self.stem = stem = pending
+                self.tier = "hq"
+            wrap = min(end - length, len(stem))
+            stem.read_into(0, wrap, out[split : split + wrap])
+            out[split + wrap :] = 0
+
+        if boundary > 0:
+            # just joined, nothing before the loop point
+            out[:boundary] = 0
+
+        out *= self.volume * self.gain
+
+
+class AudioEngine:
+    def __init__(self, slots, samplerate=None):
+        self.slots = slots
+        self.sr = samplerate or SAMPLE_RATE
+        self.position = 0
+        self.max_length = 0
+        self.stream = None
+        self.master_volume = 1.0
+        self.meters = MeterRing(len(slots) + CHANNELS)
+        # mixer changes from other threads (see control.py), applied at the start
+        # of the next block so they land together and never mid block
+        self.commands = collections.deque()
+        # None is drivers.OUTPUT_DRIVER, options go to the driver as is
+        self.driver = None
+        self.driver_options = {}
+        # latency.py changes these through reopen(), None latency is the device default
+        self.blocksize = BUFFER_SIZE
+        self.latency = None
+        # underflows the card reported and how long each callback took
+        self.xruns = 0
+        self.timings = np.zeros(TIMING_BLOCKS)
+        self.timing_count = 0
+        # sees every block when a performance is being recorded, see record.py
+        self.recorder = None
+        # a file being auditioned on top of the mix, see cue.py
+        self.cue = None
+
+    def update_max_length(self):
+        lengths = [
+            len(s.stem) for s in self.slots if not s.empty and s.stem is not None
+        ]
+        self.max_length = max(lengths) if lengths else 0
+
+    def post(self, command):
+        # command is a no argument callable, run right away if nothing is playing
+        if self.is_playing():
+            self.commands.append(command)
+        else:
+            command()
+
+    def run_commands(self):
+        while self.commands:
+            try:
+                self.commands.popleft()()
+            except Exception as e:
+                rt_log(logging.ERROR, "Mixer command failed: %s", e)
+
+    def audio_callback(self, outdata, frames, time, status):
+        t0 = perf_counter()
+        if status:
+            # never print in here, a slow console would hold up the card
+            rt_log(logging.WARNING, "Audio callback status: %s", status)
+            self.xruns += 1
+
+        self.mix_block(outdata, frames)
+
+        self.timings[self.timing_count % TIMING_BLOCKS] = perf_counter() - t0
+        self.timing_count += 1
+
+    def callback_timings(self):
+        # seconds per callback, the last TIMING_BLOCKS of them in no particular order.
+        # the first couple after a start are slow (scratch buffers get made), skip them
+        if self.timing_count <= TIMING_BLOCKS:
+            return self.timings[2 : self.timing_count].copy()
+        return self.timings.copy()
+
+    def mix_block(self, outdata, frames):
+        self.run_commands()
+        recorder = self.recorder
+        if recorder is not None:
+            recorder.block(self, frames)
+
+        active_lengths = [
+            len(s.stem) for s in self.slots if not s.empty and s.stem is not None
+        ]
+        self.max_length = max(active_lengths) if active_lengths else 0
+
+        if self.max_length == 0:
+            outdata.fill(0)
+            self.meters.next_row()
+            self.meters.publish()
+            if self.cue is not None:
+                self.mix_cue(outdata, frames)
+                outdata *= self.master_volume
+                np.clip(outdata, -1.0, 1.0, out=outdata)
+            if recorder is not None:
+                recorder.done(self)
+            return
+
+        self.position %= self.max_length
+
+        for slot in self.slots:
+            slot.req_pos = self.position
+            slot.req_frames = frames
+            slot.req_channels = CHANNELS
+            slot.req_loop = self.max_length
+            slot.start_event.set()
+
+        for slot in self.slots:
+            slot.done_event.wait()
+            slot.done_event.clear()
+
+        mix = np.zeros((frames, CHANNELS), dtype=np.float32)
+        levels = self.meters.next_row()
+
+        any_solo = any(s.solo for s in self.slots if not s.empty)
+
+        for i, slot in enumerate(self.slots):
+            if slot.empty:
+                continue
+
+            should_play = False
+            if any_solo:
+                if slot.solo:
+                    should_play = True
+            else:
+                if not slot.mute:
+                    should_play = True
+
+            if should_play:
+                buf = slot.output_buffer
+                mix += buf
+                flat = buf.reshape(-1)
+                levels[i] = (
+                    math.sqrt(float(np.dot(flat, flat)) / len(flat)),
+                    max(float(flat.max()), -float(flat.min())),
+                )
+
+        # on top of the slots, through the master volume like them
+        if self.cue is not None:
+            self.mix_cue(mix, frames)
+
+        mix *= self.master_volume
+
+        # master before the clip so anything over 1.0 shows up as clipping
+        # (per column reductions, numpy is a lot slower reducing over axis 0 here)
+        for ch in range(CHANNELS):
+            col = mix[:, ch]
+            levels[len(self.slots) + ch] = (
+                math.sqrt(float(np.dot(col, col)) / frames),
+                max(float(col.max()), -float(col.min())),
+            )
+        self.meters.publish()
+
+        outdata[:] = np.clip(mix, -1.0, 1.0)
+
+        self.position += frames
+        self.position %= self.max_length
+        if recorder is not None:
+            recorder.done(self)
+
+    def mix_cue(self, mix, frames):
+        # drops the cue once its faded out after a stop
+        if not self.cue.mix_into(mix, frames):
+            self.cue = None
+
+    def is_playing(self):
+        return self.stream is not None and self.stream.active
+
+    def restart(self):
+        self.position = 0
+        if self.stream is None or not self.stream.active:
+            self.start()
+
+    def start(self):
+        # one stream at a time, a second one would run the mixer twice per block
+        if self.is_playing():
+            return
+        self.update_max_length()
+        options = dict(self.driver_options)
+        if self.latency is not None:
+            options.setdefault("latency", self.latency)
+        self.timing_count = 0
+        self.stream = drivers.open_stream(
+            self.sr,
+            CHANNELS,
+            self.blocksize,
+            self.audio_callback,
+            self.driver,
+            **options,
+        )
+        self.stream.start()
+        log.info("Audio engine started.")
+
+    def reopen(self, blocksize, latency=None):
+        # new block size, the stream gets restarted if its running. the position
+        # carries on so the jam just skips a beat
+        playing = self.is_playing()
+        if playing:
+            self.stop()
+        self.blocksize = blocksize
+        self.latency = latency
+        if playing:
+            self.start()
+
+    def stop(self):
+        if self.stream:
+            self.stream.stop()
+            self.stream.close()
+            log.info("Audio engine stopped.")
+        # anything posted while it was winding down
+        self.run_commands()
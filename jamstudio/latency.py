@@ -0,0 +1,217 @@
+# picks the output block size (and the device latency that goes with it)
+#
+# the live engine keeps how long each callback took, headroom is the share of the
+# block period thats left over at the p99 callback. tune() plays the current slots
+# through a second engine on the null driver at every BLOCK_SIZES entry (paced at
+# real time so it sees about the same cpu the real one does) and picks the smallest
+# one that keeps MIN_HEADROOM. the results are kept per driver/device, so its
+# measured once, not every time someone looks.
+#
+# reopening the stream is a dropout, so it only happens when the user picks a size,
+# when auto gets switched on (the tuned pick) or when the card reports underflows
+# (one size up). the watcher thread only asks for it (pending), the ui thread does it
+# in apply_pending() so it never runs into a stop/start/pause from the ui
+
+import logging
+import threading
+
+import numpy as np
+
+from . import drivers
+from .engine import CHANNELS, AudioEngine, Slot
+
+log = logging.getLogger(__name__)
+
+BLOCK_SIZES = [256, 512, 1024, 2048, 4096]
+
+# set from config.json "latency"
+AUTO_LATENCY = False
+# a block size picked by hand (or the last one auto picked), None is engine.BUFFER_SIZE
+BLOCK_SIZE = None
+
+# share of the block the p99 callback has to leave free
+MIN_HEADROOM = 0.5
+# device latency asked for, in blocks. one more than the block itself so a late
+# callback has a block of slack before it underflows
+LATENCY_BLOCKS = 2
+# how long each block size gets played for in tune()
+BENCH_SECONDS = 0.5
+# how often the watcher looks at underflows
+CHECK_SECONDS = 2.0
+
+
+def device_latency(blocksize, samplerate):
+    return LATENCY_BLOCKS * blocksize / samplerate
+
+
+def headroom(timings, blocksize, samplerate):
+    # (headroom, p99 ms), None if theres nothing measured yet
+    if len(timings) == 0:
+        return None
+    period = blocksize / samplerate
+    p99 = float(np.percentile(timings, 99))
+    return 1.0 - p99 / period, p99 * 1000
+
+
+def pick(results):
+    # smallest block size with enough headroom, the biggest one if none has
+    for blocksize, (room, _) in sorted(results.items()):
+        if room >= MIN_HEADROOM:
+            return blocksize
+    return max(results)
+
+
+class LatencyManager(threading.Thread):
+    def __init__(self, session):
+        super().__init__()
+        self.daemon = True
+        self.name = "latency"
+        self.session = session
+        self.engine = session.engine
+        self.lock = threading.Lock()
+        self.stopped = threading.Event()
+        # blocksize -> (headroom, p99 ms) from the last tune()
+        self.results = {}
+        self.suggested = None
+        self.tuning = False
+        # device_key() -> (results, suggested), see tune()
+        self.tuned = {}
+        # the bench engine gets its own slot threads, made once and reused
+        self.bench_slots = []
+        self.seen_xruns = 0
+        # auto was just switched on (or has nothing saved yet), the watcher picks a size
+        self.auto_pick = AUTO_LATENCY and BLOCK_SIZE is None
+        # block size waiting for the ui thread to apply it
+        self.pending = None
+
+    def live(self):
+        # (headroom, p99 ms) of the running stream
+        engine = self.engine
+        return headroom(engine.callback_timings(), engine.blocksize, engine.sr)
+
+    def bench(self, blocksize):
+        if not self.bench_slots:
+            for i in range(len(self.engine.slots)):
+                slot = Slot(i)
+                slot.start()
+                self.bench_slots.append(slot)
+
+        for bench, slot in zip(self.bench_slots, self.engine.slots):
+            bench.empty = slot.empty or slot.stem is None
+            bench.stem = slot.stem
+            bench.volume = slot.volume
+            bench.gain = slot.gain
+            bench.half = slot.half
+            bench.mute = slot.mute
+            bench.solo = slot.solo
+
+        engine = AudioEngine(self.bench_slots, self.engine.sr)
+        engine.position = self.engine.position
+        stream = drivers.NullStream(
+            engine.sr,
+            CHANNELS,
+            blocksize,
+            engine.audio_callback,
+            max_blocks=max(8, int(BENCH_SECONDS * engine.sr / blocksize)),
+        )
+        stream.start()
+        stream.wait()
+        # the first couple of blocks warm up the scratch buffers
+        return headroom(stream.timings[2:], blocksize, engine.sr)
+
+    def device_key(self):
+        engine = self.engine
+        return (
+            engine.driver or drivers.OUTPUT_DRIVER,
+            engine.driver_options.get("device"),
+            engine.sr,
+        )
+
+    def tune(self):
+        # measures every block size against whats loaded now, returns the pick.
+        # once per driver/device, after that its the same answer
+        key = self.device_key()
+        with self.lock:
+            if key in self.tuned:
+                self.results, self.suggested = self.tuned[key]
+                return self.suggested
+            self.tuning = True
+            try:
+                results = {size: self.bench(size) for size in BLOCK_SIZES}
+            finally:
+                self.tuning = False
+            self.results = results
+            self.suggested = pick(results)
+            self.tuned[key] = (results, self.suggested)
+        log.info(
+            "Latency tune: %s, suggest %d.",
+            ", ".join(f"{s} {r * 100:.0f}%" for s, (r, _) in sorted(results.items())),
+            self.suggested,
+            extra={"headroom": {s: r for s, (r, _) in results.items()}},
+        )
+        return self.suggested
+
+    def tune_async(self):
+        if self.tuning:
+            return
+        if self.device_key() in self.tuned:
+            self.tune()
+            return
+        threading.Thread(target=self.tune, name="latency-tune", daemon=True).start()
+
+    def apply_pending(self):
+        # ui thread, every frame
+        blocksize = self.pending
+        if blocksize is not None:
+            self.pending = None
+            self.apply(blocksize)
+
+    def apply(self, blocksize):
+        # ui thread only, reopening the stream is a short dropout
+        global BLOCK_SIZE
+        BLOCK_SIZE = blocksize
+        engine = self.engine
+        if engine.blocksize != blocksize:
+            engine.reopen(blocksize, device_latency(blocksize, engine.sr))
+            log.info(
+                "Block size %d (%.1f ms).",
+                blocksize,
+                blocksize / engine.sr * 1000,
+                extra={"blocksize": blocksize},
+            )
+
+    def set_auto(self, auto):
+        global AUTO_LATENCY
+        AUTO_LATENCY = auto
+        self.auto_pick = auto
+        if not auto:
+            self.pending = None
+
+    def run(self):
+        while not self.stopped.wait(CHECK_SECONDS):
+            if not AUTO_LATENCY or not self.engine.is_playing():
+                continue
+            try:
+                self.check()
+            except Exception as e:
+                log.error("Latency check failed: %s", e)
+
+    def check(self):
+        engine = self.engine
+        xruns = engine.xruns
+        if xruns > self.seen_xruns and engine.blocksize < BLOCK_SIZES[-1]:
+            # the card is missing blocks, one size up right away
+            bigger = next(s for s in BLOCK_SIZES if s > engine.blocksize)
+            if self.pending is None or self.pending < bigger:
+                log.warning("Underflows at block size %d, going up.", engine.blocksize)
+                self.pending = bigger
+            self.seen_xruns = xruns
+            return
+        self.seen_xruns = xruns
+
+        if self.auto_pick and not self.session.is_loading():
+            self.auto_pick = False
+            self.pending = self.tune()
+
+    def stop(self):
+        self.stopped.set()
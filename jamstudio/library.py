@@ -0,0 +1,125 @@
+# finding songs on disk and reading their audio
+
+import hashlib
+import json
+import logging
+import os
+
+import numpy as np
+import soundfile as sf
+
+from . import engine, memory, trace
+from .music import KEY_TO_INT
+from .stretch import resample_rate
+
+log = logging.getLogger(__name__)
+
+SONG_FOLDERS = ["Songs", "Stock Songs"]
+
+# what a meta.json needs for a song to be used as is, scale defaults to major.
+# anything less and the analysis fills in the rest (see read_meta)
+REQUIRED_META = ("bpm", "key")
+
+
+def get_song_list():
+    all_songs = []
+
+    for folder in SONG_FOLDERS:
+        if not os.path.exists(folder):
+            os.makedirs(folder)
+            continue
+
+        songs = [
+            os.path.join(folder, x)
+            for x in os.listdir(folder)
+            if os.path.isdir(os.path.join(folder, x))
+        ]
+        all_songs.extend(songs)
+
+    all_songs.sort(key=lambda x: os.path.basename(x).lower())
+
+    return all_songs
+
+
+def meta_complete(meta):
+    return all(name in meta for name in REQUIRED_META) and meta["key"] in KEY_TO_INT
+
+
+def stem_files(song_folder):
+    # (stem type, scale) -> file name for the stems a song has, drums are
+    # ("drums", "neutral"). names match in any case ("Vocals_Major.ogg"), loading
+    # and the song index both go through here so they agree on what a song has
+    files = {}
+    for name in sorted(os.listdir(song_folder)):
+        base, ext = os.path.splitext(name.lower())
+        if ext != ".ogg":
+            continue
+        if base == "drums":
+            files.setdefault(("drums", "neutral"), name)
+        elif "_" in base:
+            stem_type, scale = base.rsplit("_", 1)
+            files.setdefault((stem_type, scale), name)
+    return files
+
+
+def read_meta(song_folder):
+    # meta.json wins, anything missing from it comes from the analysis sidecar
+    # (worked out on the spot the first time if theres no sidecar yet)
+    meta = {}
+    try:
+        with open(os.path.join(song_folder, "meta.json"), "r") as f:
+            meta = json.load(f)
+    except FileNotFoundError:
+        pass
+    except Exception as e:
+        log.warning("Bad meta.json in %s: %s", song_folder, e)
+
+    if meta.get("key") not in KEY_TO_INT:
+        meta.pop("key", None)
+    if meta_complete(meta):
+        return meta
+
+    from .analysis import song_analysis
+
+    guessed = song_analysis(song_folder)
+    merged = {
+        "bpm": guessed["bpm"],
+        "key": guessed["key"],
+        "scale": guessed["scale"],
+    }
+    merged.update(meta)
+    if merged["bpm"] is None or merged["key"] is None:
+        raise ValueError(f"Could not work out bpm/key for {song_folder}")
+    return merged
+
+
+def find_song(song_name):
+    for folder in SONG_FOLDERS:
+        potential_path = os.path.join(folder, song_name)
+        if os.path.exists(potential_path):
+            return potential_path
+    return None
+
+
+def load_audio_data(path):
+    with trace.span("decode", path=os.path.basename(path)) as sp:
+        audio, sr = sf.read(path, dtype="float32")
+        if audio.ndim == 1:
+            audio = np.stack([audio, audio], axis=1)
+        sp["bytes"] = audio.nbytes
+    memory.hold("decode", audio.nbytes)
+    if sr != engine.SAMPLE_RATE:
+        # once per decode, from here on it plays at the engine rate like everything else
+        with trace.span("resample", bytes=audio.nbytes, rate=sr):
+            audio = resample_rate(audio, sr, engine.SAMPLE_RATE)
+        memory.hold("resample", audio.nbytes)
+    # no normalizing here, the slot gain from loudness.py sets the level
+    return audio
+
+
+def file_checksum(path):
+    h = hashlib.sha1()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b""):
+            h.update(chunk)
+    return h.hexdigest()
@@ -0,0 +1,171 @@
+# logging for the whole package. every module logs to logging.getLogger(__name__)
+# and setup() points the "jamstudio" logger at a QueueHandler, so the thread doing
+# the logging only puts a record on a queue and a QueueListener thread does the
+# actual writing (the console, and a json lines file if LOG_FILE is set)
+#
+# the audio callback cant even do that (handlers take locks), it calls rt_log()
+# which drops the record into a preallocated ring that a background thread drains
+
+import atexit
+import json
+import logging
+import logging.handlers
+import queue
+import threading
+import time
+
+# set from config.json "log_level" / "log_file"
+LOG_LEVEL = "INFO"
+LOG_FILE = ""
+
+# how many callback records can pile up between drains before new ones get dropped
+RT_RING_SIZE = 256
+RT_DRAIN_SECONDS = 0.05
+
+# everything a LogRecord has on its own, the rest came in through extra=
+RECORD_FIELDS = set(vars(logging.makeLogRecord({}))) | {"message", "asctime"}
+
+logger = logging.getLogger("jamstudio")
+_listener = None
+_drainer = None
+
+
+class ConsoleFormatter(logging.Formatter):
+    # plain message like the old prints, warnings and errors get their level in front
+    def format(self, record):
+        message = super().format(record)
+        if record.levelno >= logging.WARNING:
+            return f"{record.levelname.capitalize()}: {message}"
+        return message
+
+
+class JsonFormatter(logging.Formatter):
+    # one json object per line, extra= fields come along as their own keys
+    def format(self, record):
+        data = {
+            "time": round(record.created, 6),
+            "level": record.levelname,
+            "logger": record.name,
+            "thread": record.threadName,
+            "message": record.getMessage(),
+        }
+        for key, value in vars(record).items():
+            if key not in RECORD_FIELDS and key not in data:
+                data[key] = value
+        if record.exc_info:
+            data["exception"] = self.formatException(record.exc_info)
+        return json.dumps(data, default=str)
+
+
+class RtRing:
+    # one writer (the audio callback), one reader (the drain thread), no locks.
+    # a slot is filled in before head moves past it, the reader only reads behind head
+    def __init__(self, size=RT_RING_SIZE):
+        self.size = size
+        self.levels = [0] * size
+        self.messages = [None] * size
+        self.args = [None] * size
+        self.times = [0.0] * size
+        self.head = 0
+        self.tail = 0
+        self.dropped = 0
+
+    def write(self, level, message, arg=None):
+        # message should be a constant string, it gets formatted on the drain side
+        if self.head - self.tail >= self.size:
+            self.dropped += 1
+            return
+        i = self.head % self.size
+        self.levels[i] = level
+        self.messages[i] = message
+        self.args[i] = arg
+        self.times[i] = time.time()
+        self.head += 1
+
+    def drain(self, target):
+        while self.tail < self.head:
+            i = self.tail % self.size
+            args = () if self.args[i] is None else (self.args[i],)
+            target.log(
+                self.levels[i],
+                self.messages[i],
+                *args,
+                extra={"rt_time": self.times[i]},
+            )
+            self.tail += 1
+        if self.dropped:
+            dropped, self.dropped = self.dropped, 0
+            target.warning("%d audio callback log records dropped.", dropped)
+
+
+rt_ring = RtRing()
+rt_logger = logging.getLogger("jamstudio.rt")
+
+
+def rt_log(level, message, arg=None):
+    # the only logging call thats ok inside the audio callback
+    rt_ring.write(level, message, arg)
+
+
+class RtDrainer(threading.Thread):
+    def __init__(self):
+        super().__init__()
+        self.daemon = True
+        self.name = "log-drain"
+        self.stopped = threading.Event()
+
+    def run(self):
+        while not self.stopped.wait(RT_DRAIN_SECONDS):
+            rt_ring.drain(rt_logger)
+        rt_ring.drain(rt_logger)
+
+
+def setup(level=None, log_file=None):
+    # can be called again (after the config is read), the old listener gets flushed
+    # and replaced
+    global _listener, _drainer
+    shutdown()
+
+    console = logging.StreamHandler()
+    console.setFormatter(ConsoleFormatter("%(message)s"))
+    handlers = [console]
+
+    log_file = LOG_FILE if log_file is None else log_file
+    file_error = None
+    if log_file:
+        try:
+            to_file = logging.FileHandler(log_file, encoding="utf-8")
+            to_file.setFormatter(JsonFormatter())
+            handlers.append(to_file)
+        except OSError as e:
+            file_error = e
+
+    records = queue.SimpleQueue()
+    logger.handlers = [logging.handlers.QueueHandler(records)]
+    logger.setLevel((level or LOG_LEVEL).upper())
+    logger.propagate = False
+
+    _listener = logging.handlers.QueueListener(records, *handlers)
+    _listener.start()
+    _drainer = RtDrainer()
+    _drainer.start()
+
+    if file_error is not None:
+        logger.warning("Could not open log file %s: %s", log_file, file_error)
+
+
+def shutdown():
+    # flushes whatever is still queued, safe to call more than once
+    global _listener, _drainer
+    if _drainer is not None:
+        _drainer.stopped.set()
+        _drainer.join()
+        _drainer = None
+    if _listener is not None:
+        _listener.stop()
+        for handler in _listener.handlers:
+            handler.close()
+        _listener = None
+
+
+atexit.register(shutdown)
@@ -0,0 +1,231 @@
+# per stem loudness so every slot comes in at about the same level
+#
+# integrated loudness (bs.1770 style, k-weighted and gated) and true peak get worked
+# out once per file and kept in loudness.json in the song folder, keyed by mtime.
+# the slot plays the stem as it is on disk with a gain towards LOUDNESS_TARGET,
+# so nothing has to scan the whole stem on every load
+
+import json
+import logging
+import os
+import threading
+
+import numpy as np
+
+from . import engine, trace
+from .library import load_audio_data
+
+log = logging.getLogger(__name__)
+
+LOUDNESS_FILE = "loudness.json"
+LOUDNESS_VERSION = 1
+
+# lufs every stem is brought to, set from config.json "loudness_target".
+# None turns it off and plays stems at their file level
+LOUDNESS_TARGET = -16.0
+# gain never pushes a stems true peak past this (dBTP), same ceiling the old
+# peak normalize had
+TRUE_PEAK_CEILING = 0.0
+# so a near silent stem doesnt get turned up into a wall of noise
+MAX_GAIN_DB = 24.0
+
+# 100ms steps, a gating block is 4 of them (400ms with 75% overlap)
+STEP_SECONDS = 0.1
+ABSOLUTE_GATE = -70.0
+RELATIVE_GATE = -10.0
+
+# true peak oversampling, 4x with a 48 tap windowed sinc (12 per phase)
+OVERSAMPLE = 4
+PHASE_TAPS = 12
+
+# how many samples at a time, keeps the scratch arrays small on long files
+CHUNK = 1 << 16
+
+_lock = threading.Lock()
+
+
+def biquad_power(b, a, freqs, sr):
+    # |H|^2 of a biquad at freqs
+    z = np.exp(-2j * np.pi * freqs / sr)
+    num = b[0] + b[1] * z + b[2] * z * z
+    den = a[0] + a[1] * z + a[2] * z * z
+    return np.abs(num / den) ** 2
+
+
+def k_weighting(freqs, sr):
+    # the two stage k filter (high shelf then high pass) as a power response,
+    # coefficients worked out for sr instead of the 48k table in the spec
+    gain_db, shelf_fc, shelf_q = 4.0, 1500.0, 1 / np.sqrt(2)
+    A = 10 ** (gain_db / 40)
+    w0 = 2 * np.pi * shelf_fc / sr
+    alpha = np.sin(w0) / (2 * shelf_q)
+    cos = np.cos(w0)
+    shelf_b = (
+        A * ((A + 1) + (A - 1) * cos + 2 * np.sqrt(A) * alpha),
+        -2 * A * ((A - 1) + (A + 1) * cos),
+        A * ((A + 1) + (A - 1) * cos - 2 * np.sqrt(A) * alpha),
+    )
+    shelf_a = (
+        (A + 1) - (A - 1) * cos + 2 * np.sqrt(A) * alpha,
+        2 * ((A - 1) - (A + 1) * cos),
+        (A + 1) - (A - 1) * cos - 2 * np.sqrt(A) * alpha,
+    )
+
+    hp_fc, hp_q = 38.0, 0.5
+    w0 = 2 * np.pi * hp_fc / sr
+    alpha = np.sin(w0) / (2 * hp_q)
+    cos = np.cos(w0)
+    hp_b = ((1 + cos) / 2, -(1 + cos), (1 + cos) / 2)
+    hp_a = (1 + alpha, -2 * cos, 1 - alpha)
+
+    return biquad_power(shelf_b, shelf_a, freqs, sr) * biquad_power(
+        hp_b, hp_a, freqs, sr
+    )
+
+
+def step_powers(audio, sr):
+    # k-weighted mean square of every 100ms step, summed over channels.
+    # the filter is applied in the frequency domain per step, parseval does the rest
+    step = int(round(sr * STEP_SECONDS))
+    n_steps = len(audio) // step
+    if n_steps == 0:
+        return np.zeros(0)
+
+    weight = k_weighting(np.fft.rfftfreq(step, 1 / sr), sr)
+    # rfft only has one side, everything but dc (and nyquist) counts twice
+    weight[1:] *= 2
+    if step % 2 == 0:
+        weight[-1] /= 2
+    weight /= step * step
+
+    powers = np.zeros(n_steps)
+    per_chunk = max(1, CHUNK // step)
+    for first in range(0, n_steps, per_chunk):
+        last = min(n_steps, first + per_chunk)
+        block = audio[first * step : last * step].reshape(last - first, step, -1)
+        spec = np.fft.rfft(block, axis=1)
+        power = spec.real**2 + spec.imag**2
+        powers[first:last] = np.einsum("sfc,f->s", power, weight)
+    return powers
+
+
+def integrated_loudness(audio, sr=None):
+    # lufs, None if the whole thing is below the absolute gate
+    sr = sr or engine.SAMPLE_RATE
+    powers = step_powers(audio, sr)
+    if len(powers) < 4:
+        return None
+    blocks = np.convolve(powers, np.ones(4) / 4, mode="valid")
+
+    with np.errstate(divide="ignore"):
+        levels = -0.691 + 10 * np.log10(blocks)
+    gated = blocks[levels > ABSOLUTE_GATE]
+    if len(gated) == 0:
+        return None
+
+    relative = -0.691 + 10 * np.log10(gated.mean()) + RELATIVE_GATE
+    gated = blocks[(levels > ABSOLUTE_GATE) & (levels > relative)]
+    return float(-0.691 + 10 * np.log10(gated.mean()))
+
+
+def oversample_filter():
+    # (PHASE_TAPS, OVERSAMPLE) windowed sinc, column p makes the p-th in-between sample
+    n = OVERSAMPLE * PHASE_TAPS
+    t = (np.arange(n) - (n - 1) / 2) / OVERSAMPLE
+    h = np.sinc(t) * np.kaiser(n, 8.0)
+    phases = h.reshape(PHASE_TAPS, OVERSAMPLE)[::-1]
+    return phases / phases.sum(axis=0)
+
+
+def true_peak(audio):
+    # dBTP, max of the 4x oversampled signal over every channel
+    if len(audio) == 0:
+        return -np.inf
+    taps = oversample_filter().astype(np.float32)
+    history = np.zeros((PHASE_TAPS - 1, audio.shape[1]), np.float32)
+    peak = 0.0
+    for start in range(0, len(audio), CHUNK):
+        chunk = np.concatenate((history, audio[start : start + CHUNK]))
+        history = chunk[-(PHASE_TAPS - 1) :]
+        for ch in range(chunk.shape[1]):
+            windows = np.lib.stride_tricks.sliding_window_view(chunk[:, ch], PHASE_TAPS)
+            peak = max(peak, float(np.abs(windows @ taps).max()))
+    return 20 * np.log10(peak) if peak else -np.inf
+
+
+def measure(audio, sr=None):
+    with trace.span("loudness", bytes=audio.nbytes):
+        lufs = integrated_loudness(audio, sr)
+        peak = true_peak(audio)
+    return {
+        "lufs": None if lufs is None else round(lufs, 2),
+        "true_peak": None if not np.isfinite(peak) else round(float(peak), 2),
+    }
+
+
+def read_sidecar(song_folder):
+    try:
+        with open(os.path.join(song_folder, LOUDNESS_FILE), "r") as f:
+            data = json.load(f)
+        if data.get("version") == LOUDNESS_VERSION:
+            return data
+    except Exception:
+        pass
+    return {"version": LOUDNESS_VERSION, "files": {}}
+
+
+def cached_loudness(path):
+    entry = read_sidecar(os.path.dirname(path))["files"].get(os.path.basename(path))
+    if entry is None or entry.get("mtime") != os.path.getmtime(path):
+        return None
+    return entry
+
+
+def save_loudness(path, entry):
+    # read-modify-write, the lock keeps the load threads from stepping on each other
+    song_folder = os.path.dirname(path)
+    entry = dict(entry, mtime=os.path.getmtime(path))
+    with _lock:
+        data = read_sidecar(song_folder)
+        data["files"][os.path.basename(path)] = entry
+        try:
+            target = os.path.join(song_folder, LOUDNESS_FILE)
+            with open(target + ".tmp", "w") as f:
+                json.dump(data, f, indent=4)
+            os.replace(target + ".tmp", target)
+        except Exception as e:
+            log.error("Could not save loudness: %s", e)
+    return entry
+
+
+def stem_loudness(path, load=None):
+    # the sidecar entry for path, measured (and saved) the first time.
+    # load returns the decoded audio if its already around somewhere
+    entry = cached_loudness(path)
+    if entry is None:
+        audio = load() if load is not None else load_audio_data(path)
+        entry = save_loudness(path, measure(audio))
+    return entry
+
+
+def gain_for(entry):
+    # linear gain that takes a stem to LOUDNESS_TARGET without going over the ceiling
+    if LOUDNESS_TARGET is None or entry.get("lufs") is None:
+        return 1.0
+    gain_db = min(LOUDNESS_TARGET - entry["lufs"], MAX_GAIN_DB)
+    if entry.get("true_peak") is not None:
+        gain_db = min(gain_db, TRUE_PEAK_CEILING - entry["true_peak"])
+    return float(10 ** (gain_db / 20))
+
+
+def stem_gain(path, load=None):
+    try:
+        return gain_for(stem_loudness(path, load))
+    except Exception as e:
+        log.warning(
+            "Could not measure loudness of %s: %s",
+            os.path.basename(path),
+            e,
+            extra={"path": path},
+        )
+        return 1.0
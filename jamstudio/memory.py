@@ -0,0 +1,248 @@
+# memory accounting: what the slots, the caches and the loads in flight are holding,
+# and an optional budget every load has to fit under
+#
+# a load reserves what it might need (estimate()) before it starts. if that would go
+# over MEMORY_BUDGET_MB it waits for the loads in flight to finish (project loads and
+# renders, a stem added by hand doesnt wait), once none are in flight the caches get
+# emptied and it gets one more try before its refused. while
+# it runs the stages report the arrays they make with hold(), which is where the
+# bytes per stage and the peaks come from
+#
+# report(session) is the whole picture as a dict, the debug hud in main.py and the
+# /jam/memory control message (control.py) both show it
+
+import json
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+
+import numpy as np
+
+from .engine import CHANNELS
+
+MB = 1024 * 1024
+FRAME_BYTES = CHANNELS * 4  # one float32 frame
+
+# set from config.json "memory_budget_mb", None means no limit
+MEMORY_BUDGET_MB = None
+
+# how long a queued load sleeps before it looks again (finishing loads wake it early)
+WAIT_SECONDS = 0.5
+# finished loads kept for the report
+LOAD_HISTORY = 16
+
+_local = threading.local()
+
+
+class BudgetExceeded(Exception):
+    pass
+
+
+def hold(stage, nbytes):
+    # an array a pipeline stage made, counted against the load this thread is
+    # running (if any) until that load is done
+    load = getattr(_local, "load", None)
+    if load is not None:
+        load.hold(stage, nbytes)
+
+
+def estimate(plan):
+    # the most loading plan could have around at once: the decoded source (twice
+    # over while its resampled) and the preview
+    frames = plan["target_len"] or plan["est_len"]
+    source = int(frames * plan["ratio"]) * FRAME_BYTES
+    if plan.get("source_rate", plan["key"][9]) != plan["key"][9]:
+        source *= 2
+    return source + frames * FRAME_BYTES
+
+
+def render_estimate(frames, ratio, semis):
+    # a float32 copy per stage (the micro stretch is always there) and the packed stem
+    stages = 1 + (ratio != 1.0) + (semis != 0)
+    return (stages + 1) * frames * FRAME_BYTES
+
+
+class Load:
+    def __init__(self, tracker, name, reserved):
+        self.tracker = tracker
+        self.name = name
+        self.reserved = reserved
+        self.held = 0
+        self.peak = 0
+        self.stages = {}
+
+    def hold(self, stage, nbytes):
+        tracker = self.tracker
+        with tracker.lock:
+            self.stages[stage] = self.stages.get(stage, 0) + nbytes
+            self.held += nbytes
+            self.peak = max(self.peak, self.held)
+            tracker.stages[stage] = tracker.stages.get(stage, 0) + nbytes
+            tracker.stage_peaks[stage] = max(
+                tracker.stage_peaks.get(stage, 0), tracker.stages[stage]
+            )
+            tracker.in_flight += nbytes
+            tracker.peak = max(tracker.peak, tracker.in_flight)
+
+
+class MemoryTracker:
+    def __init__(self, resident=None, reclaim=None):
+        # resident() is bytes held outside of loads, reclaim() empties the caches
+        self.lock = threading.Condition()
+        self.resident = resident or (lambda: 0)
+        self.reclaim = reclaim
+        self.loads = 0
+        self.reserved = 0
+        self.in_flight = 0  # bytes the loads in flight have reported with hold()
+        self.peak = 0
+        self.stages = {}  # stage -> bytes held by loads in flight
+        self.stage_peaks = {}
+        self.history = deque(maxlen=LOAD_HISTORY)
+        self.refused = 0
+        self.last_refused = None
+
+    def budget(self):
+        return MEMORY_BUDGET_MB * MB if MEMORY_BUDGET_MB else None
+
+    def fits(self, nbytes):
+        budget = self.budget()
+        return budget is None or self.resident() + self.reserved + nbytes <= budget
+
+    def reserve(self, name, nbytes, wait=True, reclaim=True, on_wait=None):
+        reclaimed = not reclaim or self.reclaim is None
+        while True:
+            with self.lock:
+                while not self.fits(nbytes):
+                    if wait and self.loads:
+                        # the ones in flight give theirs back when theyre done
+                        if on_wait is not None:
+                            on_wait()
+                        self.lock.wait(WAIT_SECONDS)
+                    elif not reclaimed:
+                        break
+                    else:
+                        self.refused += 1
+                        self.last_refused = (
+                            f"{name} needs {nbytes / MB:.1f} MB, "
+                            f"{self.free() / MB:.1f} MB left in the budget"
+                        )
+                        raise BudgetExceeded(self.last_refused)
+                else:
+                    self.loads += 1
+                    self.reserved += nbytes
+                    return Load(self, name, nbytes)
+            # not under the lock, spilling the prefetch cache writes to disk and
+            # the other loads shouldnt wait on that. then its checked again
+            self.reclaim()
+            reclaimed = True
+
+    def finish(self, load, seconds):
+        with self.lock:
+            self.loads -= 1
+            self.reserved -= load.reserved
+            self.in_flight -= load.held
+            for stage, nbytes in load.stages.items():
+                self.stages[stage] -= nbytes
+            self.history.append(
+                {
+                    "name": load.name,
+                    "reserved": load.reserved,
+                    "peak": load.peak,
+                    "stages": dict(load.stages),
+                    "seconds": round(seconds, 3),
+                }
+            )
+            self.lock.notify_all()
+
+    @contextmanager
+    def load(self, name, nbytes, wait=True, reclaim=True, on_wait=None):
+        # with tracker.load("slot 3", estimate(plan)): ... everything hold() sees in
+        # this thread gets counted against it
+        load = self.reserve(name, nbytes, wait, reclaim, on_wait)
+        outer = getattr(_local, "load", None)
+        _local.load = load
+        t0 = time.perf_counter()
+        try:
+            yield load
+        finally:
+            _local.load = outer
+            self.finish(load, time.perf_counter() - t0)
+
+    def free(self):
+        budget = self.budget()
+        if budget is None:
+            return None
+        return budget - self.resident() - self.reserved
+
+
+def stem_bytes(stem):
+    # (bytes in ram, bytes memory mapped from disk)
+    if isinstance(stem.data, np.memmap):
+        return 0, stem.nbytes
+    return stem.nbytes, 0
+
+
+def resident_bytes(session):
+    # everything the session holds outside of loads, a stem shared by two slots
+    # (or a slot and the pool) only counts once
+    seen = set()
+    total = 0
+    for slot in session.slots:
+        for stem in (slot.stem, slot.pending_stem, slot.join_stem):
+            if stem is not None and id(stem.data) not in seen:
+                seen.add(id(stem.data))
+                total += stem_bytes(stem)[0]
+    with session.stem_pool.lock:
+        for stem in session.stem_pool.released.values():
+            if id(stem.data) not in seen:
+                seen.add(id(stem.data))
+                total += stem_bytes(stem)[0]
+    total += session.stage_cache.nbytes
+    total += session.prefetcher.store.memory_bytes
+    return total
+
+
+def report(session):
+    tracker = session.memory
+    slots = {}
+    for slot in session.slots:
+        entry = {}
+        for name in ("stem", "pending_stem", "join_stem"):
+            stem = getattr(slot, name)
+            if stem is not None:
+                ram, mapped = stem_bytes(stem)
+                entry[name] = {"ram": ram, "mapped": mapped}
+        if entry:
+            slots[slot.idx] = entry
+
+    with session.stem_pool.lock:
+        pool = sum(stem_bytes(s)[0] for s in session.stem_pool.released.values())
+    with tracker.lock:
+        loads = {
+            "in_flight": tracker.loads,
+            "reserved": tracker.reserved,
+            "held": tracker.in_flight,
+            "peak": tracker.peak,
+            "stages": dict(tracker.stages),
+            "stage_peaks": dict(tracker.stage_peaks),
+            "recent": list(tracker.history),
+        }
+        refused = {"count": tracker.refused, "last": tracker.last_refused}
+
+    return {
+        "resident": resident_bytes(session),
+        "budget": tracker.budget(),
+        "slots": slots,
+        "caches": {
+            "pool_released": pool,
+            "stage_cache": session.stage_cache.nbytes,
+            "prefetch": session.prefetcher.store.memory_bytes,
+        },
+        "loads": loads,
+        "refused": refused,
+    }
+
+
+def report_json(session):
+    return json.dumps(report(session))
@@ -0,0 +1,50 @@
+# key and tempo math, no audio in here
+
+KEY_TO_INT = {
+    "C": 0,
+    "C#": 1,
+    "Db": 1,
+    "D": 2,
+    "D#": 3,
+    "Eb": 3,
+    "E": 4,
+    "F": 5,
+    "F#": 6,
+    "Gb": 6,
+    "G": 7,
+    "G#": 8,
+    "Ab": 8,
+    "A": 9,
+    "A#": 10,
+    "Bb": 10,
+    "B": 11,
+}
+
+KEYS_SHARP = ["C", "C#", "D", "D#", "E", "F", "F#", "G", "G#", "A", "A#", "B"]
+KEYS_FLAT = ["C", "Db", "D", "Eb", "E", "F", "Gb", "G", "Ab", "A", "Bb", "B"]
+
+
+def key_shift_semitones(target_key, source_key):
+    # calc semitone diff
+    raw = KEY_TO_INT[target_key] - KEY_TO_INT[source_key]
+    if raw > 6:
+        raw -= 12
+    elif raw < -6:
+        raw += 12
+    return raw
+
+
+def match_bpm_timescale(original_bpm, master_bpm):
+    # find best bpm match
+    candidates = [
+        original_bpm * 0.0625,
+        original_bpm * 0.125,
+        original_bpm * 0.25,
+        original_bpm * 0.5,  # half time
+        original_bpm,  # og
+        original_bpm * 2,  # double time
+        original_bpm * 4,
+        original_bpm * 8,
+        original_bpm * 16,
+    ]
+    return min(candidates, key=lambda b: abs(b - master_bpm))
@@ -0,0 +1,98 @@
+# processed stems shared between slots
+
+import threading
+from collections import OrderedDict
+
+
+class StemPool:
+    # processed stems shared between slots, keyed by (source file, transform)
+    # the packed arrays are read only so two slots can point at the same one safely
+    # once nothing uses a stem it hangs around in an LRU in case it comes back
+    def __init__(self, retain_bytes=256 * 1024 * 1024):
+        self.lock = threading.Lock()
+        self.retain_bytes = retain_bytes
+        self.in_use = {}  # key -> [audio, refs]
+        self.released = OrderedDict()  # key -> audio, oldest first
+
+    def acquire(self, key):
+        with self.lock:
+            entry = self.in_use.get(key)
+            if entry is not None:
+                entry[1] += 1
+                return entry[0]
+            audio = self.released.pop(key, None)
+            if audio is not None:
+                self.in_use[key] = [audio, 1]
+            return audio
+
+    def add(self, key, audio):
+        # if someone beat us to it just share theirs
+        with self.lock:
+            entry = self.in_use.get(key)
+            if entry is None and key in self.released:
+                entry = [self.released.pop(key), 0]
+                self.in_use[key] = entry
+            if entry is not None:
+                entry[1] += 1
+                return entry[0]
+            self.in_use[key] = [audio, 1]
+            return audio
+
+    def release(self, key):
+        with self.lock:
+            entry = self.in_use.get(key)
+            if entry is None:
+                return
+            entry[1] -= 1
+            if entry[1] > 0:
+                return
+            del self.in_use[key]
+            self.released[key] = entry[0]
+            self.trim()
+
+    def trim(self, retain_bytes=None):
+        if retain_bytes is None:
+            retain_bytes = self.retain_bytes
+        total = sum(a.nbytes for a in self.released.values())
+        while self.released and total > retain_bytes:
+            _, audio = self.released.popitem(last=False)
+            total -= audio.nbytes
+
+    def drop_released(self):
+        with self.lock:
+            self.trim(0)
+
+
+class StageCache:
+    # intermediate float32 arrays (decoded sources, time stretched stems) so a retune
+    # only redoes the stages that actually changed. plain LRU with a byte budget
+    def __init__(self, max_bytes=256 * 1024 * 1024):
+        self.lock = threading.Lock()
+        self.max_bytes = max_bytes
+        self.items = OrderedDict()  # key -> array, oldest first
+        self.nbytes = 0
+
+    def get(self, key):
+        with self.lock:
+            audio = self.items.get(key)
+            if audio is not None:
+                self.items.move_to_end(key)
+            return audio
+
+    def put(self, key, audio):
+        if audio.nbytes > self.max_bytes:
+            return
+        with self.lock:
+            old = self.items.pop(key, None)
+            if old is not None:
+                self.nbytes -= old.nbytes
+            self.items[key] = audio
+            self.nbytes += audio.nbytes
+            while self.nbytes > self.max_bytes:
+                _, dropped = self.items.popitem(last=False)
+                self.nbytes -= dropped.nbytes
+
+    def clear(self):
+        with self.lock:
+            self.items.clear()
+            self.nbytes = 0
@@ -0,0 +1,269 @@
+# renders the loaded stems at the keys/tempos youre likely to jump to next while
+# the jam is just sitting there playing, so manual tuning can swap them straight in
+# anything in the foreground (loads, renders, retunes) stops it right away
+
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+
+from . import memory, trace
+from .engine import PackedStem, pack_stem
+from .library import find_song
+from .music import KEY_TO_INT, KEYS_SHARP
+from .store import DiskStore
+from .stretch import RenderCancelled
+
+log = logging.getLogger(__name__)
+
+# all of these can be set from config.json under "prefetch"
+PREFETCH_ENABLED = True
+# fraction of one core it may use, it sleeps between renders to stay under it
+PREFETCH_CPU = 0.5
+PREFETCH_MEMORY_MB = 256
+PREFETCH_DISK_MB = 1024
+PREFETCH_DIR = os.path.join("cache", "variants")
+
+# semitone steps tried around the master key, closest first
+KEY_STEPS = [1, -1, 2, -2]
+
+# how long the foreground has to be quiet before it starts again
+IDLE_SECONDS = 2.0
+
+
+def nearby_targets(bpm, key, scale, song_bpms=()):
+    # (bpm, key, scale) combos worth having ready, most likely first
+    if bpm is None or key not in KEY_TO_INT:
+        return []
+    root = KEY_TO_INT[key]
+
+    targets = []
+    for step in KEY_STEPS[:2]:
+        targets.append((bpm, KEYS_SHARP[(root + step) % 12], scale))
+
+    # relative mode, same notes so its a common switch
+    if scale == "major":
+        targets.append((bpm, KEYS_SHARP[(root - 3) % 12], "minor"))
+    else:
+        targets.append((bpm, KEYS_SHARP[(root + 3) % 12], "major"))
+
+    for step in KEY_STEPS[2:]:
+        targets.append((bpm, KEYS_SHARP[(root + step) % 12], scale))
+
+    # the other loaded songs own tempos are the usual bpm moves
+    for other in sorted(set(song_bpms)):
+        if other != bpm:
+            targets.append((other, key, scale))
+
+    return targets
+
+
+class VariantStore:
+    # prefetched stems, in memory first and spilled to disk once theres too many
+    # both sides are LRUs with their own byte budget
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.memory = OrderedDict()  # key -> PackedStem
+        self.memory_bytes = 0
+        self.disk = None
+
+    def disk_store(self):
+        # made on first use so the config has been read by then
+        if self.disk is None:
+            self.disk = DiskStore(PREFETCH_DIR, PREFETCH_DISK_MB)
+        return self.disk
+
+    def __contains__(self, key):
+        with self.lock:
+            if key in self.memory:
+                return True
+        return key in self.disk_store()
+
+    def put(self, key, stem):
+        with self.lock:
+            self.memory[key] = stem
+            self.memory_bytes += stem.nbytes
+        self.spill(PREFETCH_MEMORY_MB * 1024 * 1024)
+
+    def spill(self, max_bytes=0):
+        # oldest memory ones go to disk until theres max_bytes left (or away if
+        # the disk side is off)
+        spill = []
+        with self.lock:
+            while self.memory_bytes > max_bytes:
+                old_key, old = self.memory.popitem(last=False)
+                self.memory_bytes -= old.nbytes
+                spill.append((old_key, old))
+        if PREFETCH_DISK_MB > 0:
+            for old_key, old in spill:
+                self.disk_store().put(old_key, old.data, old.scale)
+
+    def take(self, key):
+        # the stem for key if its here, memory ones leave the store (the stem
+        # pool has them from then on), disk ones get memory mapped
+        with self.lock:
+            stem = self.memory.pop(key, None)
+            if stem is not None:
+                self.memory_bytes -= stem.nbytes
+                return stem
+
+        found = self.disk_store().get(key)
+        if found is None:
+            return None
+        return PackedStem(*found)
+
+
+class Prefetcher(threading.Thread):
+    def __init__(self, session):
+        super().__init__()
+        self.daemon = True
+        self.session = session
+        self.store = VariantStore()
+        self.cancel = threading.Event()
+        self.last_busy = time.monotonic()
+        self.queue = []
+        self.queue_state = None
+        self.failed = set()
+
+    def preempt(self):
+        # foreground work is here, drop whatever were rendering
+        self.last_busy = time.monotonic()
+        self.cancel.set()
+
+    def take(self, key):
+        return self.store.take(key)
+
+    def idle(self):
+        session = self.session
+        if time.monotonic() - self.last_busy < IDLE_SECONDS:
+            return False
+        if session.is_loading() or not session.engine.is_playing():
+            return False
+        for slot in session.slots:
+            future = slot.render_future
+            if future is not None and not future.done():
+                return False
+        return True
+
+    def state(self):
+        session = self.session
+        return (
+            session.master_bpm,
+            session.master_key,
+            session.master_scale,
+            session.engine.max_length,
+            tuple(s.plan_key for s in session.slots),
+        )
+
+    def build_queue(self):
+        # plan every occupied slot at every nearby target, the same way retune would
+        session = self.session
+        slots = [s for s in session.slots if not s.empty and s.song_name]
+        targets = nearby_targets(
+            session.master_bpm,
+            session.master_key,
+            session.master_scale,
+            [s.bpm for s in slots if s.bpm],
+        )
+
+        queue = []
+        for target in targets:
+            loop_len = (
+                session.engine.max_length if target[0] == session.master_bpm else 0
+            )
+            for slot in slots:
+                song_path = find_song(slot.song_name)
+                if not song_path:
+                    continue
+                try:
+                    plan = session.plan_stem(
+                        song_path, slot.type, slot.profile, loop_len, target, []
+                    )
+                except Exception:
+                    continue
+                if plan is None:
+                    continue
+                if not loop_len:
+                    loop_len = plan["target_len"] or plan["est_len"]
+                queue.append(plan)
+        return queue
+
+    def next_plan(self):
+        state = self.state()
+        if state != self.queue_state:
+            self.queue = self.build_queue()
+            self.queue_state = state
+
+        pool = self.session.stem_pool
+        while self.queue:
+            plan = self.queue.pop(0)
+            key = plan["key"]
+            if key in self.failed or key in self.store:
+                continue
+            if key in pool.in_use or key in pool.released:
+                continue
+            if plan["ratio"] == 1.0 and plan["semis"] == 0:
+                # nothing to render, the plain load is instant anyway
+                continue
+            return plan
+        return None
+
+    def render(self, plan):
+        session = self.session
+        self.cancel.clear()
+        # speculative, so it never waits or empties the caches to fit
+        estimate = memory.estimate(plan) + memory.render_estimate(
+            plan["target_len"] or plan["est_len"], plan["ratio"], plan["semis"]
+        )
+        if not session.memory.fits(estimate):
+            self.queue.insert(0, plan)
+            return
+        with session.memory.load("prefetch", estimate, wait=False, reclaim=False):
+            source = session.source_audio(plan["path"])
+            with trace.span("prefetch", stem=plan["type"], semis=plan["semis"]):
+                audio = session.render_plan(
+                    source,
+                    plan["key"],
+                    plan["ratio"],
+                    plan["semis"],
+                    plan["target_len"],
+                    plan["type"],
+                    plan["profile"],
+                    self.cancel,
+                )
+            if self.cancel.is_set():
+                raise RenderCancelled()
+            self.store.put(plan["key"], pack_stem(audio))
+
+    def run(self):
+        while True:
+            time.sleep(0.25)
+            if not PREFETCH_ENABLED or not self.idle():
+                continue
+
+            plan = self.next_plan()
+            if plan is None:
+                continue
+
+            t0 = time.monotonic()
+            try:
+                self.render(plan)
+            except (RenderCancelled, memory.BudgetExceeded):
+                # itll come back around next time things are quiet
+                self.queue_state = None
+                continue
+            except Exception as e:
+                log.warning(
+                    "Prefetch failed for %s: %s",
+                    os.path.basename(plan["path"]),
+                    e,
+                    extra={"path": plan["path"]},
+                )
+                self.failed.add(plan["key"])
+                continue
+
+            # stay under the cpu budget
+            spent = time.monotonic() - t0
+            cpu = min(max(PREFETCH_CPU, 0.05), 1.0)
+            self.cancel.wait(spent * (1 - cpu) / cpu)
@@ -0,0 +1,118 @@
+# the preview tier, streamed: a stem can play as soon as the first block of its file
+# is decoded, the way cue.py plays a file straight off the disk
+#
+# the preview is a linear resample of the file to the loop length, so its in time and
+# the pitch is rough. it goes straight from the files own rate, the same numbers as
+# stretch.resample_linear over the whole file. the stem is made at full length up
+# front and filled in as the decode goes, whats not decoded yet plays as silence.
+# the decode starts where the slot starts playing, wraps round to the start and
+# runs far ahead of real time, so the play head doesnt catch up with it
+#
+# the file gets decoded into source along the way, thats what the hq render works
+# from once its all in (session.stream_job)
+
+import threading
+
+import numpy as np
+import soundfile as sf
+
+from . import engine
+from .engine import CHANNELS, PackedStem
+
+BLOCK_FRAMES = 16384
+# int16 previews cant know the peak before theyre decoded, they use the full range
+INT16_SCALE = 1 / 32767
+
+
+class PreviewStream:
+    def __init__(self, path, length, start=0, mode=None):
+        # start is the preview frame the slot starts playing from
+        self.path = path
+        self.file = sf.SoundFile(path)
+        self.frames = self.file.frames
+        self.rate = self.file.samplerate
+        self.length = length
+        self.step = self.frames / length  # source frames per preview frame
+
+        mode = mode or engine.STEM_STORAGE
+        self.scale = INT16_SCALE if mode == "int16" else 1.0
+        dtype = {"int16": np.int16, "float16": np.float16}.get(mode, np.float32)
+        # the stem gets a read only view, this one stays writable for the decode
+        self.buffer = np.zeros((length, CHANNELS), dtype)
+        self.stem = PackedStem(self.buffer[:], self.scale)
+        self.source = np.empty((self.frames, CHANNELS), np.float32)
+
+        # from the start frame to the end, then from the beginning up to and
+        # including it so the frames just before it have what comes next
+        first = min(int(start % length * self.step), self.frames - 1)
+        self.segments = [(first, self.frames), (0, first + 1)]
+        self.pos, self.end = self.segments.pop(0)
+        self.file.seek(self.pos)
+        self.tail = None  # (source frame, that frame) last of the block before
+        self.done = False
+
+        # set once theres something to play (or it failed, see error)
+        self.ready = threading.Event()
+        self.error = None
+        # set once the slot has it, or it was thrown away (see session.load_planned)
+        self.published = threading.Event()
+
+    def decode_block(self):
+        # the next block into source and the preview, False once its all in
+        if self.pos >= self.end:
+            if not self.segments:
+                self.done = True
+                self.close()
+                return False
+            self.pos, self.end = self.segments.pop(0)
+            self.file.seek(self.pos)
+        block = self.file.read(
+            min(BLOCK_FRAMES, self.end - self.pos), dtype="float32", always_2d=True
+        )
+        if not len(block):
+            # the file was shorter than its header said
+            self.end = self.pos
+            return True
+        if block.shape[1] == 1:
+            block = np.repeat(block, CHANNELS, axis=1)
+        elif block.shape[1] > CHANNELS:
+            block = block[:, :CHANNELS]
+
+        start = self.pos
+        self.source[start : start + len(block)] = block
+        if self.tail is None:
+            self.fill(start, block)
+        elif self.tail[0] == start - 1:
+            self.fill(start - 1, np.concatenate((self.tail[1], block)))
+        else:
+            # back round to the start, the last frame goes towards the first
+            if self.tail[0] == self.frames - 1 and start == 0:
+                self.fill(self.frames - 1, np.concatenate((self.tail[1], block[:1])))
+            self.fill(start, block)
+        self.tail = (start + len(block) - 1, block[-1:])
+        self.pos += len(block)
+        return True
+
+    def fill(self, base, data):
+        # every preview frame that falls between two frames of data (data[0] is
+        # source frame base)
+        last = base + len(data) - 1
+        lo = max(0, int(base / self.step))
+        hi = min(self.length, int(last / self.step) + 2)
+        j = np.arange(lo, hi)
+        pos = j * self.step
+        i0 = pos.astype(np.int64)
+        keep = (i0 >= base) & (i0 < last)
+        if not keep.any():
+            return
+        j, pos, i0 = j[keep], pos[keep], i0[keep]
+        frac = (pos - i0).astype(np.float32)[:, None]
+        k = i0 - base
+        values = data[k] * (1 - frac) + data[k + 1] * frac
+        if self.scale != 1.0:
+            values = np.clip(np.round(values / self.scale), -32767, 32767)
+        self.buffer[j[0] : j[-1] + 1] = values
+
+    def close(self):
+        if not self.file.closed:
+            self.file.close()
@@ -0,0 +1,356 @@
+# saving/loading jams and rendering them out to wav
+
+import hashlib
+import json
+import logging
+import os
+import time
+
+import numpy as np
+import soundfile as sf
+
+from . import stretch, trace
+from .engine import CHANNELS, PackedStem
+from .library import file_checksum, find_song
+from .session import NUM_SLOTS
+from .store import STEM_FORMAT
+
+log = logging.getLogger(__name__)
+
+PROJECTS_DIR = "projects"
+
+# a bundle is a folder with the project json and the processed stems as .npy files
+# next to it, loading maps those straight in instead of stretching everything again
+BUNDLE_EXT = ".djam"
+
+
+def list_projects():
+    if not os.path.exists(PROJECTS_DIR):
+        return []
+    return [
+        f
+        for f in os.listdir(PROJECTS_DIR)
+        if f.endswith(".json") or f.endswith(BUNDLE_EXT)
+    ]
+
+
+def export_mix_to_wav(session, filename="export.wav"):
+    with trace.span("export_mix_to_wav", file=filename):
+        mix_to_wav(session, filename)
+
+
+def mix_to_wav(session, filename):
+    log.info("Starting export...", extra={"file": filename})
+    with trace.span("wait_renders"):
+        session.finish_renders()
+
+    max_len = session.engine.max_length
+    if max_len == 0:
+        log.error("No audio data to export.")
+        return
+
+    t_mix = time.perf_counter()
+    master_mix = np.zeros((max_len, CHANNELS), dtype=np.float32)
+
+    for slot in session.slots:
+        if slot.empty or slot.stem is None:
+            continue
+
+        if slot.mute:
+            continue
+
+        audio = slot.stem.to_array()
+        sl_len = len(audio)
+
+        offset_samples = (sl_len // 2) if slot.half == 1 else 0
+        processed_audio = np.roll(audio, -offset_samples, axis=0)
+
+        if sl_len < max_len:
+            repeats = (max_len // sl_len) + 1
+            tiled = np.tile(processed_audio, (repeats, 1))
+            processed_audio = tiled[:max_len]
+        elif sl_len > max_len:
+            processed_audio = processed_audio[:max_len]
+        master_mix += processed_audio * (slot.volume * slot.gain)
+
+    master_mix *= session.engine.master_volume
+    master_mix = np.clip(master_mix, -1.0, 1.0)
+    trace.record("mix", t_mix, time.perf_counter(), bytes=master_mix.nbytes)
+
+    try:
+        with trace.span("write_wav", bytes=master_mix.nbytes):
+            sf.write(filename, master_mix, session.engine.sr)
+        log.info("Exported to: %s", filename, extra={"file": filename})
+    except Exception as e:
+        log.error("Export failed: %s", e, extra={"file": filename})
+
+
+def project_data(session):
+    data = {
+        "master": {
+            "bpm": session.master_bpm,
+            "key": session.master_key,
+            "scale": session.master_scale,
+            "master_volume": session.engine.master_volume,
+            "profile": stretch.global_profile,
+        },
+        "slots": [],
+    }
+
+    for i, slot in enumerate(session.slots):
+        if not slot.empty:
+            slot_data = {
+                "index": i,
+                "song_name": slot.song_name,
+                "type": slot.type,
+                "volume": slot.volume,
+                "half": slot.half,
+                "mute": slot.mute,
+                "solo": slot.solo,
+                "detected_key": slot.key,
+                "detected_scale": slot.scale,
+                "profile": slot.profile,
+            }
+            data["slots"].append(slot_data)
+
+    return data
+
+
+def save_project(session, filename="project_data.json"):
+    if filename.endswith(BUNDLE_EXT):
+        save_bundle(session, filename)
+        return
+
+    data = project_data(session)
+
+    if not os.path.exists(PROJECTS_DIR):
+        os.makedirs(PROJECTS_DIR)
+    full_path = os.path.join(PROJECTS_DIR, filename)
+
+    try:
+        with open(full_path, "w") as f:
+            json.dump(data, f, indent=4)
+        log.info("Project saved to: %s", full_path)
+    except Exception as e:
+        log.error("Could not save project: %s", e)
+
+
+def save_bundle(session, filename):
+    # stems have to be full quality before they go in
+    session.finish_renders()
+    data = project_data(session)
+
+    bundle_dir = os.path.join(PROJECTS_DIR, filename)
+    stems_dir = os.path.join(bundle_dir, "stems")
+
+    try:
+        os.makedirs(stems_dir, exist_ok=True)
+        keep = set()
+
+        for slot_data in data["slots"]:
+            slot = session.slots[slot_data["index"]]
+            if slot.pool_key is None or slot.tier != "hq":
+                continue
+
+            source = slot.pool_key[0]
+            info = {
+                "source": os.path.basename(source),
+                "size": os.path.getsize(source),
+                "mtime": os.path.getmtime(source),
+                "sha1": file_checksum(source),
+                "transform": list(slot.pool_key[2:]),
+                "scale": float(slot.stem.scale),
+                "format": STEM_FORMAT,
+            }
+
+            # the name comes from the source + transform so a stem that didnt change
+            # keeps its file, overwriting one thats memory mapped right now would
+            # pull it out from under the mixer
+            digest = hashlib.sha1(
+                json.dumps([info["sha1"], info["transform"]]).encode()
+            ).hexdigest()[:12]
+            info["stem"] = f"slot_{slot_data['index']}_{digest}.npy"
+            keep.add(info["stem"])
+
+            stem_path = os.path.join(stems_dir, info["stem"])
+            if not os.path.exists(stem_path):
+                with trace.span("write_stem", bytes=slot.stem.nbytes):
+                    np.save(stem_path, slot.stem.data)
+
+            slot_data["bundle"] = info
+
+        with open(os.path.join(bundle_dir, "project.json"), "w") as f:
+            json.dump(data, f, indent=4)
+
+        for f in os.listdir(stems_dir):
+            if f not in keep:
+                try:
+                    os.remove(os.path.join(stems_dir, f))
+                except OSError:
+                    # still mapped on windows, itll go next save
+                    pass
+
+        log.info("Project bundle saved to: %s", bundle_dir)
+    except Exception as e:
+        log.error("Could not save bundle: %s", e)
+
+
+def bundled_stem(bundle_dir, slot_data, plan):
+    # the stem saved in the bundle if it still matches the plan, None means process it as usual
+    info = slot_data.get("bundle")
+    if info is None:
+        return None
+
+    source = plan["path"]
+    transform = info["transform"]
+    if len(transform) == 7:
+        # saved before the engine rate was part of the key, those all ran at 44.1k
+        transform = [*transform, 44100]
+    if (
+        os.path.basename(source) != info["source"]
+        or list(plan["key"][2:]) != transform
+        or info.get("format", 1) != STEM_FORMAT
+    ):
+        log.info(
+            "Bundled stem was made with different settings, reprocessing.",
+            extra={"slot": slot_data["index"]},
+        )
+        return None
+
+    # same size and mtime is good enough, otherwise check the actual bytes
+    if (os.path.getsize(source), os.path.getmtime(source)) != (
+        info["size"],
+        info["mtime"],
+    ):
+        with trace.span("checksum", bytes=os.path.getsize(source)):
+            changed = file_checksum(source) != info["sha1"]
+        if changed:
+            log.info(
+                "Source audio changed since the bundle was saved, reprocessing.",
+                extra={"slot": slot_data["index"]},
+            )
+            return None
+
+    try:
+        with trace.span("map_stem"):
+            data = np.load(
+                os.path.join(bundle_dir, "stems", info["stem"]), mmap_mode="r"
+            )
+    except Exception as e:
+        log.warning(
+            "Could not read bundled stem (%s), reprocessing.",
+            e,
+            extra={"slot": slot_data["index"]},
+        )
+        return None
+
+    return PackedStem(data, info["scale"])
+
+
+def load_project(session, filename):
+    # returns as soon as every slot is queued, the slots load in parallel and the
+    # jam starts playing when the first one is in
+    full_path = os.path.join(PROJECTS_DIR, filename)
+    bundle_dir = None
+    if filename.endswith(BUNDLE_EXT):
+        bundle_dir = full_path
+        full_path = os.path.join(bundle_dir, "project.json")
+
+    if not os.path.exists(full_path):
+        log.warning("No save file found.")
+        return
+
+    audio_engine = session.engine
+    t_load = time.perf_counter()
+    gen = None
+
+    try:
+        with open(full_path, "r") as f:
+            data = json.load(f)
+
+        gen = session.start_load(t_load)
+        audio_engine.stop()
+
+        session.master_bpm = data["master"]["bpm"]
+        session.master_key = data["master"]["key"]
+        session.master_scale = data["master"]["scale"]
+
+        if "master_volume" in data["master"]:
+            audio_engine.master_volume = data["master"]["master_volume"]
+        # slots saved without their own profile get the projects, the users own
+        # setting (Options, config.json) stays as it is
+        project_profile = data["master"].get("profile")
+
+        for i in range(NUM_SLOTS):
+            session.clear_slot(i)
+
+        audio_engine.max_length = 0
+        audio_engine.position = 0
+
+        # planning is just meta.json and file headers, so it stays in here and the
+        # first slot decides the loop length for the rest like it would loading one by one
+        loop_len = 0
+        for slot_data in data["slots"]:
+            song_name = slot_data["song_name"]
+            song_path = find_song(song_name)
+            if not song_path:
+                log.warning("'%s' not found during load.", song_name)
+                continue
+
+            plan = session.plan_stem(
+                song_path,
+                slot_data["type"],
+                saved_profile(slot_data, project_profile),
+                loop_len,
+            )
+            if plan is None:
+                continue
+            if not loop_len:
+                loop_len = plan["target_len"] or plan["est_len"]
+
+            session.submit_load(
+                slot_data["index"],
+                lambda slot_data=slot_data, plan=plan: load_slot(
+                    session, slot_data, plan, bundle_dir, gen
+                ),
+                gen,
+            )
+
+        trace.record("load_project", t_load, time.perf_counter(), file=filename)
+
+    except Exception as e:
+        log.error("Could not load project: %s", e)
+    finally:
+        # starts the jam (and says its done) if no slot is left to do that
+        if gen is not None:
+            session.planning_done(gen)
+
+
+def saved_profile(slot_data, project_profile):
+    # the profile a slot was rendered with, None leaves it to the current setting
+    profile = slot_data.get("profile")
+    if profile in stretch.PROCESSING_PROFILES:
+        return profile
+    if project_profile in stretch.PROCESSING_PROFILES:
+        return project_profile
+    if project_profile == "per stem":
+        return stretch.STEM_PROFILES.get(slot_data["type"], "balanced")
+    return None
+
+
+def load_slot(session, slot_data, plan, bundle_dir, gen):
+    stem = None
+    if bundle_dir:
+        stem = bundled_stem(bundle_dir, slot_data, plan)
+        if stem is not None:
+            log.info("Stem loaded from bundle.", extra={"slot": slot_data["index"]})
+
+    mix = {
+        "volume": slot_data.get("volume", 1.0),
+        "half": slot_data.get("half", 0),
+        "mute": slot_data.get("mute", False),
+        "solo": slot_data.get("solo", False),
+    }
+    return session.load_planned(
+        slot_data["index"], plan, mix, stem=stem, join=True, gen=gen
+    )
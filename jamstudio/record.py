@@ -0,0 +1,235 @@
+# records a performance as the mixer played it so it can be rendered to a wav
+# afterwards, no audio gets recorded while playing
+#
+# while a Recorder is attached (engine.recorder) the mixer hands it every block,
+# after the queued commands ran and before anything gets mixed. it compares every
+# slot (stem, volume, mute/solo, half...) and the master with the block before and
+# keeps what changed as (sample time, slot, field, value) events. stems go in a
+# table the events point into, the arrays themselves are only referenced
+#
+# render() replays the events block by block through a second engine with its own
+# slot threads, so its the same mixer with the same blocks, as fast as the cpu
+# goes. the wav is what came out of the speakers, minus the time it was paused
+
+import logging
+import threading
+import time
+from collections import Counter
+
+import numpy as np
+import soundfile as sf
+
+from . import trace
+from .engine import CHANNELS, AudioEngine, Slot
+
+log = logging.getLogger(__name__)
+
+# whats compared per slot every block, the order is the order they get applied in
+SLOT_FIELDS = (
+    "empty",
+    "stem",
+    "pending_stem",
+    "join_stem",
+    "volume",
+    "gain",
+    "half",
+    "mute",
+    "solo",
+)
+STEM_FIELDS = {"stem", "pending_stem", "join_stem"}
+# slot index for events that arent about a slot: "frames" (block size), "position"
+# (restart or seek), "master_volume" and "tuning" (retunes, just a marker)
+MASTER = -1
+
+# replay slots, made once and reused
+_replay_slots = []
+_replay_lock = threading.Lock()
+
+
+class Recording:
+    def __init__(self, samplerate):
+        self.sr = samplerate
+        self.events = []  # (time, slot, field, value), time in samples
+        self.stems = []  # stem fields hold an index into this (or None)
+        self.stem_index = {}  # id(stem) -> index
+        self.frames = 0  # length so far
+
+    def stem_ref(self, stem):
+        if stem is None:
+            return None
+        i = self.stem_index.get(id(stem))
+        if i is None:
+            i = self.stem_index[id(stem)] = len(self.stems)
+            self.stems.append(stem)
+        return i
+
+    def seconds(self):
+        return self.frames / self.sr
+
+    def summary(self):
+        # "3:12, 41 events (12 volume, 4 mute, ...)"
+        counts = Counter(field for _, _, field, _ in self.events)
+        minutes, seconds = divmod(int(self.seconds()), 60)
+        return (
+            f"{minutes}:{seconds:02d}, {len(self.events)} events ("
+            + ", ".join(f"{n} {field}" for field, n in counts.most_common())
+            + ")"
+        )
+
+
+class Recorder:
+    def __init__(self, session):
+        self.session = session
+        self.recording = Recording(session.engine.sr)
+        self.last = [None] * len(session.engine.slots)
+        self.last_master = {}
+        self.end_position = None
+
+    def note(self, slot, field, value):
+        self.recording.events.append((self.recording.frames, slot, field, value))
+
+    def master(self, field, value):
+        if self.last_master.get(field, self) != value:
+            self.last_master[field] = value
+            self.note(MASTER, field, value)
+
+    def block(self, engine, frames):
+        # called from the mixer, no locks and no io in here
+        recording = self.recording
+        self.master("frames", frames)
+        if engine.position != self.end_position:
+            self.note(MASTER, "position", engine.position)
+        self.master("master_volume", engine.master_volume)
+        session = self.session
+        self.master(
+            "tuning", (session.master_bpm, session.master_key, session.master_scale)
+        )
+
+        for i, slot in enumerate(engine.slots):
+            state = (
+                slot.empty,
+                slot.stem,
+                slot.pending_stem,
+                slot.join_stem,
+                slot.volume,
+                slot.gain,
+                slot.half,
+                slot.mute,
+                slot.solo,
+            )
+            last = self.last[i]
+            if state == last:
+                continue
+            for n, field in enumerate(SLOT_FIELDS):
+                if last is None or state[n] is not last[n] and state[n] != last[n]:
+                    value = state[n]
+                    if field in STEM_FIELDS:
+                        value = recording.stem_ref(value)
+                    self.note(i, field, value)
+            self.last[i] = state
+
+        recording.frames += frames
+
+    def done(self, engine):
+        # end of the block, where the position should be at the start of the next one
+        self.end_position = engine.position
+
+
+def start(session):
+    recorder = Recorder(session)
+    session.engine.recorder = recorder
+    log.info("Recording started.")
+    return recorder
+
+
+def stop(session):
+    # the finished Recording, None if nothing was recording
+    recorder = session.engine.recorder
+    if recorder is None:
+        return None
+    session.engine.recorder = None
+    recording = recorder.recording
+    log.info("Recording stopped: %s.", recording.summary())
+    return recording
+
+
+def replay_slots(count):
+    while len(_replay_slots) < count:
+        slot = Slot(len(_replay_slots))
+        slot.start()
+        _replay_slots.append(slot)
+    return _replay_slots[:count]
+
+
+def render(recording, filename):
+    # the whole performance to filename, returns how long it took
+    t0 = time.perf_counter()
+    with _replay_lock, trace.span("render_performance", file=filename):
+        slots = replay_slots(
+            max((slot for _, slot, _, _ in recording.events), default=-1) + 1
+        )
+        for slot in slots:
+            slot.empty = True
+            slot.stem = slot.pending_stem = slot.join_stem = None
+        engine = AudioEngine(slots, recording.sr)
+
+        events = recording.events
+        n = 0
+        t = 0
+        frames = 0
+        out = None
+        with sf.SoundFile(filename, "w", recording.sr, CHANNELS, "FLOAT") as wav:
+            while t < recording.frames:
+                while n < len(events) and events[n][0] <= t:
+                    _, i, field, value = events[n]
+                    n += 1
+                    if i == MASTER:
+                        if field == "frames":
+                            frames = value
+                            out = np.zeros((frames, CHANNELS), np.float32)
+                        elif field == "position":
+                            engine.position = value
+                        elif field == "master_volume":
+                            engine.master_volume = value
+                    elif field in STEM_FIELDS:
+                        setattr(
+                            slots[i],
+                            field,
+                            None if value is None else recording.stems[value],
+                        )
+                    else:
+                        setattr(slots[i], field, value)
+                engine.mix_block(out, frames)
+                wav.write(out)
+                t += frames
+
+        for slot in slots:
+            # dont keep the stems alive through the replay slots
+            slot.stem = slot.pending_stem = slot.join_stem = None
+
+    took = time.perf_counter() - t0
+    log.info(
+        "Performance rendered to %s (%.1f s of audio in %.1f s, %.0fx real time).",
+        filename,
+        recording.seconds(),
+        took,
+        recording.seconds() / max(took, 1e-9),
+        extra={"file": filename},
+    )
+    return took
+
+
+def render_in_background(recording, filename):
+    # not a daemon, quitting waits for the wav to be finished
+    thread = threading.Thread(
+        target=guarded_render, args=(recording, filename), name="render-performance"
+    )
+    thread.start()
+    return thread
+
+
+def guarded_render(recording, filename):
+    try:
+        render(recording, filename)
+    except Exception as e:
+        log.error("Performance render failed: %s", e, extra={"file": filename})
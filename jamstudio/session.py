@@ -0,0 +1,836 @@
+# a jam: the master tuning, the 12 slots and everything that fills them
+# nothing happens on import, the slot threads start when a session is made
+
+import logging
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import soundfile as sf
+
+from . import engine, loudness, memory, stretch, trace, waveform
+from .engine import AudioEngine, PackedStem, Slot, pack_stem
+from .library import find_song, load_audio_data, read_meta, stem_files
+from .memory import BudgetExceeded, MemoryTracker
+from .music import key_shift_semitones, match_bpm_timescale
+from .pool import StageCache, StemPool
+from .prefetch import Prefetcher
+from .preview import PreviewStream
+from .store import WARM_DIR, DiskStore
+from .stretch import (
+    RenderCancelled,
+    fit_length,
+    resample_linear,
+    resample_rate,
+    resampled_length,
+    resolve_backend,
+    shift_stage,
+    stretch_stage,
+)
+
+log = logging.getLogger(__name__)
+
+NUM_SLOTS = 12
+
+# load_status entry while a project is still being planned, see start_load
+PLANNING = "planning"
+
+# a warmed-up stem this many samples off the loop length just gets padded/trimmed
+WARM_FIT_SAMPLES = 64
+
+
+def pick_stem_file(song_folder, stem_type, master_scale):
+    # (file name, its scale) for a stem, the relative mode file if theres none in
+    # master_scale. (None, None) if theres no file at all
+    files = stem_files(song_folder)
+    if stem_type == "drums":
+        scales = ("neutral",)
+    else:
+        scales = (master_scale, "minor" if master_scale == "major" else "major")
+    for scale in scales:
+        if (stem_type, scale) in files:
+            return files[stem_type, scale], scale
+    return None, None
+
+
+def plan_stem(song_folder, stem_type, profile, master, loop_len=0, say=None):
+    # works out which file a stem comes from and what has to happen to it to fit
+    # master (bpm, key, scale), returns None if theres no file
+    # loop_len is the length its fitted to, 0 means its own length
+    # say gets the progress notes instead of the log (warm-up and prefetch pass their own)
+    info = say or log.info
+    error = say or log.error
+    if profile not in stretch.PROCESSING_PROFILES:
+        profile = stretch.profile_for(stem_type)
+
+    meta = read_meta(song_folder)
+    song_key = meta["key"]
+    song_bpm = meta["bpm"]
+
+    info(f"Loading stem '{stem_type}' from: {song_folder}")
+
+    master_bpm, master_key, master_scale = master
+
+    file_to_load, loaded_scale = pick_stem_file(song_folder, stem_type, master_scale)
+    if file_to_load is None:
+        error(f"No stem files found for {stem_type}.")
+        return None
+    if loaded_scale not in (master_scale, "neutral"):
+        info(
+            f"No matching mode file found. Falling back to the relative mode of {loaded_scale}."
+        )
+
+    full_path = os.path.join(song_folder, file_to_load)
+
+    # time Stretch
+    adjusted_bpm = match_bpm_timescale(song_bpm, master_bpm)
+    stretch_ratio = master_bpm / adjusted_bpm
+    if stretch_ratio != 1.0:
+        info(
+            f"Applying time stretch: {song_bpm} base BPM -> {adjusted_bpm} multiple BPM -> {master_bpm} adjusted BPM"
+        )
+
+    # pitch shift (now with fallback shit)
+    semis = 0
+    if stem_type != "drums":
+        semis = key_shift_semitones(master_key, song_key)
+        if loaded_scale == master_scale:
+            pass
+
+        elif loaded_scale != "neutral":
+            info("Applying relative mode offset.")
+            if loaded_scale == "minor" and master_scale == "major":
+                semis -= 3
+            elif loaded_scale == "major" and master_scale == "minor":
+                semis += 3
+
+        if semis != 0:
+            info(f"Pitch shift: {semis:+d} semitones.")
+
+    # sync length, the micro stretch in render_stem lines it up to the sample
+    with trace.span("probe"):
+        src = sf.info(full_path)
+    # in engine frames, the source gets converted when its decoded
+    src_len = resampled_length(src.frames, src.samplerate, engine.SAMPLE_RATE)
+    est_len = int(round(src_len / stretch_ratio))
+    target_len = est_len
+    if loop_len:
+        ratio = loop_len / est_len
+        target_len = loop_len if 0.5 < ratio < 2.0 else None
+
+    key = (
+        os.path.abspath(full_path),
+        os.path.getmtime(full_path),
+        stem_type,
+        round(stretch_ratio, 6),
+        semis,
+        target_len,
+        profile,
+        resolve_backend(stem_type),
+        engine.STEM_STORAGE,
+        engine.SAMPLE_RATE,
+    )
+
+    return {
+        "path": full_path,
+        "song": os.path.basename(song_folder),
+        "type": stem_type,
+        "key": key,
+        "song_key": song_key,
+        "scale": loaded_scale,
+        "bpm": song_bpm,
+        "ratio": stretch_ratio,
+        "semis": semis,
+        "est_len": est_len,
+        "target_len": target_len,
+        "source_rate": src.samplerate,
+        "profile": profile,
+    }
+
+
+def source_key(path):
+    # a decoded file in the stage cache, at the engine rate
+    return ("source", os.path.abspath(path), os.path.getmtime(path), engine.SAMPLE_RATE)
+
+
+def warm_key(plan):
+    # the plan key without the loop length and storage, the warm-up command renders
+    # every stem at its own length in float32 since it cant know whatll be playing
+    key = plan["key"]
+    return (*key[:5], *key[6:8], key[9])
+
+
+class JamSession:
+    def __init__(self, samplerate=None):
+        self.slots = []
+        for i in range(NUM_SLOTS):
+            s = Slot(i)
+            s.start()
+            self.slots.append(s)
+
+        self.engine = AudioEngine(self.slots, samplerate)
+
+        self.master_bpm = None
+        self.master_key = None
+        self.master_scale = None
+
+        # hq renders run here, two at a time so they dont eat the whole cpu
+        self.render_pool = ThreadPoolExecutor(max_workers=2)
+        # streamed previews decode here, one per slot at most (see preview.py)
+        self.decode_pool = ThreadPoolExecutor(max_workers=NUM_SLOTS)
+        self.stem_pool = StemPool()
+        # decoded sources and stretched-but-not-shifted stems for retunes
+        self.stage_cache = StageCache()
+        self.slot_lock = threading.Lock()
+
+        # project loads decode and preview every slot at once
+        self.load_pool = ThreadPoolExecutor(max_workers=4)
+        self.load_futures = []
+        self.load_gen = 0
+        self.load_status = {}  # slot -> "queued"/"loading" while a project loads
+        self.load_started = False
+        self.load_t0 = 0.0
+
+        self.prefetcher = Prefetcher(self)
+        self.prefetcher.start()
+        self.warm_store = DiskStore(WARM_DIR)
+
+        # whats held in memory and the budget loads have to fit under (memory.py)
+        self.memory = MemoryTracker(
+            lambda: memory.resident_bytes(self), self.drop_caches
+        )
+
+    def reset_master(self):
+        self.master_bpm = None
+        self.master_key = None
+        self.master_scale = None
+
+    def restart(self):
+        log.info("Restarting...")
+        self.cancel_loads()
+        self.engine.stop()
+
+        for i in range(NUM_SLOTS):
+            self.clear_slot(i)
+
+        self.reset_master()
+
+        self.engine.max_length = 0
+        self.engine.position = 0
+        self.engine.start()
+
+        log.info("Restart complete.")
+
+    def add_stem_to_slot(self, slot_id, song_folder, stem_type, profile=None):
+        with trace.span(
+            "add_stem_to_slot",
+            slot=slot_id,
+            song=os.path.basename(song_folder),
+            stem=stem_type,
+        ):
+            self.load_stem(slot_id, song_folder, stem_type, profile)
+
+    def load_stem(self, slot_id, song_folder, stem_type, profile):
+        plan = self.plan_stem(song_folder, stem_type, profile)
+        if plan is not None:
+            self.load_planned(slot_id, plan)
+
+    def load_planned(self, slot_id, plan, mix=None, stem=None, join=False, gen=None):
+        # stem is an already processed one (from a bundle), otherwise it gets decoded
+        # join holds the slot back until the next loop boundary if the jam is playing
+        # gen is the load it belongs to, a newer load or a clear makes it stale
+        key = plan["key"]
+        stretch_ratio = plan["ratio"]
+        semis = plan["semis"]
+        target_len = plan["target_len"]
+
+        self.prefetcher.preempt()
+
+        stem_audio = None
+        tier = "hq"
+        if stem is None:
+            stem = self.stem_pool.acquire(key)
+            if stem is not None:
+                # same stem + same transform is already in memory, no work to do
+                log.info("Reusing already processed stem.", extra={"slot": slot_id})
+            else:
+                # rendered ahead of time, by the prefetcher or the warm-up command
+                stem = self.prefetcher.take(key)
+                if stem is None:
+                    stem = self.warm_stem(plan)
+                if stem is not None:
+                    log.info("Using pre-rendered stem.", extra={"slot": slot_id})
+                    stem = self.stem_pool.add(key, stem)
+        else:
+            stem = self.stem_pool.add(key, stem)
+
+        stream = None
+        cancel = None
+        if stem is None:
+            # project loads wait their turn if theres no room, one added by hand
+            # gets turned down so the ui isnt stuck waiting
+            def waiting():
+                if slot_id in self.load_status:
+                    self.load_status[slot_id] = "waiting for memory"
+
+            length = target_len or plan["est_len"]
+            stem_audio = self.stage_cache.get(source_key(plan["path"]))
+            try:
+                if stem_audio is not None:
+                    # decoded already (a retune), nothing to wait for
+                    with self.memory.load(
+                        f"slot {slot_id}",
+                        length * memory.FRAME_BYTES,
+                        wait=gen is not None,
+                        on_wait=waiting,
+                    ):
+                        if (
+                            stretch_ratio != 1.0
+                            or semis != 0
+                            or target_len != len(stem_audio)
+                        ):
+                            # just a resample to the right length so its in time,
+                            # pitch is rough
+                            with trace.span("preview", bytes=stem_audio.nbytes):
+                                stem = pack_stem(resample_linear(stem_audio, length))
+                            memory.hold("preview", stem.nbytes)
+                            tier = "preview"
+                        else:
+                            with trace.span("pack", bytes=stem_audio.nbytes):
+                                stem = self.stem_pool.add(key, pack_stem(stem_audio))
+                            memory.hold("pack", stem.nbytes)
+                else:
+                    # decoded a block at a time on its own thread, the slot plays
+                    # as soon as the first one is in. it starts decoding where the
+                    # slot starts playing, the loop start if it waits to join
+                    start = 0
+                    if not self.joins(self.slots[slot_id], join):
+                        start = self.engine.position
+                    if (mix or {}).get("half"):
+                        start += length // 2
+                    stream = PreviewStream(plan["path"], length, start)
+                    cancel = threading.Event()
+                    future = self.decode_pool.submit(
+                        self.stream_job, slot_id, stream, plan, gen, cancel, waiting
+                    )
+                    stream.ready.wait()
+                    if stream.error is not None:
+                        stream.published.set()
+                        raise stream.error
+                    stem = stream.stem
+                    tier = "preview"
+            except BudgetExceeded as e:
+                log.warning(
+                    "Slot %d not loaded, over the memory budget: %s",
+                    slot_id,
+                    e,
+                    extra={"slot": slot_id, "path": plan["path"]},
+                )
+                return False
+            if slot_id in self.load_status:
+                self.load_status[slot_id] = "loading"
+
+        if stream is None:
+            waveform.peaks_for(stem)
+            # measured once per file, after that its just the sidecar
+            gain = loudness.stem_gain(
+                plan["path"],
+                lambda: (
+                    stem_audio
+                    if stem_audio is not None
+                    else self.source_audio(plan["path"])
+                ),
+            )
+        else:
+            # a file thats never been measured gets its gain once its decoded
+            gain = 1.0
+            try:
+                entry = loudness.cached_loudness(plan["path"])
+                if entry is not None:
+                    gain = loudness.gain_for(entry)
+            except OSError:
+                pass
+
+        slot = self.slots[slot_id]
+        with self.slot_lock:
+            if gen is not None and gen != self.load_gen:
+                if tier == "hq":
+                    self.stem_pool.release(key)
+                if stream is not None:
+                    cancel.set()
+                    stream.published.set()
+                return False
+
+        self.drop_slot_stem(slot)
+
+        with self.slot_lock:
+            self.set_slot_info(slot, plan, mix)
+            slot.gain = gain
+            slot.tier = tier
+            slot.pool_key = key if tier == "hq" else None
+            if stream is not None:
+                # a clear or another load cancels the decode like it would a render
+                slot.render_cancel = cancel
+                slot.render_future = future
+
+            if self.joins(slot, join):
+                slot.join_stem = stem
+            else:
+                slot.stem = stem
+                slot.empty = False
+                self.engine.update_max_length()
+
+        if stream is not None:
+            stream.published.set()
+        elif tier == "preview":
+            self.start_render(slot, key, stem_audio, stretch_ratio, semis, target_len)
+        if tier == "preview":
+            log.info(
+                "Preview loaded, rendering full quality in the background.",
+                extra={"slot": slot_id, "path": plan["path"]},
+            )
+        else:
+            log.info("Stem loaded.", extra={"slot": slot_id, "path": plan["path"]})
+        return True
+
+    def joins(self, slot, join):
+        # whether a stem going into slot waits for the next loop boundary
+        playing = self.engine.is_playing() and any(not s.empty for s in self.slots)
+        return join and playing and slot.empty
+
+    def stream_job(self, slot_id, stream, plan, gen, cancel, waiting):
+        # decodes a streamed preview (load_planned waits for the first block), then
+        # hands what got decoded to the hq render
+        path = plan["path"]
+        try:
+            with self.memory.load(
+                f"slot {slot_id}",
+                memory.estimate(plan),
+                wait=gen is not None,
+                on_wait=waiting,
+            ):
+                memory.hold("preview", stream.stem.nbytes)
+                with trace.span("decode", path=os.path.basename(path)) as sp:
+                    memory.hold("decode", stream.source.nbytes)
+                    with trace.span("preview", bytes=stream.stem.nbytes):
+                        stream.decode_block()
+                    stream.ready.set()
+                    while stream.decode_block():
+                        if cancel.is_set():
+                            return
+                    sp["bytes"] = stream.source.nbytes
+                source = stream.source
+                if stream.rate != engine.SAMPLE_RATE:
+                    with trace.span("resample", bytes=source.nbytes, rate=stream.rate):
+                        source = resample_rate(source, stream.rate, engine.SAMPLE_RATE)
+                    memory.hold("resample", source.nbytes)
+        except Exception as e:
+            if not stream.ready.is_set():
+                # load_planned raises it
+                stream.error = e
+                stream.ready.set()
+            else:
+                log.error(
+                    "Could not decode %s: %s",
+                    os.path.basename(path),
+                    e,
+                    extra={"slot": slot_id, "path": path},
+                )
+            return
+        finally:
+            stream.close()
+        self.stage_cache.put(source_key(path), source)
+
+        stream.published.wait()
+        if cancel.is_set():
+            return
+        gain = loudness.stem_gain(path, lambda: source)
+        # drawn from a half decoded preview until now
+        stream.stem.peaks = None
+        waveform.peaks_for(stream.stem)
+
+        slot = self.slots[slot_id]
+        with self.slot_lock:
+            if slot.render_cancel is not cancel or cancel.is_set():
+                return
+            slot.gain = gain
+            self.start_render(
+                slot,
+                plan["key"],
+                source,
+                plan["ratio"],
+                plan["semis"],
+                plan["target_len"],
+                cancel,
+            )
+
+    def plan_stem(
+        self,
+        song_folder,
+        stem_type,
+        profile=None,
+        loop_len=None,
+        master=None,
+        notes=None,
+    ):
+        # sets the master if this is the first track, loop_len defaults to whats
+        # playing now. see plan_stem below for the rest
+        say = None if notes is None else notes.append
+        if master is None and self.master_bpm is None:
+            meta = read_meta(song_folder)
+            self.master_bpm = meta["bpm"]
+            self.master_key = meta["key"]
+            self.master_scale = meta.get("scale", "major")
+            (say or log.info)(f"Master set to {self.master_key} {self.master_scale}.")
+
+        if master is None:
+            master = (self.master_bpm, self.master_key, self.master_scale)
+        if loop_len is None:
+            loop_len = self.engine.max_length
+        return plan_stem(song_folder, stem_type, profile, master, loop_len, say)
+
+    def set_slot_info(self, slot, plan, mix=None):
+        # mix is the saved volume/half/mute/solo from a project
+        mix = mix or {}
+        slot.song_name = plan["song"]
+        slot.type = plan["type"]
+        slot.key = plan["song_key"]
+        slot.scale = plan["scale"]
+        slot.bpm = plan["bpm"]
+        slot.profile = plan["profile"]
+        slot.plan_key = plan["key"]
+        slot.offset = 0
+        slot.half = mix.get("half", 0)
+        if mix:
+            slot.volume = mix.get("volume", 1.0)
+            slot.target_volume = slot.volume
+            slot.mute = mix.get("mute", False)
+            slot.solo = mix.get("solo", False)
+
+    def start_render(
+        self, slot, key, source, stretch_ratio, semis, target_len, cancel=None
+    ):
+        # cancel carries on from a streamed decode, if there was one
+        self.prefetcher.preempt()
+        cancel = cancel or threading.Event()
+        slot.render_cancel = cancel
+        slot.render_future = self.render_pool.submit(
+            self.render_job,
+            slot,
+            key,
+            source,
+            stretch_ratio,
+            semis,
+            target_len,
+            slot.type,
+            slot.profile,
+            cancel,
+        )
+
+    def render_job(
+        self,
+        slot,
+        key,
+        source,
+        stretch_ratio,
+        semis,
+        target_len,
+        stem_type,
+        profile,
+        cancel,
+    ):
+        frames = target_len or int(round(len(source) / stretch_ratio))
+        try:
+            with self.memory.load(
+                f"slot {slot.idx} render",
+                memory.render_estimate(frames, stretch_ratio, semis),
+            ), trace.span("render", slot=slot.idx, stem=stem_type, profile=profile):
+                audio = self.render_plan(
+                    source,
+                    key,
+                    stretch_ratio,
+                    semis,
+                    target_len,
+                    stem_type,
+                    profile,
+                    cancel,
+                )
+        except RenderCancelled:
+            return
+        except BudgetExceeded as e:
+            log.warning(
+                "Slot %d stays on the preview, over the memory budget: %s",
+                slot.idx,
+                e,
+                extra={"slot": slot.idx},
+            )
+            return
+        except Exception as e:
+            log.error(
+                "Render failed for slot %d: %s", slot.idx, e, extra={"slot": slot.idx}
+            )
+            return
+
+        with self.slot_lock:
+            # a retune or clear got here first, toss it
+            if slot.render_cancel is not cancel or cancel.is_set():
+                return
+
+            with trace.span("pack", bytes=audio.nbytes):
+                audio = self.stem_pool.add(key, pack_stem(audio))
+            slot.pool_key = key
+
+            if slot.join_stem is not None:
+                # hasnt started playing yet, it can just join with the hq one
+                slot.join_stem = audio
+                slot.tier = "hq"
+            elif not self.engine.is_playing():
+                # nothing is playing so theres no loop point to wait for
+                slot.stem = audio
+                slot.tier = "hq"
+            else:
+                slot.pending_stem = audio
+        waveform.peaks_for(audio)
+        log.info(
+            "Slot %d full quality render done.", slot.idx, extra={"slot": slot.idx}
+        )
+
+    def warm_stem(self, plan):
+        found = self.warm_store.get(warm_key(plan))
+        if found is None:
+            return None
+        data = found[0]
+        target_len = plan["target_len"] or plan["est_len"]
+        if abs(len(data) - target_len) > WARM_FIT_SAMPLES:
+            return None
+        if len(data) == target_len and engine.STEM_STORAGE == "float32":
+            return PackedStem(data)
+        return pack_stem(fit_length(np.asarray(data), target_len))
+
+    def render_plan(
+        self, source, key, stretch_ratio, semis, target_len, stem_type, profile, cancel
+    ):
+        # the stretch only depends on the file, tempo and profile, so a key
+        # change can pick it back up and just redo the shift
+        stage_key = ("stretched", *key[:4], *key[6:8], key[9])
+        stretched = self.stage_cache.get(stage_key)
+        if stretched is None:
+            stretched = stretch_stage(source, stretch_ratio, stem_type, profile, cancel)
+            if stretched is not source:
+                self.stage_cache.put(stage_key, stretched)
+        return shift_stage(stretched, semis, target_len, stem_type, profile, cancel)
+
+    def source_audio(self, path):
+        # decoded file, kept around so a retune doesnt decode again
+        key = source_key(path)
+        audio = self.stage_cache.get(key)
+        if audio is None:
+            audio = load_audio_data(path)
+            self.stage_cache.put(key, audio)
+        return audio
+
+    def drop_caches(self):
+        # everything kept just in case, for when a load needs the room
+        self.stem_pool.drop_released()
+        self.stage_cache.clear()
+        self.prefetcher.store.spill()
+        log.info("Dropped cached stems to make room.")
+
+    def drop_slot_stem(self, slot):
+        # cancel whatever is rendering for this slot and give its stem back to the pool
+        with self.slot_lock:
+            if slot.render_cancel is not None:
+                slot.render_cancel.set()
+                if slot.render_future is not None:
+                    slot.render_future.cancel()
+            slot.render_cancel = None
+            slot.render_future = None
+            slot.pending_stem = None
+            slot.join_stem = None
+            if slot.pool_key is not None:
+                self.stem_pool.release(slot.pool_key)
+                slot.pool_key = None
+
+    def cancel_loads(self):
+        # anything still loading from an older project gets thrown away
+        self.prefetcher.preempt()
+        with self.slot_lock:
+            self.load_gen += 1
+            self.load_status = {}
+            self.load_started = False
+            self.load_futures = []
+        return self.load_gen
+
+    def start_load(self, t0):
+        # a new project load, anything older gets thrown away. PLANNING stays in
+        # load_status until planning_done() so the load cant look finished while
+        # slots are still being planned and submitted
+        gen = self.cancel_loads()
+        with self.slot_lock:
+            self.load_t0 = t0
+            self.load_status[PLANNING] = "planning"
+        return gen
+
+    def planning_done(self, gen):
+        self.load_finished(PLANNING, False, gen)
+
+    def submit_load(self, slot_id, job, gen):
+        # job does the actual loading and returns True if the slot got filled
+        with self.slot_lock:
+            self.load_status[slot_id] = "queued"
+        self.load_futures.append(
+            self.load_pool.submit(self.load_job, slot_id, job, gen)
+        )
+
+    def load_job(self, slot_id, job, gen):
+        if gen != self.load_gen:
+            return
+        self.load_status[slot_id] = "loading"
+        try:
+            with trace.span("load_slot", slot=slot_id):
+                loaded = job()
+        except Exception as e:
+            log.error("Could not load slot %d: %s", slot_id, e, extra={"slot": slot_id})
+            loaded = False
+        self.load_finished(slot_id, loaded, gen)
+
+    def load_finished(self, key, loaded, gen):
+        # key is a slot or PLANNING. the only place a project load starts the engine
+        with self.slot_lock:
+            if gen != self.load_gen or key not in self.load_status:
+                return
+            del self.load_status[key]
+            done = not self.load_status
+            # the first slot in starts the jam, the rest join on the loop
+            if (loaded or done) and not self.load_started:
+                self.load_started = True
+                if not self.engine.is_playing():
+                    self.engine.start()
+
+        if done:
+            log.info("Project loaded successfully.")
+            trace.print_summary("Load timings", trace.spans_since(self.load_t0))
+
+    def is_loading(self):
+        return bool(self.load_status)
+
+    def finish_renders(self):
+        # block until every load and hq render is in, used before exporting
+        for future in list(self.load_futures):
+            future.result()
+        for slot in self.slots:
+            # a streamed decode hands over to a render when its done, so wait
+            # until the future stops changing
+            future = slot.render_future
+            while future is not None and not future.cancelled():
+                future.result()
+                if slot.render_future is future:
+                    break
+                future = slot.render_future
+            if slot.join_stem is not None:
+                slot.stem = slot.join_stem
+                slot.join_stem = None
+                slot.empty = False
+            if slot.pending_stem is not None:
+                slot.stem = slot.pending_stem
+                slot.pending_stem = None
+                slot.tier = "hq"
+
+    def clear_slot(self, i):
+        slot = self.slots[i]
+        self.drop_slot_stem(slot)
+        slot.empty = True
+        slot.stem = None
+        slot.tier = None
+        slot.song_name = None
+        slot.type = None
+        slot.profile = None
+        slot.plan_key = None
+        slot.volume = 1.0
+        slot.target_volume = 1.0
+        slot.gain = 1.0
+        slot.offset = 0
+        slot.half = 0
+        slot.mute = False
+        slot.solo = False
+        log.info("Slot %d cleared.", i, extra={"slot": i})
+
+        # nothing left playing to line up with, anything waiting comes straight in
+        if all(s.empty for s in self.slots):
+            for s in self.slots:
+                if s.join_stem is not None:
+                    s.stem = s.join_stem
+                    s.join_stem = None
+                    s.empty = False
+
+    def shift_slot(self, i):
+        slot = self.slots[i]
+        slot.half = 1 if slot.half == 0 else 0
+
+    def toggle_playback(self):
+        (self.engine.stop if self.engine.is_playing() else self.engine.start)()
+
+    def retune(self, key, scale, bpm=None, on_progress=None):
+        # move the whole jam to a new master key/mode/bpm
+        # every slot gets a fresh plan and only the ones whose transform changed
+        # get reprocessed, drums dont care about the key and a bpm change keeps
+        # the pitch decision. on_progress gets called before each slot so the ui can redraw
+        old_bpm = self.master_bpm
+        self.master_key = key
+        self.master_scale = scale
+        if bpm:
+            self.master_bpm = bpm
+
+        self.cancel_loads()
+
+        # same tempo keeps the loop length, otherwise the first slot sets it like a fresh load
+        loop_len = self.engine.max_length if self.master_bpm == old_bpm else 0
+
+        todo = []
+        for i, slot in enumerate(self.slots):
+            if slot.empty:
+                continue
+
+            song_path = find_song(slot.song_name)
+            if not song_path:
+                log.error(
+                    "Could not locate song '%s' in any known folder.",
+                    slot.song_name,
+                    extra={"slot": i},
+                )
+                continue
+
+            plan = self.plan_stem(song_path, slot.type, slot.profile, loop_len)
+            if plan is None:
+                continue
+            if not loop_len:
+                loop_len = plan["target_len"] or plan["est_len"]
+
+            if plan["key"] == slot.plan_key:
+                log.info(
+                    "Slot %d already matches, nothing to do.", i, extra={"slot": i}
+                )
+                continue
+
+            mix = {
+                "volume": slot.target_volume,
+                "half": slot.half,
+                "mute": slot.mute,
+                "solo": slot.solo,
+            }
+            todo.append((i, plan, mix))
+
+        if not todo:
+            log.info("Nothing to retune.")
+            return
+
+        self.engine.stop()
+
+        for i, plan, mix in todo:
+            log.info("Reloading slot %d...", i, extra={"slot": i})
+            if on_progress:
+                on_progress()
+            self.load_planned(i, plan, mix)
+
+        self.engine.start()
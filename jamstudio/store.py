@@ -0,0 +1,117 @@
+# processed stems on disk as plain .npy files so they can be memory mapped back in
+# one index.json per folder, only one process should write to a store at a time
+
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+
+import numpy as np
+
+log = logging.getLogger(__name__)
+
+# where the warm-up command leaves its renders, see warmup.py
+WARM_DIR = os.path.join("cache", "warm")
+
+# bump when whats inside a stored stem changes so old files stop matching
+# 2: stems are kept at their file level, the slot gain does the loudness
+STEM_FORMAT = 2
+
+
+class DiskStore:
+    # max_mb None means it never throws anything out
+    def __init__(self, directory, max_mb=None):
+        self.lock = threading.RLock()
+        self.directory = directory
+        self.max_mb = max_mb
+        self.index = None  # digest -> {"scale", "bytes", "used"}
+
+    def load_index(self):
+        if self.index is not None:
+            return
+        self.index = {}
+        try:
+            with open(os.path.join(self.directory, "index.json"), "r") as f:
+                self.index = json.load(f)
+        except Exception:
+            pass
+
+    def save_index(self):
+        # written to a temp file first so a crash mid write doesnt lose the whole index
+        try:
+            os.makedirs(self.directory, exist_ok=True)
+            path = os.path.join(self.directory, "index.json")
+            with open(path + ".tmp", "w") as f:
+                json.dump(self.index, f)
+            os.replace(path + ".tmp", path)
+        except Exception as e:
+            log.error("Could not save stem store index: %s", e)
+
+    def digest(self, key):
+        return hashlib.sha1(repr((STEM_FORMAT, key)).encode()).hexdigest()
+
+    def path_for(self, key):
+        return os.path.join(self.directory, self.digest(key) + ".npy")
+
+    def __contains__(self, key):
+        with self.lock:
+            self.load_index()
+            return self.digest(key) in self.index
+
+    def put(self, key, data, scale=1.0):
+        with self.lock:
+            self.load_index()
+            digest = self.digest(key)
+            if digest not in self.index:
+                try:
+                    os.makedirs(self.directory, exist_ok=True)
+                    np.save(self.path_for(key), data)
+                except Exception as e:
+                    log.error("Could not write to the stem store: %s", e)
+                    return
+            self.add_entry(key, data.nbytes, scale)
+
+    def add_entry(self, key, nbytes, scale=1.0):
+        # for when the .npy was written somewhere else (a worker process)
+        with self.lock:
+            self.load_index()
+            self.index[self.digest(key)] = {
+                "scale": float(scale),
+                "bytes": int(nbytes),
+                "used": time.time(),
+            }
+            self.trim()
+            self.save_index()
+
+    def trim(self):
+        # caller holds the lock, oldest out until its under budget
+        if self.max_mb is None:
+            return
+        total = sum(e["bytes"] for e in self.index.values())
+        for old in sorted(self.index, key=lambda d: self.index[d].get("used", 0)):
+            if total <= self.max_mb * 1024 * 1024:
+                break
+            total -= self.index[old]["bytes"]
+            del self.index[old]
+            try:
+                os.remove(os.path.join(self.directory, old + ".npy"))
+            except OSError:
+                pass
+
+    def get(self, key):
+        # (memory mapped array, scale) or None
+        with self.lock:
+            self.load_index()
+            digest = self.digest(key)
+            entry = self.index.get(digest)
+            if entry is None:
+                return None
+            try:
+                data = np.load(self.path_for(key), mmap_mode="r")
+            except Exception:
+                del self.index[digest]
+                return None
+            entry["used"] = time.time()
+            return data, entry["scale"]
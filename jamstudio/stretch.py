@@ -0,0 +1,591 @@
+# time stretching and pitch shifting
+# rubberband when we can find it, a couple of numpy stretchers when we cant
+#
+# the numpy ones keep the length, the pitch and the level of anything tonal. noise
+# (breath, hats, reverb tails) comes out quieter, its frames dont line up so the
+# overlap add sums them in power instead of amplitude: up to ~3 dB through the
+# vocoder, ~1 dB through wsola
+#
+#   python -m jamstudio.stretch [file] --rate 1.0667 --semitones 3
+#
+# times every backend it can find on file (a made up tone and noise without one) and
+# prints how far the length, level and pitch ended up from where they should be
+
+import argparse
+import logging
+import math
+import os
+import shutil
+import subprocess
+import tempfile
+import time
+
+import numpy as np
+import soundfile as sf
+
+from . import engine as mixer
+from . import logs, memory, trace
+
+log = logging.getLogger(__name__)
+
+# which stretcher each stem type uses
+# "auto" = rubberband if the binary can be found, otherwise the numpy fallback
+# "phase_vocoder" and "wsola" force the numpy ones (wsola keeps drum hits tight)
+STRETCH_BACKENDS = {
+    "vocals": "auto",
+    "bass": "auto",
+    "lead": "auto",
+    "drums": "auto",
+}
+BACKEND_CHOICES = ["auto", "rubberband", "phase_vocoder", "wsola"]
+
+# sample rate conversion (resample_rate), taps either side of each output at the
+# lower rate, kaiser beta and where the passband stops as a share of nyquist
+RESAMPLE_HALF_TAPS = 16
+RESAMPLE_BETA = 8.6
+RESAMPLE_ROLLOFF = 0.94
+# outputs per phase done at a time, keeps what each product touches in cache
+RESAMPLE_CHUNK = 1024
+
+# rubberband quality profiles, "args" goes to every stem and the stem type keys add on top
+PROCESSING_PROFILES = {
+    # R2, quickest. drums get the short window so the hits stay crisp
+    "fast": {"engine": "r2", "args": [], "drums": ["--crisp", "6"]},
+    # R3 with the default options
+    "balanced": {"engine": "r3", "args": []},
+    # R3 + formant preservation so shifted vocals dont go chipmunk
+    "finest": {
+        "engine": "r3",
+        "args": [],
+        "vocals": ["--formant"],
+        "lead": ["--formant"],
+    },
+}
+
+# which profile each stem type gets when the global setting is "per stem"
+STEM_PROFILES = {
+    "vocals": "finest",
+    "bass": "balanced",
+    "lead": "balanced",
+    "drums": "fast",
+}
+PROFILE_CHOICES = ["per stem", "fast", "balanced", "finest"]
+global_profile = "per stem"
+
+PV_FFT_SIZE = 2048
+PV_HOP = PV_FFT_SIZE // 4
+PV_BATCH_FRAMES = 256
+
+WSOLA_FRAME = 1024
+WSOLA_HOP = WSOLA_FRAME // 2
+WSOLA_TOLERANCE = 256
+WSOLA_DECIMATE = 4
+
+_rubberband_paths = {}
+
+
+class RenderCancelled(Exception):
+    pass
+
+
+def find_rubberband(engine="r2"):
+    # returns (exe, extra args) or None
+    # the bundled windows exes sit next to main.py, everything else uses PATH
+    if engine not in _rubberband_paths:
+        found = None
+        names = ["rubberband-r3", "rubberband"] if engine == "r3" else ["rubberband"]
+        for name in names:
+            exe = shutil.which(name)
+            if exe is None and os.name == "nt" and os.path.exists(name + ".exe"):
+                exe = os.path.abspath(name + ".exe")
+            if exe:
+                # plain rubberband 3.x can still do R3 with --fine
+                extra = ["--fine"] if engine == "r3" and name == "rubberband" else []
+                found = (exe, extra)
+                break
+        if found is None and engine == "r2":
+            log.info("rubberband not found, using the built-in numpy stretcher.")
+        _rubberband_paths[engine] = found
+    return _rubberband_paths[engine]
+
+
+def rubberband_available():
+    return find_rubberband("r2") is not None
+
+
+def run_rubberband(audio, args, engine="r2", cancel=None):
+    # same deal as pyrubberband (temp wav in, temp wav out) but we pick the exe
+    # and can kill it halfway if the render gets cancelled
+    exe, extra = find_rubberband(engine) or find_rubberband("r2")
+
+    fd, infile = tempfile.mkstemp(suffix=".wav")
+    os.close(fd)
+    fd, outfile = tempfile.mkstemp(suffix=".wav")
+    os.close(fd)
+
+    try:
+        sf.write(infile, audio, mixer.SAMPLE_RATE, subtype="FLOAT")
+        proc = subprocess.Popen(
+            [exe, "-q", *extra, *args, infile, outfile],
+            stdout=subprocess.DEVNULL,
+            stderr=subprocess.DEVNULL,
+        )
+        if cancel is None:
+            proc.wait()
+        else:
+            while proc.poll() is None:
+                if cancel.wait(0.02):
+                    proc.kill()
+                    proc.wait()
+                    raise RenderCancelled()
+        if proc.returncode != 0:
+            raise RuntimeError(f"{os.path.basename(exe)} exited with {proc.returncode}")
+        out, _ = sf.read(outfile, dtype="float32", always_2d=True)
+    finally:
+        os.unlink(infile)
+        os.unlink(outfile)
+
+    return out
+
+
+def profile_for(stem_type):
+    if global_profile in PROCESSING_PROFILES:
+        return global_profile
+    return STEM_PROFILES.get(stem_type, "balanced")
+
+
+def profile_rb_settings(profile, stem_type):
+    prof = PROCESSING_PROFILES.get(profile, PROCESSING_PROFILES["balanced"])
+    return prof["engine"], prof["args"] + prof.get(stem_type, [])
+
+
+def resolve_backend(stem_type):
+    backend = STRETCH_BACKENDS.get(stem_type, "auto")
+    if backend == "rubberband" and not rubberband_available():
+        backend = "auto"
+    if backend == "auto":
+        if rubberband_available():
+            return "rubberband"
+        return "wsola" if stem_type == "drums" else "phase_vocoder"
+    return backend
+
+
+def resample_linear(audio, length):
+    # dirt cheap resample for previews, wraps around since its a loop
+    n = len(audio)
+    if n == length or n == 0:
+        return audio
+    pos = np.arange(length) * (n / length)
+    i0 = pos.astype(np.int64)
+    frac = (pos - i0).astype(np.float32)[:, None]
+    i1 = (i0 + 1) % n
+    return audio[i0] * (1 - frac) + audio[i1] * frac
+
+
+def resampled_length(frames, sr_in, sr_out):
+    return int(round(frames * sr_out / sr_in))
+
+
+def polyphase_taps(up, down):
+    # (up, taps) kaiser windowed sinc, row p is the filter for an output that lands
+    # p/up of the way between two input samples. cutoff sits just under the lower
+    # of the two nyquists
+    cut = RESAMPLE_ROLLOFF * min(1.0, up / down)
+    half = int(np.ceil(RESAMPLE_HALF_TAPS / cut))
+    k = np.arange(-half + 1, half + 1)
+    t = np.arange(up)[:, None] / up - k[None, :]
+    window = np.i0(RESAMPLE_BETA * np.sqrt(np.clip(1 - (t / half) ** 2, 0, None)))
+    taps = cut * np.sinc(cut * t) * window / np.i0(RESAMPLE_BETA)
+    # every phase passes dc at exactly 1
+    taps /= taps.sum(axis=1, keepdims=True)
+    return taps.astype(np.float32), half
+
+
+def resample_rate(audio, sr_in, sr_out):
+    # proper sample rate conversion for sources that dont match the engine.
+    # output n sits at input time n*down/up, every output with the same n % up uses
+    # the same phase and steps through the input down samples at a time, so each
+    # phase is one strided matrix product over the whole file
+    if sr_in == sr_out or len(audio) == 0:
+        return audio
+    g = math.gcd(int(sr_in), int(sr_out))
+    up, down = int(sr_out) // g, int(sr_in) // g
+    taps, half = polyphase_taps(up, down)
+    width = taps.shape[1]
+
+    n_out = resampled_length(len(audio), sr_in, sr_out)
+    padded = np.concatenate(
+        (
+            np.zeros((half, audio.shape[1]), np.float32),
+            audio.astype(np.float32, copy=False),
+            np.zeros((half + down, audio.shape[1]), np.float32),
+        )
+    )
+    # (positions, channels, width) view, nothing gets copied here
+    windows = np.lib.stride_tricks.sliding_window_view(padded, width, axis=0)
+
+    out = np.empty((n_out, audio.shape[1]), np.float32)
+    block = RESAMPLE_CHUNK * up
+    for first in range(0, n_out, block):
+        last = min(n_out, first + block)
+        base = first // up * down
+        for r in range(min(up, last - first)):
+            count = len(range(first + r, last, up))
+            start = base + (r * down) // up + 1
+            phase = (r * down) % up
+            out[first + r : last : up] = (
+                windows[start : start + count * down : down] @ taps[phase]
+            )
+    return out
+
+
+def resample_to_length(audio, length):
+    # band limited resample by chopping/padding the spectrum
+    # stems are loops anyway so the periodic assumption of the fft is fine
+    n = len(audio)
+    if n == length or n == 0:
+        return audio
+    spec = np.fft.rfft(audio, axis=0)
+    bins = length // 2 + 1
+    if bins <= spec.shape[0]:
+        spec = spec[:bins]
+    else:
+        spec = np.vstack(
+            (spec, np.zeros((bins - spec.shape[0], spec.shape[1]), dtype=spec.dtype))
+        )
+    out = np.fft.irfft(spec, n=length, axis=0) * (length / n)
+    return out.astype(np.float32)
+
+
+def _nearest_peak(mag):
+    # index of the closest spectral peak for every bin, per frame
+    n_bins = mag.shape[1]
+    idx = np.arange(n_bins)
+    peaks = np.zeros(mag.shape, dtype=bool)
+    peaks[:, 2:-2] = (
+        (mag[:, 2:-2] > mag[:, 1:-3])
+        & (mag[:, 2:-2] > mag[:, :-4])
+        & (mag[:, 2:-2] >= mag[:, 3:-1])
+        & (mag[:, 2:-2] >= mag[:, 4:])
+    )
+    # frames with no peaks at all just lock to themselves
+    no_peaks = ~peaks.any(axis=1)
+    peaks[no_peaks] = True
+
+    prev_peak = np.maximum.accumulate(np.where(peaks, idx, -1), axis=1)
+    next_peak = np.minimum.accumulate(
+        np.where(peaks, idx, n_bins * 2)[:, ::-1], axis=1
+    )[:, ::-1]
+
+    use_next = (prev_peak < 0) | (
+        (next_peak < n_bins) & (next_peak - idx < idx - prev_peak)
+    )
+    return np.where(use_next, next_peak, prev_peak)
+
+
+def pv_time_stretch(audio, rate, cancel=None):
+    # phase vocoder w/ identity phase locking, frames are processed in batches
+    # phases come from the mid channel and get applied to every channel so stereo stays put
+    # stems are loops so the edges get padded by wrapping around instead of with silence
+    n = len(audio)
+    out_len = int(round(n / rate))
+    channels = audio.shape[1]
+    n_fft = PV_FFT_SIZE
+    hop = PV_HOP
+    half = n_fft // 2
+    pad = n_fft
+
+    window = np.hanning(n_fft + 1)[:-1].astype(np.float32)
+    n_frames = (out_len + pad) // hop + 1
+
+    front = int(np.ceil(half * (rate + 1))) + 1
+    centers = np.arange(n_frames) * hop - pad + half
+    starts = np.round(centers * rate).astype(np.int64) - half + front
+    end_pad = max(0, int(starts[-1]) + hop + n_fft - (n + front))
+    padded = np.pad(audio, ((front, end_pad), (0, 0)), mode="wrap")
+
+    bin_advance = 2 * np.pi * hop * np.arange(half + 1) / n_fft
+    frame_idx = np.arange(n_fft)
+
+    out = np.zeros((n_frames + 3, hop, channels), dtype=np.float32)
+    phase_acc = None
+    last_dphi = None
+
+    for b0 in range(0, n_frames, PV_BATCH_FRAMES):
+        if cancel is not None and cancel.is_set():
+            raise RenderCancelled()
+        b_starts = starts[b0 : b0 + PV_BATCH_FRAMES]
+        kb = len(b_starts)
+
+        frames = padded[b_starts[:, None] + frame_idx] * window[None, :, None]
+        frames_next = (
+            padded[b_starts[:, None] + hop + frame_idx] * window[None, :, None]
+        )
+
+        spec = np.fft.rfft(frames, axis=1)
+        mid = spec.mean(axis=2)
+        mid_phase = np.angle(mid)
+        mid_next_phase = np.angle(np.fft.rfft(frames_next, axis=1).mean(axis=2))
+
+        # measured phase advance over exactly one hop
+        dphi = mid_next_phase - mid_phase - bin_advance
+        dphi -= 2 * np.pi * np.round(dphi / (2 * np.pi))
+        dphi += bin_advance
+
+        if phase_acc is None:
+            steps = np.vstack((mid_phase[:1], dphi[:-1]))
+            out_phase = np.cumsum(steps, axis=0)
+        else:
+            steps = np.vstack((last_dphi[None], dphi[:-1]))
+            out_phase = phase_acc + np.cumsum(steps, axis=0)
+        phase_acc = out_phase[-1]
+        last_dphi = dphi[-1]
+
+        # identity phase locking, every bin follows its nearest peak
+        peak_of = _nearest_peak(np.abs(mid))
+        locked = np.take_along_axis(out_phase, peak_of, axis=1) + (
+            mid_phase - np.take_along_axis(mid_phase, peak_of, axis=1)
+        )
+
+        rotate = np.exp(1j * (locked - mid_phase)).astype(np.complex64)
+        synth = np.fft.irfft(spec * rotate[:, :, None], n=n_fft, axis=1)
+        synth = synth.astype(np.float32) * window[None, :, None]
+
+        for j in range(4):
+            out[b0 + j : b0 + j + kb] += synth[:, j * hop : (j + 1) * hop]
+
+    # hann^2 at 75% overlap sums to 1.5
+    out = out.reshape(-1, channels)[pad : pad + out_len]
+    return (out / 1.5).astype(np.float32)
+
+
+def wsola_time_stretch(audio, rate, cancel=None):
+    # waveform similarity overlap add, way better than the vocoder for drum hits
+    # the search runs on a decimated mono copy, the windowing + overlap add is batched
+    n = len(audio)
+    out_len = int(round(n / rate))
+    channels = audio.shape[1]
+    frame = WSOLA_FRAME
+    hop = WSOLA_HOP
+    tol = WSOLA_TOLERANCE
+    dec = WSOLA_DECIMATE
+    half = frame // 2
+    pad = frame
+
+    n_frames = (out_len + pad) // hop + 1
+
+    front = int(np.ceil(half * (rate + 1))) + tol + 1
+    centers = np.arange(n_frames) * hop - pad + half
+    nominal = np.round(centers * rate).astype(np.int64) - half + front
+    end_pad = max(0, int(nominal[-1]) + tol + frame + hop + dec - (n + front))
+    padded = np.pad(audio, ((front, end_pad), (0, 0)), mode="wrap")
+
+    mono = padded.mean(axis=1)
+    usable = len(mono) // dec * dec
+    mono_dec = mono[:usable].reshape(-1, dec).mean(axis=1)
+
+    frame_d = frame // dec
+    tol_d = tol // dec
+
+    starts = np.empty(n_frames, dtype=np.int64)
+    starts[0] = nominal[0]
+    for k in range(1, n_frames):
+        if k % 256 == 0 and cancel is not None and cancel.is_set():
+            raise RenderCancelled()
+        # line up with the natural continuation of whatever we picked last time
+        cont = (starts[k - 1] + hop) // dec
+        template = mono_dec[cont : cont + frame_d]
+        lo = (nominal[k] - tol) // dec
+        region = mono_dec[lo : lo + frame_d + 2 * tol_d]
+        if len(template) < frame_d or len(region) < frame_d + 2 * tol_d:
+            starts[k] = nominal[k]
+            continue
+        corr = np.correlate(region, template, mode="valid")
+        starts[k] = (lo + int(np.argmax(corr))) * dec
+
+    window = np.hanning(frame + 1)[:-1].astype(np.float32)
+    frames = padded[starts[:, None] + np.arange(frame)] * window[None, :, None]
+
+    # hann at 50% overlap sums to 1 so theres nothing to normalize
+    out = np.zeros((n_frames + 1, hop, channels), dtype=np.float32)
+    out[:n_frames] += frames[:, :hop]
+    out[1:] += frames[:, hop:]
+
+    out = out.reshape(-1, channels)[pad : pad + out_len]
+    return out.astype(np.float32)
+
+
+def time_stretch(audio, rate, stem_type=None, profile="balanced", cancel=None):
+    if rate == 1.0:
+        return audio
+    backend = resolve_backend(stem_type)
+    if backend == "rubberband":
+        engine, extra = profile_rb_settings(profile, stem_type)
+        try:
+            return run_rubberband(audio, ["--tempo", str(rate), *extra], engine, cancel)
+        except RenderCancelled:
+            raise
+        except Exception as e:
+            log.warning("rubberband failed (%s), falling back to numpy.", e)
+            backend = "wsola" if stem_type == "drums" else "phase_vocoder"
+    if backend == "wsola":
+        return wsola_time_stretch(audio, rate, cancel)
+    return pv_time_stretch(audio, rate, cancel)
+
+
+def pitch_shift(audio, semitones, stem_type=None, profile="balanced", cancel=None):
+    if semitones == 0:
+        return audio
+    backend = resolve_backend(stem_type)
+    if backend == "rubberband":
+        engine, extra = profile_rb_settings(profile, stem_type)
+        try:
+            return run_rubberband(
+                audio, ["--pitch", str(semitones), *extra], engine, cancel
+            )
+        except RenderCancelled:
+            raise
+        except Exception as e:
+            log.warning("rubberband failed (%s), falling back to numpy.", e)
+            backend = "wsola" if stem_type == "drums" else "phase_vocoder"
+    # stretch by the pitch factor then resample back down to the original length
+    factor = 2 ** (semitones / 12)
+    if backend == "wsola":
+        stretched = wsola_time_stretch(audio, 1 / factor, cancel)
+    else:
+        stretched = pv_time_stretch(audio, 1 / factor, cancel)
+    return resample_to_length(stretched, len(audio))
+
+
+def fit_length(audio, length):
+    if len(audio) > length:
+        return audio[:length]
+    if len(audio) < length:
+        pad = length - len(audio)
+        return np.vstack((audio, np.zeros((pad, audio.shape[1]), dtype=np.float32)))
+    return audio
+
+
+def render_stem(audio, stretch_ratio, semis, target_len, stem_type, profile, cancel):
+    # the full quality chain: stretch, shift, then micro stretch to the exact loop length
+    audio = stretch_stage(audio, stretch_ratio, stem_type, profile, cancel)
+    return shift_stage(audio, semis, target_len, stem_type, profile, cancel)
+
+
+def stretch_stage(audio, stretch_ratio, stem_type, profile, cancel):
+    # the tempo part on its own, a key change can start again from this
+    if stretch_ratio == 1.0:
+        return audio
+    with trace.span(
+        "time_stretch",
+        stem=stem_type,
+        backend=resolve_backend(stem_type),
+        bytes=audio.nbytes,
+    ):
+        audio = time_stretch(audio, stretch_ratio, stem_type, profile, cancel)
+    memory.hold("time_stretch", audio.nbytes)
+    return audio
+
+
+def shift_stage(audio, semis, target_len, stem_type, profile, cancel):
+    backend = resolve_backend(stem_type)
+    if semis != 0:
+        with trace.span(
+            "pitch_shift", stem=stem_type, backend=backend, bytes=audio.nbytes
+        ):
+            audio = pitch_shift(audio, semis, stem_type, profile, cancel)
+        memory.hold("pitch_shift", audio.nbytes)
+    if target_len is not None and len(audio) != target_len:
+        with trace.span(
+            "micro_stretch", stem=stem_type, backend=backend, bytes=audio.nbytes
+        ):
+            audio = time_stretch(
+                audio, len(audio) / target_len, stem_type, profile, cancel
+            )
+            audio = fit_length(audio, target_len)
+        memory.hold("micro_stretch", audio.nbytes)
+    return audio
+
+
+def dominant_freq(audio, sr):
+    # strongest frequency of the first channel, refined between bins
+    x = audio[:, 0] * np.hanning(len(audio))
+    mag = np.abs(np.fft.rfft(x))
+    k = int(np.argmax(mag[1:-1])) + 1
+    a, b, c = np.log(mag[k - 1 : k + 2] + 1e-12)
+    return (k + 0.5 * (a - c) / (a - 2 * b + c)) * sr / len(audio)
+
+
+def rms_db(audio):
+    return 10 * np.log10(np.mean(audio.astype(np.float64) ** 2) + 1e-20)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        prog="python -m jamstudio.stretch",
+        description="Time the stretch backends and check what comes out.",
+    )
+    parser.add_argument("file", nargs="?", help="audio to stretch")
+    parser.add_argument("--rate", type=float, default=128 / 120)
+    parser.add_argument("--semitones", type=int, default=3)
+    parser.add_argument("--seconds", type=float, default=30.0)
+    args = parser.parse_args(argv)
+    # the cli prints its own report, logs.setup() is for what the modules say
+    logs.setup()
+
+    sr = mixer.SAMPLE_RATE
+    if args.file:
+        audio, sr = sf.read(args.file, dtype="float32", always_2d=True)
+        audio = audio[: int(args.seconds * sr)]
+    else:
+        t = np.arange(int(args.seconds * sr)) / sr
+        rng = np.random.default_rng(0)
+        tone = 0.3 * np.sin(2 * np.pi * 440 * t) + rng.normal(0, 0.05, len(t))
+        audio = np.stack((tone, tone), axis=1).astype(np.float32)
+    t = np.arange(2 * sr) / sr
+    probe = np.repeat(0.5 * np.sin(2 * np.pi * 440 * t)[:, None], 2, axis=1)
+    probe = probe.astype(np.float32)
+
+    backends = ["phase_vocoder", "wsola"]
+    if rubberband_available():
+        backends.append("rubberband")
+    else:
+        print("rubberband not found, only the numpy backends get compared.")
+    seconds = len(audio) / sr
+    print(f"{seconds:.1f} s of audio, rate {args.rate:g}, {args.semitones:+d} st")
+
+    saved = dict(STRETCH_BACKENDS)
+    try:
+        for backend in backends:
+            STRETCH_BACKENDS["vocals"] = backend
+            for what, run, length, freq in (
+                (
+                    "stretch",
+                    lambda x: time_stretch(x, args.rate, "vocals"),
+                    int(round(len(audio) / args.rate)),
+                    440.0,
+                ),
+                (
+                    "shift",
+                    lambda x: pitch_shift(x, args.semitones, "vocals"),
+                    len(audio),
+                    440.0 * 2 ** (args.semitones / 12),
+                ),
+            ):
+                t0 = time.perf_counter()
+                out = run(audio)
+                took = time.perf_counter() - t0
+                cents = 1200 * np.log2(dominant_freq(run(probe), sr) / freq)
+                print(
+                    f"  {backend:13} {what:7} {took:6.2f} s "
+                    f"({seconds / took:5.1f}x real time), "
+                    f"length {len(out) - length:+d}, "
+                    f"level {rms_db(out) - rms_db(audio):+.2f} dB, "
+                    f"pitch {cents:+.1f} cents"
+                )
+    finally:
+        STRETCH_BACKENDS.update(saved)
+
+
+if __name__ == "__main__":
+    main()
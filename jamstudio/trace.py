@@ -0,0 +1,114 @@
+# tiny tracing layer so slow loads can be picked apart
+# spans go into a ring, export_chrome_trace() writes them out for chrome://tracing / perfetto
+
+import collections
+import json
+import logging
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+log = logging.getLogger(__name__)
+
+enabled = True
+
+# enough for a few hundred project loads, old spans just fall off
+MAX_SPANS = 50000
+
+_t0 = time.perf_counter()
+_spans = collections.deque(maxlen=MAX_SPANS)
+_thread_names = {}
+
+
+@contextmanager
+def span(name, **args):
+    # with span("decode", path=p) as sp: ... sp["bytes"] = audio.nbytes
+    if not enabled:
+        yield args
+        return
+
+    start = time.perf_counter()
+    try:
+        yield args
+    finally:
+        record(name, start, time.perf_counter(), **args)
+
+
+def record(name, start, end, **args):
+    # for stages that dont fit in a with block, start/end are time.perf_counter() values
+    if not enabled:
+        return
+    thread = threading.current_thread()
+    _thread_names[thread.ident] = thread.name
+    # deque.append is atomic, no lock needed from the render threads
+    _spans.append((name, start - _t0, end - start, thread.ident, args))
+
+
+def spans_since(t):
+    # t is a time.perf_counter() value
+    t -= _t0
+    return [s for s in list(_spans) if s[1] >= t]
+
+
+def summarize(spans):
+    # name -> (count, total seconds, total bytes)
+    totals = {}
+    for name, _, dur, _, args in spans:
+        count, total, nbytes = totals.get(name, (0, 0.0, 0))
+        totals[name] = (count + 1, total + dur, nbytes + args.get("bytes", 0))
+    return totals
+
+
+def print_summary(title, spans):
+    totals = summarize(spans)
+    if not totals:
+        return
+    lines = [f"{title}:"]
+    for name, (count, total, nbytes) in sorted(
+        totals.items(), key=lambda kv: -kv[1][1]
+    ):
+        line = f"  {name:<24} {count:>4}x {total * 1000:>9.1f} ms"
+        if nbytes:
+            line += f" {nbytes / (1024 * 1024):>8.1f} MB"
+        lines.append(line)
+    # one record so the table doesnt get split up by other threads
+    log.info("\n".join(lines))
+
+
+def export_chrome_trace(path="trace.json"):
+    pid = os.getpid()
+    events = []
+    for ident, tname in list(_thread_names.items()):
+        events.append(
+            {
+                "name": "thread_name",
+                "ph": "M",
+                "pid": pid,
+                "tid": ident,
+                "args": {"name": tname},
+            }
+        )
+
+    for name, start, dur, ident, args in list(_spans):
+        events.append(
+            {
+                "name": name,
+                "ph": "X",
+                "ts": round(start * 1e6, 1),
+                "dur": round(dur * 1e6, 1),
+                "pid": pid,
+                "tid": ident,
+                "args": {
+                    k: v if isinstance(v, (int, float)) else str(v)
+                    for k, v in args.items()
+                },
+            }
+        )
+
+    try:
+        with open(path, "w") as f:
+            json.dump({"traceEvents": events, "displayTimeUnit": "ms"}, f)
+        log.info("Trace written to: %s (%d events)", path, len(events))
+    except Exception as e:
+        log.error("Could not write trace: %s", e)
@@ -0,0 +1,205 @@
+# pre-render a library for known targets before a gig
+#
+#   python -m jamstudio.warmup 120:C:major 128:A:minor
+#   python -m jamstudio.warmup 120:C:major --songs "Song One" "Song Two" --workers 4
+#
+# run it from the app folder so it finds Songs/ and config.json. the renders go to
+# cache/warm and add_stem_to_slot picks them up instead of processing. anything
+# already in there gets skipped so you can stop it and run it again later
+
+import argparse
+import json
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import numpy as np
+
+from . import drivers, engine, logs, loudness, stretch
+from .library import find_song, get_song_list, load_audio_data
+from .music import KEY_TO_INT
+from .session import plan_stem, warm_key
+from .store import WARM_DIR, DiskStore
+
+STEM_TYPES = ["vocals", "bass", "lead", "drums"]
+
+
+def parse_target(text):
+    # "120:C:major" -> (120.0, "C", "major")
+    try:
+        bpm, key, scale = text.split(":")
+        bpm = float(bpm)
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"expected BPM:KEY:SCALE, got '{text}'")
+    if key not in KEY_TO_INT or scale not in ("major", "minor"):
+        raise argparse.ArgumentTypeError(f"unknown key or scale in '{text}'")
+    return bpm, key, scale
+
+
+def read_settings(path="config.json"):
+    # the stretch settings out of the apps config so the renders match what it would do
+    settings = {
+        "backends": dict(stretch.STRETCH_BACKENDS),
+        "stem_profiles": dict(stretch.STEM_PROFILES),
+        "profile": stretch.global_profile,
+        "sample_rate": engine.RATE_SETTING,
+    }
+    try:
+        with open(path, "r") as f:
+            config = json.load(f)
+        settings["backends"].update(config.get("stretch_backends", {}))
+        settings["stem_profiles"].update(config.get("stem_profiles", {}))
+        if config.get("profile") in stretch.PROFILE_CHOICES:
+            settings["profile"] = config["profile"]
+        if engine.valid_rate_setting(config.get("sample_rate")):
+            settings["sample_rate"] = config["sample_rate"]
+    except Exception:
+        pass
+    # rendered at the rate the app will play at, or they wont match its keys
+    if settings["sample_rate"] == "native":
+        settings["sample_rate"] = drivers.native_rate() or engine.SAMPLE_RATE
+    return settings
+
+
+def apply_settings(settings):
+    stretch.STRETCH_BACKENDS.update(settings["backends"])
+    stretch.STEM_PROFILES.update(settings["stem_profiles"])
+    stretch.global_profile = settings["profile"]
+    engine.SAMPLE_RATE = int(settings["sample_rate"])
+
+
+def render_one(plan, out_path):
+    # runs in a worker process
+    t0 = time.perf_counter()
+    source = load_audio_data(plan["path"])
+    # the source is decoded anyway, so its loudness comes along for free
+    level = None
+    if loudness.cached_loudness(plan["path"]) is None:
+        level = loudness.measure(source)
+    audio = stretch.render_stem(
+        source,
+        plan["ratio"],
+        plan["semis"],
+        plan["est_len"],
+        plan["type"],
+        plan["profile"],
+        None,
+    )
+    audio = np.ascontiguousarray(audio, dtype=np.float32)
+
+    # temp file then rename so a killed run never leaves half a stem behind
+    with open(out_path + ".tmp", "wb") as f:
+        np.save(f, audio)
+    os.replace(out_path + ".tmp", out_path)
+    return (
+        audio.nbytes,
+        len(source) / engine.SAMPLE_RATE,
+        time.perf_counter() - t0,
+        level,
+    )
+
+
+def collect_jobs(song_folders, targets, store):
+    jobs = {}
+    seen = set()
+    skipped = 0
+    for folder in song_folders:
+        for stem_type in STEM_TYPES:
+            for target in targets:
+                try:
+                    plan = plan_stem(folder, stem_type, None, target, 0, lambda m: None)
+                except Exception as e:
+                    print(f"Skipping {os.path.basename(folder)}: {e}")
+                    break
+                if plan is None or (plan["ratio"] == 1.0 and plan["semis"] == 0):
+                    continue
+                key = warm_key(plan)
+                if key in seen:
+                    # drums dont care about the key, same render for every target
+                    continue
+                seen.add(key)
+                if key in store:
+                    skipped += 1
+                    continue
+                jobs[key] = plan
+    return jobs, skipped
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        prog="python -m jamstudio.warmup",
+        description="Pre-render stems for known bpm/key targets.",
+    )
+    parser.add_argument(
+        "targets", nargs="+", type=parse_target, help="BPM:KEY:SCALE, e.g. 120:C:major"
+    )
+    parser.add_argument("--songs", nargs="+", help="song folder names (default: all)")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1)
+    args = parser.parse_args(argv)
+    # the cli prints its own report, logs.setup() is for what the modules say
+    logs.setup()
+
+    if args.songs:
+        folders = []
+        for name in args.songs:
+            folder = find_song(name)
+            if folder:
+                folders.append(folder)
+            else:
+                print(f"'{name}' not found, skipping.")
+    else:
+        folders = get_song_list()
+
+    settings = read_settings()
+    apply_settings(settings)
+
+    store = DiskStore(WARM_DIR)
+    jobs, skipped = collect_jobs(folders, args.targets, store)
+    print(
+        f"{len(jobs)} stems to render, {skipped} already done, "
+        f"{len(folders)} songs x {len(args.targets)} targets."
+    )
+    if not jobs:
+        return
+
+    os.makedirs(WARM_DIR, exist_ok=True)
+    t0 = time.perf_counter()
+    done = 0
+    audio_seconds = 0.0
+
+    with ProcessPoolExecutor(
+        max_workers=args.workers, initializer=apply_settings, initargs=(settings,)
+    ) as pool:
+        futures = {
+            pool.submit(render_one, plan, store.path_for(key)): key
+            for key, plan in jobs.items()
+        }
+        for future in as_completed(futures):
+            key = futures[future]
+            plan = jobs[key]
+            name = f"{os.path.basename(os.path.dirname(plan['path']))}/{plan['type']}"
+            try:
+                nbytes, seconds, took, level = future.result()
+            except Exception as e:
+                print(f"  failed {name}: {e}")
+                continue
+
+            store.add_entry(key, nbytes)
+            if level is not None:
+                loudness.save_loudness(plan["path"], level)
+            done += 1
+            audio_seconds += seconds
+            print(
+                f"  [{done}/{len(jobs)}] {name} x{plan['ratio']:.3f} "
+                f"{plan['semis']:+d} st in {took:.1f} s"
+            )
+
+    wall = time.perf_counter() - t0
+    print(
+        f"Done: {done} stems in {wall:.1f} s, {done / wall * 60:.1f} stems/min, "
+        f"{audio_seconds / wall:.1f} audio-seconds per second."
+    )
+
+
+if __name__ == "__main__":
+    main()
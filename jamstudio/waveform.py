@@ -0,0 +1,86 @@
+# min/max peak pyramids so the ui can draw a whole stem without touching its samples
+# level 0 is min/max per BASE_BLOCK frames, every level above halves that.
+# drawing n columns only reads the level with about n blocks, so it costs the same
+# for a 10 second loop as for a 10 minute one
+
+import numpy as np
+
+from . import trace
+
+BASE_BLOCK = 256
+# level 0 gets built this many blocks at a time
+CHUNK_BLOCKS = 256
+
+
+class Peaks:
+    def __init__(self, stem):
+        data = stem.data
+        self.length = len(data)
+        self.levels = []  # [(mins, maxs)], finest first
+        self.peak = 0.0
+        self.cached = None
+
+        if self.length == 0:
+            return
+
+        # level 0 straight off the stored samples, a chunk at a time since numpy
+        # is really slow reducing float16, the scale goes on after
+        mins = []
+        maxs = []
+        for start in range(0, self.length, BASE_BLOCK * CHUNK_BLOCKS):
+            chunk = data[start : start + BASE_BLOCK * CHUNK_BLOCKS]
+            chunk = chunk.astype(np.float32, copy=False)
+            full = len(chunk) // BASE_BLOCK * BASE_BLOCK
+            if full:
+                blocks = chunk[:full].reshape(full // BASE_BLOCK, -1)
+                mins.append(blocks.min(axis=1))
+                maxs.append(blocks.max(axis=1))
+            if full < len(chunk):
+                mins.append(chunk[full:].min(keepdims=True).ravel())
+                maxs.append(chunk[full:].max(keepdims=True).ravel())
+        scale = np.float32(stem.scale)
+        lo = np.concatenate(mins) * scale
+        hi = np.concatenate(maxs) * scale
+        self.levels.append((lo, hi))
+
+        while len(lo) > 1:
+            if len(lo) % 2:
+                lo = np.append(lo, lo[-1])
+                hi = np.append(hi, hi[-1])
+            lo = lo.reshape(-1, 2).min(axis=1)
+            hi = hi.reshape(-1, 2).max(axis=1)
+            self.levels.append((lo, hi))
+
+        self.peak = float(max(-lo[0], hi[0]))
+
+    def columns(self, n):
+        # (mins, maxs) for n equal columns across the stem
+        if self.cached is not None and self.cached[0] == n:
+            return self.cached[1]
+        if not self.levels or n <= 0:
+            return np.zeros(n, np.float32), np.zeros(n, np.float32)
+
+        # coarsest level that still has a block per column
+        frames_per_col = self.length / n
+        level = 0
+        while (
+            level + 1 < len(self.levels)
+            and BASE_BLOCK * 2 ** (level + 1) <= frames_per_col
+        ):
+            level += 1
+        lo, hi = self.levels[level]
+        block = BASE_BLOCK * 2**level
+
+        starts = (np.arange(n) * frames_per_col / block).astype(np.int64)
+        starts = np.minimum(starts, len(lo) - 1)
+        result = np.minimum.reduceat(lo, starts), np.maximum.reduceat(hi, starts)
+        self.cached = (n, result)
+        return result
+
+
+def peaks_for(stem):
+    # built once per stem and kept on it, so a pooled stem never builds it twice
+    if stem.peaks is None:
+        with trace.span("peaks", bytes=stem.nbytes):
+            stem.peaks = Peaks(stem)
+    return stem.peaks
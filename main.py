@@ -1,49 +1,55 @@
 import datetime
 import json
+import logging
 import math
 import os
 import threading
+import time
 
-import numpy as np
 import pygame
-import pyrubberband as rb
-import sounddevice as sd
-import soundfile as sf
 
-# -------------------- this shit is vaguely related --------------------
+from jamstudio import (
+    compat,
+    control,
+    cue,
+    drivers,
+    engine,
+    latency,
+    logs,
+    loudness,
+    memory,
+    prefetch,
+    record,
+    stretch,
+    trace,
+)
+from jamstudio.library import get_song_list
+from jamstudio.music import KEYS_FLAT, KEYS_SHARP, KEY_TO_INT
+from jamstudio.project import (
+    BUNDLE_EXT,
+    export_mix_to_wav,
+    list_projects,
+    load_project,
+    save_project,
+)
+from jamstudio.session import JamSession
 
-KEY_TO_INT = {
-    "C": 0,
-    "C#": 1,
-    "Db": 1,
-    "D": 2,
-    "D#": 3,
-    "Eb": 3,
-    "E": 4,
-    "F": 5,
-    "F#": 6,
-    "Gb": 6,
-    "G": 7,
-    "G#": 8,
-    "Ab": 8,
-    "A": 9,
-    "A#": 10,
-    "Bb": 10,
-    "B": 11,
-}
+# startup timing, see the startup budget below the main loop setup
+startup_t0 = time.perf_counter()
 
-KEYS_SHARP = ["C", "C#", "D", "D#", "E", "F", "F#", "G", "G#", "A", "A#", "B"]
-KEYS_FLAT = ["C", "Db", "D", "Eb", "E", "F", "Gb", "G", "Ab", "A", "Bb", "B"]
+# console only until the config is read, then again with its level/file
+logs.setup()
+log = logging.getLogger("jamstudio.ui")
+
+# -------------------- this shit is vaguely related --------------------
 
 use_flat_notation = False
 
-SAMPLE_RATE = 44100
-BUFFER_SIZE = 2048
-CHANNELS = 2
-SONG_FOLDERS = ["Songs", "Stock Songs"]
+# set "trace_file" in config.json to get a chrome trace of the session on exit
+trace_file = ""
 
-if not os.path.exists("projects"):
-    os.makedirs("projects")
+# stem select song order, "name" or "fit" (least stretching/shifting first)
+song_sort = "name"
 
 # ----------- part of the pygame stuff -----------
 
@@ -142,13 +148,40 @@ def save_config():
         "font": FONT_SETTINGS[0],
         "use_flats": use_flat_notation,
         "master_volume": audio_engine.master_volume,
+        "stretch_backends": stretch.STRETCH_BACKENDS,
+        "profile": stretch.global_profile,
+        "stem_profiles": stretch.STEM_PROFILES,
+        "stem_storage": engine.STEM_STORAGE,
+        "output_driver": drivers.OUTPUT_DRIVER,
+        "sample_rate": engine.RATE_SETTING,
+        "trace_file": trace_file,
+        "log_level": logs.LOG_LEVEL,
+        "log_file": logs.LOG_FILE,
+        "loudness_target": loudness.LOUDNESS_TARGET,
+        "memory_budget_mb": memory.MEMORY_BUDGET_MB,
+        "cue_gain": cue.CUE_GAIN,
+        "song_sort": song_sort,
+        "prefetch": {
+            "enabled": prefetch.PREFETCH_ENABLED,
+            "cpu": prefetch.PREFETCH_CPU,
+            "memory_mb": prefetch.PREFETCH_MEMORY_MB,
+            "disk_mb": prefetch.PREFETCH_DISK_MB,
+        },
+        "control": {
+            "enabled": control.CONTROL_ENABLED,
+            "port": control.CONTROL_PORT,
+        },
+        "latency": {
+            "auto": latency.AUTO_LATENCY,
+            "blocksize": latency.BLOCK_SIZE,
+        },
     }
     try:
         with open("config.json", "w") as f:
             json.dump(config, f, indent=4)
-        print("Config saved.")
+        log.info("Config saved.")
     except Exception as e:
-        print(f"Error saving config: {e}")
+        log.error("Could not save config: %s", e)
 
 
 def update_fonts(font_name=None):
@@ -198,11 +231,11 @@ def load_theme(theme_name):
                         palette[k] = tuple(v)
             update_graphics_constants()
             current_theme_name = theme_name
-            print(f"Loaded theme: {theme_name}.")
+            log.info("Loaded theme: %s.", theme_name)
         except Exception as e:
-            print(f"Failed to load theme: {e}")
+            log.error("Failed to load theme: %s", e)
     else:
-        print(f"Theme not found: {path}")
+        log.warning("Theme not found: %s", path)
     update_graphics_constants()
 
 
@@ -214,6 +247,23 @@ SLIDER_W = 120
 SLIDER_H = 10
 CIRCLE_RADIUS = 60
 
+# waveform ring around each slot, one tick per column starting at 12 oclock
+RING_COLUMNS = 96
+RING_DEPTH = 8
+RING_DIRS = [
+    (
+        math.cos(2 * math.pi * c / RING_COLUMNS - math.pi / 2),
+        math.sin(2 * math.pi * c / RING_COLUMNS - math.pi / 2),
+    )
+    for c in range(RING_COLUMNS)
+]
+
+# level meters, fed from the engines meter ring every frame
+METER_FLOOR_DB = -48.0
+METER_FALL = 0.85  # per frame once it goes quiet
+PEAK_HOLD_MS = 1000
+CLIP_HOLD_MS = 2000
+
 # -------------------- most of the functions are here --------------------
 
 
@@ -230,32 +280,6 @@ def get_display_key(key_str):
     return KEYS_FLAT[idx] if use_flat_notation else KEYS_SHARP[idx]
 
 
-def key_shift_semitones(target_key, source_key):
-    # calc semitone diff
-    raw = KEY_TO_INT[target_key] - KEY_TO_INT[source_key]
-    if raw > 6:
-        raw -= 12
-    elif raw < -6:
-        raw += 12
-    return raw
-
-
-def match_bpm_timescale(original_bpm, master_bpm):
-    # find best bpm match
-    candidates = [
-        original_bpm * 0.0625,
-        original_bpm * 0.125,
-        original_bpm * 0.25,
-        original_bpm * 0.5,  # half time
-        original_bpm,  # og
-        original_bpm * 2,  # double time
-        original_bpm * 4,
-        original_bpm * 8,
-        original_bpm * 16,
-    ]
-    return min(candidates, key=lambda b: abs(b - master_bpm))
-
-
 def darken_color(color, factor=0.6):  # one less hard-coded thing
     r, g, b = color
     return (int(r * factor), int(g * factor), int(b * factor))
@@ -278,16 +302,85 @@ def lerp_color(c1, c2, t):
     )
 
 
-def load_audio_data(path):
-    audio, sr = sf.read(path, dtype="float32")
-    if audio.ndim == 1:
-        audio = np.stack([audio, audio], axis=1)
-    if sr != SAMPLE_RATE:
-        print(f"Warning: samplerate mismatch in: {path}")
-    peak = np.max(np.abs(audio))
-    if peak:
-        audio /= peak
-    return audio
+def draw_waveform_ring(cx, cy, slot, color):
+    # the stems peaks around the circle, brighter up to the playhead. only reads
+    # the pyramid from waveform.py so its the same cost however long the stem is
+    stem = slot.stem
+    if slot.empty or stem is None or stem.peaks is None or len(stem) == 0:
+        return
+
+    peaks = stem.peaks
+    lo, hi = peaks.columns(RING_COLUMNS)
+    lo, hi = lo.tolist(), hi.tolist()
+    top = peaks.peak or 1.0
+
+    length = len(stem)
+    offset = (length // 2) if slot.half == 1 else 0
+    pos = (audio_engine.position + offset) % length
+    played = int(pos * RING_COLUMNS / length)
+
+    inner = CIRCLE_RADIUS + 4
+    played_col = lighten_color(color, 1.2)
+    rest_col = darken_color(color, 0.45)
+    for c, (dx, dy) in enumerate(RING_DIRS):
+        outer = inner + 1 + max(hi[c], -lo[c]) / top * RING_DEPTH
+        pygame.draw.line(
+            screen,
+            played_col if c <= played else rest_col,
+            (cx + dx * inner, cy + dy * inner),
+            (cx + dx * outer, cy + dy * outer),
+            2,
+        )
+
+    angle = 2 * math.pi * pos / length - math.pi / 2
+    dx, dy = math.cos(angle), math.sin(angle)
+    pygame.draw.line(
+        screen,
+        palette["text_main"],
+        (cx + dx * (CIRCLE_RADIUS - 4), cy + dy * (CIRCLE_RADIUS - 4)),
+        (cx + dx * (inner + RING_DEPTH + 2), cy + dy * (inner + RING_DEPTH + 2)),
+        2,
+    )
+
+
+def update_meters():
+    # pulls the blocks mixed since last frame, bars take the loudest of them and
+    # fall off slowly, peaks hold for a bit, clip lights up if the master went over
+    global meter_count, clip_until
+    rows, meter_count = audio_engine.meters.read(meter_count)
+    now = pygame.time.get_ticks()
+    if len(rows):
+        rms = rows[:, :, 0].max(axis=0).tolist()
+        peak = rows[:, :, 1].max(axis=0).tolist()
+    else:
+        rms = peak = [0.0] * len(meter_rms)
+
+    for c in range(len(meter_rms)):
+        meter_rms[c] = max(rms[c], meter_rms[c] * METER_FALL)
+        if peak[c] >= meter_peak[c] or now - meter_peak_time[c] > PEAK_HOLD_MS:
+            meter_peak[c] = peak[c]
+            meter_peak_time[c] = now
+
+    if max(peak[len(slots) :]) > 1.0:
+        clip_until = now + CLIP_HOLD_MS
+
+
+def meter_fraction(level):
+    if level <= 0:
+        return 0.0
+    db = 20 * math.log10(level)
+    return max(0.0, min(1.0, (db - METER_FLOOR_DB) / -METER_FLOOR_DB))
+
+
+def draw_meter(x, y, w, h, rms, peak):
+    pygame.draw.rect(screen, darken_color(slider_color, factor=0.5), (x, y, w, h))
+    filled = int(w * meter_fraction(rms))
+    if filled > 0:
+        pygame.draw.rect(screen, slider_fill, (x, y, filled, h))
+    if peak > 0:
+        peak_x = x + min(w - 2, int(w * meter_fraction(peak)))
+        peak_col = palette["btn_cancel"] if peak > 1.0 else palette["text_main"]
+        pygame.draw.rect(screen, peak_col, (peak_x, y, 2, h))
 
 
 def draw_slider(x, y, w, h, value):
@@ -426,180 +519,6 @@ def draw_dynamic_text(surface, text, font, center_x, center_y, max_width, color)
     surface.blit(text_surf, rect)
 
 
-# -------------------- classes --------------------
-
-
-class Slot(threading.Thread):
-    def __init__(self, idx):
-        super().__init__()
-        self.idx = idx
-        self.daemon = True  # ensure thread dies when app closes
-
-        # audio state
-        self.empty = True
-        self.stem = None
-        self.song_name = None
-        self.type = None
-        self.key = None
-        self.scale = None
-        self.bpm = None
-        self.volume = 1.0
-        self.target_volume = 1.0
-        self.offset = 0
-        self.half = 0
-        self.mute = False
-        self.solo = False
-
-        # thread synchronization
-        self.start_event = threading.Event()
-        self.done_event = threading.Event()
-        self.output_buffer = None
-
-        self.req_pos = 0
-        self.req_frames = 0
-        self.req_channels = 2
-
-    def run(self):
-        while True:
-            self.start_event.wait()
-            self.start_event.clear()
-
-            self.process_audio()
-
-            self.done_event.set()
-
-    def process_audio(self):
-        # silence mega mayhem
-        self.output_buffer = np.zeros(
-            (self.req_frames, self.req_channels), dtype=np.float32
-        )
-
-        if self.empty or self.stem is None:
-            return
-
-        audio = self.stem.astype(np.float32)
-        length = len(audio)
-        if length == 0:
-            return
-
-        current_offset = (length // 2) if self.half == 1 else 0
-        offset_pos = (self.req_pos + current_offset) % length
-
-        end = offset_pos + self.req_frames
-
-        if end <= length:
-            chunk = audio[offset_pos:end]
-        else:
-            wrap = end - length
-            part1 = audio[offset_pos:length]
-            part2 = audio[0:wrap]
-            chunk = np.vstack((part1, part2))
-
-        if chunk.ndim < 2:
-            chunk = np.hstack([chunk, chunk])
-
-        if chunk.shape[0] != self.req_frames:
-            if chunk.shape[0] > self.req_frames:
-                chunk = chunk[: self.req_frames]
-            else:
-                pad = self.req_frames - chunk.shape[0]
-                chunk = np.vstack(
-                    (chunk, np.zeros((pad, self.req_channels), dtype=np.float32))
-                )
-
-        self.output_buffer = chunk * self.volume
-
-
-class AudioEngine:
-    def __init__(self, slots, samplerate=44100):
-        self.slots = slots
-        self.sr = samplerate
-        self.position = 0
-        self.max_length = 0
-        self.stream = None
-        self.master_volume = 1.0
-
-    def update_max_length(self):
-        lengths = [
-            len(s.stem) for s in self.slots if not s.empty and s.stem is not None
-        ]
-        self.max_length = max(lengths) if lengths else 0
-
-    def audio_callback(self, outdata, frames, time, status):
-        if status:
-            print("Audio callback status:", status)
-
-        active_lengths = [
-            len(s.stem) for s in self.slots if not s.empty and s.stem is not None
-        ]
-        self.max_length = max(active_lengths) if active_lengths else 0
-
-        if self.max_length == 0:
-            outdata.fill(0)
-            return
-
-        self.position %= self.max_length
-
-        for slot in self.slots:
-            slot.req_pos = self.position
-            slot.req_frames = frames
-            slot.req_channels = CHANNELS
-            slot.start_event.set()
-
-        for slot in self.slots:
-            slot.done_event.wait()
-            slot.done_event.clear()
-
-        mix = np.zeros((frames, CHANNELS), dtype=np.float32)
-
-        any_solo = any(s.solo for s in self.slots if not s.empty)
-
-        for slot in self.slots:
-            if slot.empty:
-                continue
-
-            should_play = False
-            if any_solo:
-                if slot.solo:
-                    should_play = True
-            else:
-                if not slot.mute:
-                    should_play = True
-
-            if should_play:
-                mix += slot.output_buffer
-
-        mix *= self.master_volume
-
-        outdata[:] = np.clip(mix, -1.0, 1.0)
-
-        self.position += frames
-        self.position %= self.max_length
-
-    def restart(self):
-        self.position = 0
-        if self.stream is None or not self.stream.active:
-            self.start()
-
-    def start(self):
-        self.update_max_length()
-        self.stream = sd.OutputStream(
-            samplerate=self.sr,
-            channels=CHANNELS,
-            blocksize=BUFFER_SIZE,
-            dtype="float32",
-            callback=self.audio_callback,
-        )
-        self.stream.start()
-        print("Audio engine started.")
-
-    def stop(self):
-        if self.stream:
-            self.stream.stop()
-            self.stream.close()
-            print("Audio engine stopped.")
-
-
 # -------------------- the rest of the pygame bullshit, did you know i hate pygame? --------------------
 # this pygame shit sucks so much we shoulda used something else man idk
 # pyqt6?? some tkinter shit???
@@ -865,14 +784,11 @@ class DropdownMenu:
 
 
 # -------------------- slot shit --------------------
-
-slots = []
-for i in range(12):
-    s = Slot(i)
-    s.start()
-    slots.append(s)
-
-audio_engine = AudioEngine(slots, SAMPLE_RATE)
+trace.record("startup.imports", startup_t0, time.perf_counter())
+with trace.span("startup.session"):
+    session = JamSession()
+slots = session.slots
+audio_engine = session.engine
 
 init_theme = "default"
 init_font = "Arial"
@@ -887,17 +803,96 @@ if os.path.exists("config.json"):
             init_flats = config_data.get("use_flats", False)
             init_vol = config_data.get("master_volume", 1.0)
             audio_engine.master_volume = init_vol
-            print("Config loaded.")
+            for stype, backend in config_data.get("stretch_backends", {}).items():
+                if (
+                    stype in stretch.STRETCH_BACKENDS
+                    and backend in stretch.BACKEND_CHOICES
+                ):
+                    stretch.STRETCH_BACKENDS[stype] = backend
+            for stype, prof in config_data.get("stem_profiles", {}).items():
+                if (
+                    stype in stretch.STEM_PROFILES
+                    and prof in stretch.PROCESSING_PROFILES
+                ):
+                    stretch.STEM_PROFILES[stype] = prof
+            if config_data.get("profile") in stretch.PROFILE_CHOICES:
+                stretch.global_profile = config_data["profile"]
+            if config_data.get("stem_storage") in engine.STORAGE_CHOICES:
+                engine.STEM_STORAGE = config_data["stem_storage"]
+            rate = config_data.get("sample_rate", engine.RATE_SETTING)
+            if engine.valid_rate_setting(rate):
+                engine.RATE_SETTING = rate
+            else:
+                log.warning(
+                    'sample_rate should be "native" or a number of Hz, not %r. '
+                    "Using the native rate.",
+                    rate,
+                )
+            if config_data.get("output_driver") in drivers.DRIVER_CHOICES:
+                drivers.OUTPUT_DRIVER = config_data["output_driver"]
+            trace_file = config_data.get("trace_file", "")
+            logs.LOG_LEVEL = config_data.get("log_level", logs.LOG_LEVEL)
+            logs.LOG_FILE = config_data.get("log_file", logs.LOG_FILE)
+            loudness.LOUDNESS_TARGET = config_data.get(
+                "loudness_target", loudness.LOUDNESS_TARGET
+            )
+            if config_data.get("song_sort") in ("fit", "name"):
+                song_sort = config_data["song_sort"]
+            memory.MEMORY_BUDGET_MB = config_data.get(
+                "memory_budget_mb", memory.MEMORY_BUDGET_MB
+            )
+            cue.CUE_GAIN = config_data.get("cue_gain", cue.CUE_GAIN)
+            prefetch_cfg = config_data.get("prefetch", {})
+            prefetch.PREFETCH_ENABLED = prefetch_cfg.get("enabled", True)
+            prefetch.PREFETCH_CPU = prefetch_cfg.get("cpu", prefetch.PREFETCH_CPU)
+            prefetch.PREFETCH_MEMORY_MB = prefetch_cfg.get(
+                "memory_mb", prefetch.PREFETCH_MEMORY_MB
+            )
+            prefetch.PREFETCH_DISK_MB = prefetch_cfg.get(
+                "disk_mb", prefetch.PREFETCH_DISK_MB
+            )
+            control_cfg = config_data.get("control", {})
+            control.CONTROL_ENABLED = control_cfg.get("enabled", False)
+            control.CONTROL_PORT = control_cfg.get("port", control.CONTROL_PORT)
+            latency_cfg = config_data.get("latency", {})
+            latency.AUTO_LATENCY = latency_cfg.get("auto", False)
+            if latency_cfg.get("blocksize") in latency.BLOCK_SIZES:
+                latency.BLOCK_SIZE = latency_cfg["blocksize"]
+            log.info("Config loaded.")
     except Exception as e:
-        print(f"Error loading config: {e}")
+        log.error("Could not load config: %s", e)
+
+logs.setup()
+
+# the engine runs at the output devices own rate so the os doesnt resample behind
+# our back, sources get converted to it once when theyre decoded
+with trace.span("startup.samplerate"):
+    engine_rate = engine.RATE_SETTING
+    if engine_rate == "native":
+        engine_rate = drivers.native_rate()
+if engine_rate:
+    engine.SAMPLE_RATE = audio_engine.sr = int(engine_rate)
+
+# osc remote control, off unless config.json turns it on
+control_server = None
+if control.CONTROL_ENABLED:
+    with trace.span("startup.control"):
+        control_server = control.start_server(session)
+
+# the saved block size (picked by hand or by auto last time), auto keeps retuning it
+if latency.BLOCK_SIZE:
+    audio_engine.reopen(
+        latency.BLOCK_SIZE,
+        latency.device_latency(latency.BLOCK_SIZE, audio_engine.sr),
+    )
+latency_manager = latency.LatencyManager(session)
+latency_manager.start()
 
 use_flat_notation = init_flats
-update_fonts(init_font)
-load_theme(init_theme)
+with trace.span("startup.theme"):
+    update_fonts(init_font)
+    load_theme(init_theme)
 
-master_bpm = None
-master_key = None
-master_scale = None
 manual_override_open = False
 
 dragging_slider = None
@@ -907,18 +902,29 @@ selected_slot = None
 # relative/parallel mode shit
 use_relative_mode = False
 
-audio_engine.start()
-
 options_open = False
-available_themes = [
-    f.replace(".json", "") for f in os.listdir("themes") if f.endswith(".json")
-]
-available_fonts = pygame.font.get_fonts()
-available_fonts.sort()
-if "arial" not in available_fonts and len(available_fonts) > 0:  # yeah this thing lol
-    available_fonts.insert(0, "arial")
 
-all_fonts = available_fonts.copy()
+# the theme folder and the system fonts only get looked at when options opens,
+# get_fonts() alone can take a second or two on some machines
+available_themes = [current_theme_name]
+available_fonts = None
+all_fonts = None
+
+
+def get_font_list():
+    global available_fonts, all_fonts
+    if available_fonts is None:
+        fonts = pygame.font.get_fonts()
+        fonts.sort()
+        if "arial" not in fonts and len(fonts) > 0:  # yeah this thing lol
+            fonts.insert(0, "arial")
+        available_fonts = fonts
+        all_fonts = fonts.copy()
+    return available_fonts
+
+
+def get_theme_list():
+    return [f.replace(".json", "") for f in os.listdir("themes") if f.endswith(".json")]
 
 
 def get_idx(lst, item):
@@ -935,7 +941,7 @@ dropdown_theme = DropdownMenu(
     200,
     35,
     available_themes,
-    default_index=get_idx(available_themes, current_theme_name),
+    default_index=0,
     max_display_items=15,
 )
 dropdown_font = DropdownMenu(
@@ -943,379 +949,267 @@ dropdown_font = DropdownMenu(
     270,
     200,
     35,
-    available_fonts,
-    default_index=get_idx(available_fonts, FONT_SETTINGS[0]),
+    [FONT_SETTINGS[0]],
+    default_index=0,
     max_display_items=14,
 )
 
 btn_notation_toggle = pygame.Rect(350, 340, 200, 35)
 
+dropdown_profile = DropdownMenu(
+    350,
+    355,
+    200,
+    35,
+    stretch.PROFILE_CHOICES,
+    default_index=get_idx(stretch.PROFILE_CHOICES, stretch.global_profile),
+    max_display_items=4,
+)
+
+LATENCY_CHOICES = ["auto"] + [str(size) for size in latency.BLOCK_SIZES]
+dropdown_latency = DropdownMenu(
+    350,
+    410,
+    200,
+    35,
+    LATENCY_CHOICES,
+    default_index=(
+        0
+        if latency.AUTO_LATENCY
+        else get_idx(LATENCY_CHOICES, str(audio_engine.blocksize))
+    ),
+    max_display_items=6,
+)
+
+
+def latency_status():
+    # "2048 = 46.4 ms, headroom 97%, suggest 512" for under the latency dropdown
+    text = f"{audio_engine.blocksize} = {audio_engine.blocksize / audio_engine.sr * 1000:.1f} ms"
+    live = latency_manager.live() if audio_engine.is_playing() else None
+    if live is not None:
+        text += f", headroom {live[0] * 100:.0f}%"
+    if latency_manager.tuning:
+        text += ", measuring..."
+    elif latency_manager.suggested:
+        text += f", suggest {latency_manager.suggested}"
+    return text
+
+
 saving_mode = False
 loading_mode = False
 save_input = TextInput(
     (SCREEN_W - 300) // 2, (SCREEN_H - 100) // 2 + 20, 300, 40, text="My_Jam"
 )
 dropdown_load_project = None
+# bundles keep the processed stems so the project loads without re-rendering
+save_as_bundle = False
 
 
-def reset_master():
-    global master_bpm, master_key, master_scale
-    master_bpm = None
-    master_key = None
-    master_scale = None
-
-def restart_application():
-    global master_bpm, master_key, master_scale
+def project_filename(name):
+    name = name[: -len(".json")] if name.endswith(".json") else name
+    name = name[: -len(BUNDLE_EXT)] if name.endswith(BUNDLE_EXT) else name
+    return name + (BUNDLE_EXT if save_as_bundle else ".json")
 
-    print("Restarting...")
-    audio_engine.stop()
-
-    for i in range(12):
-        clear_slot(i)
 
-    master_bpm = None
-    master_key = None
-    master_scale = None
+def bundle_toggle_rect(box_rect):
+    return pygame.Rect(box_rect.centerx - 100, box_rect.centery + 28, 200, 30)
 
-    audio_engine.max_length = 0
-    audio_engine.position = 0
-    audio_engine.start()
 
-    print("Restart Complete.")
-
-def get_song_list():
-    all_songs = []
-
-    for folder in SONG_FOLDERS:
-        if not os.path.exists(folder):
-            os.makedirs(folder)
-            continue
+# stem select
+# filled in by the background scan after the first frame
+dropdown_song_select = DropdownMenu(240, 200, 360, 35, [], max_display_items=16)
+dropdown_stem_type_select = DropdownMenu(
+    240, 260, 360, 35, ["vocals", "bass", "lead", "drums"], max_display_items=4
+)
 
-        songs = [
-            os.path.join(folder, x)
-            for x in os.listdir(folder)
-            if os.path.isdir(os.path.join(folder, x))
-        ]
-        all_songs.extend(songs)
+# bpm/key/stems of every song, read once so the list can be sorted by how little
+# processing each song needs against the master (see compat.py)
+song_index = compat.SongIndex()
+song_list = []
+song_order = None
+btn_song_sort = pygame.Rect(460, 137, 140, 30)
 
-    all_songs.sort(key=lambda x: os.path.basename(x).lower())
 
-    return all_songs
+def song_order_key():
+    # whatever the order depends on, its redone when this changes
+    master = (session.master_bpm, session.master_key, session.master_scale)
+    return song_sort, master, dropdown_stem_type_select.get_selected(), len(song_list)
 
 
-def add_stem_to_slot(slot_id, song_folder, stem_type):
-    global master_bpm, master_key, master_scale
+def refresh_song_order():
+    global song_order
+    song_order = song_order_key()
+    selected = dropdown_song_select.get_selected()
+    songs = song_list
+    if song_sort == "fit" and session.master_bpm is not None:
+        master = song_order[1]
+        songs = song_index.rank(songs, master, dropdown_stem_type_select.get_selected())
+    dropdown_song_select.update_options(songs)
+    if selected in songs:
+        dropdown_song_select.index = songs.index(selected)
 
-    meta_path = os.path.join(song_folder, "meta.json")
-    with open(meta_path, "r") as f:
-        meta = json.load(f)
 
-    song_key = meta["key"]
-    song_bpm = meta["bpm"]
+# what the panel is cueing, (song, stem) or None. picking another song or stem while
+# it plays switches the cue over to it
+cue_selection = None
+btn_cue = pygame.Rect(515, 298, 85, 24)
 
-    print(f"\nLoading stem '{stem_type}' from: {song_folder}")
 
-    # set master if first track
-    if master_bpm is None:
-        master_bpm = song_bpm
-        master_key = song_key
-        master_scale = meta.get("scale", "major")
-        print(f"Master set to {master_key} {master_scale}.")
+def selected_stem():
+    return dropdown_song_select.get_selected(), dropdown_stem_type_select.get_selected()
 
-    file_to_load = loaded_scale = ""
 
-    if stem_type == "drums":
-        file_to_load = "drums.ogg"
-        loaded_scale = "neutral"
+def start_cue():
+    global cue_selection
+    song, stem = selected_stem()
+    if song and stem and cue.start(session, song, stem) is not None:
+        cue_selection = (song, stem)
     else:
-        target_scale = master_scale
-
-        target_path = os.path.join(song_folder, f"{stem_type}_{target_scale}.ogg")
+        stop_cue()
 
-        if os.path.exists(target_path):
-            file_to_load = f"{stem_type}_{target_scale}.ogg"
-            loaded_scale = target_scale
-        else:
-            fallback_scale = "minor" if target_scale == "major" else "major"
-            fallback_path = os.path.join(
-                song_folder, f"{stem_type}_{fallback_scale}.ogg"
-            )
-
-            if os.path.exists(fallback_path):
-                file_to_load = f"{stem_type}_{fallback_scale}.ogg"
-                loaded_scale = fallback_scale
-                print(
-                    f"No matching mode file found. Falling back to the relative mode of {loaded_scale}."
-                )
-            else:
-                print(f"ERROR: No stem files found for {stem_type}.")
-                return
-
-    # load Audio
-    full_path = os.path.join(song_folder, file_to_load)
-    stem_audio = load_audio_data(full_path)
-
-    # time Stretch
-    adjusted_bpm = match_bpm_timescale(song_bpm, master_bpm)
-    stretch_ratio = master_bpm / adjusted_bpm
-    if stretch_ratio != 1.0:
-        print(
-            f"Applying time stretch: {song_bpm} base BPM -> {adjusted_bpm} multiple BPM -> {master_bpm} adjusted BPM"
-        )
-        stem_audio = rb.time_stretch(stem_audio, SAMPLE_RATE, stretch_ratio)
-
-    # pitch shift (now with fallback shit)
-    if stem_type != "drums":
-        semis = key_shift_semitones(master_key, song_key)
-        if loaded_scale == master_scale:
-            pass
-
-        elif loaded_scale != "neutral":
-            print("Applying relative mode offset.")
-            if loaded_scale == "minor" and master_scale == "major":
-                semis -= 3
-            elif loaded_scale == "major" and master_scale == "minor":
-                semis += 3
-
-        if semis != 0:
-            print(f"Pitch shift: {semis:+d} semitones.")
-            stem_audio = rb.pitch_shift(stem_audio, SAMPLE_RATE, semis)
-
-    # sync length
-    if audio_engine.max_length == 0:
-        audio_engine.max_length = len(stem_audio)
-
-    master_length = audio_engine.max_length
-    cur_len = len(stem_audio)
-
-    # micro stretch to align samples exactly
-    if cur_len != master_length:
-        ratio = master_length / cur_len
-        if 0.5 < ratio < 2.0:
-            stem_audio = rb.time_stretch(stem_audio, SAMPLE_RATE, 1 / ratio)
-            if len(stem_audio) > master_length:
-                stem_audio = stem_audio[:master_length]
-            elif len(stem_audio) < master_length:
-                pad = master_length - len(stem_audio)
-                stem_audio = np.vstack(
-                    (stem_audio, np.zeros((pad, stem_audio.shape[1]), dtype=np.float32))
-                )
-
-    slot = slots[slot_id]
-    slot.empty = False
-    slot.stem = stem_audio
-    slot.song_name = os.path.basename(song_folder)
-    slot.type = stem_type
-    slot.key = song_key
-    slot.scale = loaded_scale
-    slot.bpm = song_bpm
-    slot.offset = 0
-    slot.half = 0
-
-    print("Stem loaded.")
-    audio_engine.update_max_length()
-
-
-def clear_slot(i):
-    slot = slots[i]
-    slot.empty = True
-    slot.stem = None
-    slot.song_name = None
-    slot.type = None
-    slot.volume = 1.0
-    slot.target_volume = 1.0
-    slot.offset = 0
-    slot.half = 0
-    slot.mute = False
-    slot.solo = False
-    print(f"Slot {i} cleared.")
-
-
-def shift_slot(i):
-    slot = slots[i]
-    slot.half = 1 if slot.half == 0 else 0
-
-
-def toggle_master_playback():
-    (
-        audio_engine.stop
-        if audio_engine.stream and audio_engine.stream.active
-        else audio_engine.start
-    )()
 
+def stop_cue():
+    global cue_selection
+    if cue_selection is not None:
+        cue.stop(session)
+        cue_selection = None
 
-# -------------------- saving and loading and exporting --------------------
 
+def song_fit_text():
+    # what the selected song needs to fit the master
+    song = dropdown_song_select.get_selected()
+    if song is None or session.master_bpm is None:
+        return ""
+    master = (session.master_bpm, session.master_key, session.master_scale)
+    return (
+        song_index.describe(song, master, dropdown_stem_type_select.get_selected())
+        or ""
+    )
 
-def export_mix_to_wav(filename="export.wav"):
-    print("Starting export...")
-
-    max_len = audio_engine.max_length
-    if max_len == 0:
-        print("ERROR: No audio data to export.")
-        return
-
-    master_mix = np.zeros((max_len, CHANNELS), dtype=np.float32)
-
-    for slot in slots:
-        if slot.empty or slot.stem is None:
-            continue
-
-        if slot.mute:
-            continue
-
-        audio = slot.stem
-        sl_len = len(audio)
-
-        offset_samples = (sl_len // 2) if slot.half == 1 else 0
-        processed_audio = np.roll(audio, -offset_samples, axis=0)
-
-        if sl_len < max_len:
-            repeats = (max_len // sl_len) + 1
-            tiled = np.tile(processed_audio, (repeats, 1))
-            processed_audio = tiled[:max_len]
-        elif sl_len > max_len:
-            processed_audio = processed_audio[:max_len]
-        master_mix += processed_audio * slot.volume
-
-    master_mix *= audio_engine.master_volume
-    master_mix = np.clip(master_mix, -1.0, 1.0)
-
-    try:
-        sf.write(filename, master_mix, SAMPLE_RATE)
-        print(f"Exported to: {filename}")
-    except Exception as e:
-        print(f"Export failed: {e}")
 
+# manual tune
+dropdown_manual_key = DropdownMenu(
+    220,
+    235,
+    180,
+    35,
+    KEYS_FLAT if use_flat_notation else KEYS_SHARP,
+    max_display_items=12,
+)
+dropdown_manual_scale = DropdownMenu(
+    440, 235, 180, 35, ["major", "minor"], max_display_items=2
+)
+input_manual_bpm = TextInput(370, 200, 100, 35)
 
-def save_project(filename="project_data.json"):
-    data = {
-        "master": {
-            "bpm": master_bpm,
-            "key": master_key,
-            "scale": master_scale,
-            "master_volume": audio_engine.master_volume,
-        },
-        "slots": [],
-    }
+# -------------------- debug hud --------------------
 
-    for i, slot in enumerate(slots):
-        if not slot.empty:
-            slot_data = {
-                "index": i,
-                "song_name": slot.song_name,
-                "type": slot.type,
-                "volume": slot.volume,
-                "half": slot.half,
-                "mute": slot.mute,
-                "solo": slot.solo,
-                "detected_key": slot.key,
-                "detected_scale": slot.scale,
-            }
-            data["slots"].append(slot_data)
-
-    full_path = os.path.join("projects", filename)
+# F3 shows whats held in memory, the same numbers /jam/memory sends out
+show_memory_hud = False
 
-    try:
-        with open(full_path, "w") as f:
-            json.dump(data, f, indent=4)
-        print(f"Project saved to: {full_path}")
-    except Exception as e:
-        print(f"Error saving: {e}")
 
+def mb(nbytes):
+    return f"{nbytes / memory.MB:.0f}"
 
-def load_project(filename):
-    full_path = os.path.join("projects", filename)
-    if not os.path.exists(full_path):
-        print("No save file found.")
-        return
 
-    overlay = pygame.Surface((SCREEN_W, SCREEN_H), pygame.SRCALPHA)
-    overlay.fill(palette["overlay"])
-    screen.blit(overlay, (0, 0))
+def memory_hud_lines():
+    data = memory.report(session)
+    loads = data["loads"]
+    caches = data["caches"]
 
-    wait_w, wait_h = 300, 100
-    wait_rect = pygame.Rect(
-        (SCREEN_W - wait_w) // 2, (SCREEN_H - wait_h) // 2, wait_w, wait_h
+    budget = data["budget"]
+    lines = [
+        f"Memory {mb(data['resident'])} MB"
+        + (f" of {mb(budget)} MB budget" if budget else ", no budget")
+    ]
+    slot_text = []
+    for i, stems in data["slots"].items():
+        ram = sum(s["ram"] for s in stems.values())
+        mapped = sum(s["mapped"] for s in stems.values())
+        slot_text.append(f"{i}: {mb(ram)}" + (f"+{mb(mapped)}m" if mapped else ""))
+    lines.append("Slots " + ("  ".join(slot_text) or "-"))
+    lines.append(
+        f"Pool {mb(caches['pool_released'])}  stages {mb(caches['stage_cache'])}"
+        f"  prefetch {mb(caches['prefetch'])}"
     )
-    pygame.draw.rect(screen, palette["popup_bg"], wait_rect)
-    pygame.draw.rect(screen, palette["popup_border"], wait_rect, 3)
-    draw_text_centered(
-        "Loading Project...", FONT_LARGE, palette["text_main"], wait_rect
+    lines.append(
+        f"Loads {loads['in_flight']}, reserved {mb(loads['reserved'])}"
+        f", held {mb(loads['held'])}, peak {mb(loads['peak'])}"
     )
-    pygame.display.flip()
-
-    try:
-        with open(full_path, "r") as f:
-            data = json.load(f)
-
-        audio_engine.stop()
-
-        global master_bpm, master_key, master_scale
-        master_bpm = data["master"]["bpm"]
-        master_key = data["master"]["key"]
-        master_scale = data["master"]["scale"]
-
-        if "master_volume" in data["master"]:
-            audio_engine.master_volume = data["master"]["master_volume"]
-
-        for i in range(12):
-            clear_slot(i)
-
-        audio_engine.max_length = 0
+    if loads["stage_peaks"]:
+        lines.append(
+            "Peaks "
+            + "  ".join(f"{s} {mb(n)}" for s, n in loads["stage_peaks"].items())
+        )
+    if data["refused"]["count"]:
+        lines.append(f"Refused {data['refused']['count']}: {data['refused']['last']}")
+    return lines
 
-        for slot_data in data["slots"]:
-            idx = slot_data["index"]
-            song_name = slot_data["song_name"]
-            stem_type = slot_data["type"]
 
-            song_path = None
-            for folder in SONG_FOLDERS:
-                potential_path = os.path.join(folder, song_name)
-                if os.path.exists(potential_path):
-                    song_path = potential_path
-                    break
+def toggle_recording():
+    # F9, stopping renders the performance to a wav in the background
+    recording = record.stop(session)
+    if recording is None:
+        record.start(session)
+        return
+    if recording.frames == 0:
+        log.warning("Nothing was played while recording.")
+        return
+    timestamp = datetime.datetime.now().isoformat()[:19].replace(":", "-")
+    record.render_in_background(recording, f"performance_{timestamp}.wav")
+
+
+def draw_memory_hud():
+    lines = memory_hud_lines()
+    height = FONT_SMALL.get_linesize()
+    width = max(FONT_SMALL.size(line)[0] for line in lines) + 16
+    panel = pygame.Surface((width, height * len(lines) + 12), pygame.SRCALPHA)
+    panel.fill(palette["overlay"])
+    # under the top buttons
+    screen.blit(panel, (8, 70))
+    for n, line in enumerate(lines):
+        screen.blit(
+            FONT_SMALL.render(line, True, palette["text_main"]),
+            (16, 76 + n * height),
+        )
 
-            if song_path:
-                add_stem_to_slot(idx, song_path, stem_type)
 
-                s = slots[idx]
-                s.volume = slot_data.get("volume", 1.0)
-                s.target_volume = slot_data.get("volume", 1.0)
-                s.half = slot_data.get("half", 0)
-                s.mute = slot_data.get("mute", False)
-                s.solo = slot_data.get("solo", False)
-            else:
-                print(f"'{song_name}' not found during load.")
+# -------------------- startup --------------------
 
-        audio_engine.start()
-        print("Project loaded successfully.")
+# seconds from launch, over budget just gets a warning here.
+# tests/test_startup.py fails when a null driver start goes over them
+STARTUP_BUDGET_FIRST_FRAME = 1.0
+STARTUP_BUDGET_AUDIO = 1.5
 
-    except Exception as e:
-        print(f"Error loading project: {e}")
+first_frame_time = None
+audio_start_time = None
 
 
-# stem select
-dropdown_song_select = DropdownMenu(
-    240, 200, 360, 35, get_song_list(), max_display_items=16
-)
-dropdown_stem_type_select = DropdownMenu(
-    240, 260, 360, 35, ["vocals", "bass", "lead", "drums"], max_display_items=4
-)
+def report_startup(first_frame_s, audio_s):
+    log.info(
+        "Startup: first frame %.0f ms, audio %.0f ms.",
+        first_frame_s * 1000,
+        audio_s * 1000,
+        extra={"first_frame_s": first_frame_s, "audio_s": audio_s},
+    )
+    if first_frame_s > STARTUP_BUDGET_FIRST_FRAME:
+        log.warning("First frame over budget (%.1f s).", STARTUP_BUDGET_FIRST_FRAME)
+    if audio_s > STARTUP_BUDGET_AUDIO:
+        log.warning("Audio start over budget (%.1f s).", STARTUP_BUDGET_AUDIO)
+
+
+def background_startup():
+    # the slow lookups nobody needs for the first frame
+    global song_list
+    with trace.span("startup.song_scan"):
+        songs = get_song_list()
+    if not song_list:
+        song_list = songs
+        refresh_song_order()
+    with trace.span("startup.song_index"):
+        song_index.update(songs)
+    with trace.span("startup.fonts"):
+        get_font_list()
 
-# manual tune
-dropdown_manual_key = DropdownMenu(
-    220,
-    235,
-    180,
-    35,
-    KEYS_FLAT if use_flat_notation else KEYS_SHARP,
-    max_display_items=12,
-)
-dropdown_manual_scale = DropdownMenu(
-    440, 235, 180, 35, ["major", "minor"], max_display_items=2
-)
-input_manual_bpm = TextInput(370, 200, 100, 35)
 
 # -------------------- main loop --------------------
 
@@ -1325,7 +1219,18 @@ clock = pygame.time.Clock()
 running = True
 pulse_timer = 0
 
+# one per slot then master left/right, same order as the meter ring
+meter_count = 0
+meter_rms = [0.0] * (len(slots) + engine.CHANNELS)
+meter_peak = [0.0] * len(meter_rms)
+meter_peak_time = [0] * len(meter_rms)
+clip_until = 0
+
 while running:
+    # block size changes the latency watcher asked for, the stream only ever gets
+    # reopened from here or from the options menu
+    latency_manager.apply_pending()
+
     # bg
     screen.fill(palette["bg_dark"])
 
@@ -1346,6 +1251,8 @@ while running:
         or loading_mode
     )
 
+    update_meters()
+
     # slider sm64
     lerp_speed = 0.33
 
@@ -1445,11 +1352,11 @@ while running:
 
     # what
     pulse_val = 0.0
-    if audio_engine.stream and audio_engine.stream.active:
+    if audio_engine.is_playing():
         pulse_timer += clock.get_time()
 
-    if master_bpm and master_bpm > 0:
-        ms_per_beat = 60000 / master_bpm
+    if session.master_bpm and session.master_bpm > 0:
+        ms_per_beat = 60000 / session.master_bpm
 
         base_sine_wave = math.sin(
             (pulse_timer * 2 * math.pi) / ms_per_beat - (math.pi / 2)
@@ -1507,7 +1414,7 @@ while running:
     pygame.draw.rect(screen, btn_ctrl_col, btn_play_rect, border_radius=2)
     pygame.draw.rect(screen, play_outline, btn_play_rect, 4, border_radius=2)
 
-    is_playing = audio_engine is not None and audio_engine.stream.active
+    is_playing = audio_engine.is_playing()
 
     if is_playing:
         bar_w = 6
@@ -1566,7 +1473,7 @@ while running:
 
             should_pulse = False
 
-            if master_bpm:
+            if session.master_bpm:
                 if any_solo_visual:
                     if slot.solo:
                         should_pulse = True
@@ -1586,6 +1493,7 @@ while running:
 
         pygame.draw.circle(screen, color, (cx, cy), CIRCLE_RADIUS)
         pygame.draw.circle(screen, outline_color, (cx, cy), CIRCLE_RADIUS, 5)
+        draw_waveform_ring(cx, cy, slot, color)
 
         max_text_width = (CIRCLE_RADIUS * 2) - 10
         name = slot.song_name if slot.song_name else "Empty"
@@ -1593,14 +1501,32 @@ while running:
 
         mode_label = ""
 
-        if not slot.empty and slot.type != "drums" and master_scale:
-            if slot.scale == master_scale:
+        if not slot.empty and slot.type != "drums" and session.master_scale:
+            if slot.scale == session.master_scale:
                 mode_label = f"{slot.scale.capitalize()}"
             else:
                 mode_label = f"Relative {slot.scale.capitalize()}"
         elif not slot.empty and slot.type == "drums":
             mode_label = "Neutral"
 
+        # project loads fill slots in the background, show where each one is at
+        status = session.load_status.get(i)
+        if status is None and slot.join_stem is not None:
+            status = "joining"
+        if status is None and slot.tier == "preview":
+            status = "preview"
+
+        if status:
+            draw_dynamic_text(
+                screen,
+                status,
+                FONT_SMALL,
+                cx,
+                cy - 42,
+                max_text_width,
+                palette["text_dim"],
+            )
+
         draw_dynamic_text(
             screen, name, FONT_MEDIUM, cx, cy - 22, max_text_width, palette["text_main"]
         )
@@ -1639,13 +1565,49 @@ while running:
         sx = cx - SLIDER_W // 2
         sy = cy + CIRCLE_RADIUS + 15
         draw_slider(sx, sy, SLIDER_W, SLIDER_H, slot.volume)
+        draw_meter(sx, sy + SLIDER_H + 6, SLIDER_W, 4, meter_rms[i], meter_peak[i])
 
     # ---------- hud things ----------
 
+    # master meters, left over right, with the clip light for the np.clip in the callback
+    master_x = 330
+    master_y = SCREEN_H - 46
+    for ch in range(engine.CHANNELS):
+        c = len(slots) + ch
+        draw_meter(master_x, master_y + ch * 10, 300, 6, meter_rms[c], meter_peak[c])
+
+    clip_rect = pygame.Rect(master_x + 310, master_y - 2, 36, 20)
+    clipping = pygame.time.get_ticks() < clip_until
+    pygame.draw.rect(
+        screen,
+        palette["btn_cancel"] if clipping else palette["btn_inactive"],
+        clip_rect,
+        border_radius=4,
+    )
+    draw_text_centered(
+        "CLIP",
+        FONT_SMALL,
+        palette["text_main"] if clipping else palette["text_dim"],
+        clip_rect,
+    )
+
+    # recording light over the master meters
+    recorder = audio_engine.recorder
+    if recorder is not None:
+        minutes, seconds = divmod(int(recorder.recording.seconds()), 60)
+        screen.blit(
+            FONT_SMALL.render(
+                f"REC {minutes}:{seconds:02d}", True, palette["btn_cancel"]
+            ),
+            (master_x, master_y - 26),
+        )
+
     # the text
-    if master_bpm is not None:
-        display_k = get_display_key(master_key)
-        stats_text = f"BPM: {master_bpm:.1f} | KEY: {display_k} {master_scale}"
+    if session.master_bpm is not None:
+        display_k = get_display_key(session.master_key)
+        stats_text = (
+            f"BPM: {session.master_bpm:.1f} | KEY: {display_k} {session.master_scale}"
+        )
     else:
         stats_text = "No Tuning Set"
 
@@ -1682,6 +1644,33 @@ while running:
         screen.blit(FONT_MEDIUM.render("Stem:", True, text_color), (240, 235))
         dropdown_stem_type_select.draw(screen)
 
+        if song_order_key() != song_order:
+            refresh_song_order()
+        draw_action_button(
+            screen,
+            "Sort: Best Fit" if song_sort == "fit" else "Sort: Name",
+            btn_song_sort,
+            palette["input_active"] if song_sort == "fit" else palette["btn_ctrl"],
+            mx,
+            my,
+            FONT_SMALL,
+        )
+        screen.blit(
+            FONT_SMALL.render(song_fit_text(), True, palette["text_dim"]), (240, 300)
+        )
+
+        if cue_selection is not None and selected_stem() != cue_selection:
+            start_cue()
+        draw_action_button(
+            screen,
+            "STOP CUE" if cue_selection else "CUE",
+            btn_cue,
+            palette["input_active"] if cue_selection else palette["btn_ctrl"],
+            mx,
+            my,
+            FONT_SMALL,
+        )
+
         stem_confirm_rect = pygame.Rect(240, 325, 170, 50)
         stem_cancel_rect = pygame.Rect(430, 325, 170, 50)
 
@@ -1786,6 +1775,13 @@ while running:
             not_text, FONT_MEDIUM, palette["text_main"], btn_notation_toggle
         )
 
+        screen.blit(FONT_MEDIUM.render("Quality:", True, text_color), (250, 360))
+        dropdown_profile.draw(screen)
+
+        screen.blit(FONT_MEDIUM.render("Latency:", True, text_color), (250, 415))
+        dropdown_latency.draw(screen)
+        screen.blit(FONT_SMALL.render(latency_status(), True, text_color), (250, 450))
+
         opt_close_rect = pygame.Rect(335, 480, 170, 50)
 
         draw_action_button(
@@ -1794,6 +1790,8 @@ while running:
 
         dropdown_theme.draw_list(screen)
         dropdown_font.draw_list(screen)
+        dropdown_profile.draw_list(screen)
+        dropdown_latency.draw_list(screen)
 
     # -------------------- save and load overlays --------------------
 
@@ -1817,6 +1815,16 @@ while running:
         save_input.rect.center = box_rect.center
         save_input.draw(screen)
 
+        draw_action_button(
+            screen,
+            "Bundle Stems: " + ("On" if save_as_bundle else "Off"),
+            bundle_toggle_rect(box_rect),
+            palette["input_active"] if save_as_bundle else palette["btn_manual"],
+            mx,
+            my,
+            FONT_SMALL,
+        )
+
         btn_w, btn_h = 120, 40
         gap = 20
 
@@ -1897,6 +1905,9 @@ while running:
         if dropdown_load_project:
             dropdown_load_project.draw_list(screen)
 
+    if show_memory_hud:
+        draw_memory_hud()
+
     # -------------------- input handler GOD THIS SUCKS --------------------
 
     for event in pygame.event.get():
@@ -1904,6 +1915,14 @@ while running:
             save_config()
             running = False
 
+        if event.type == pygame.KEYDOWN and event.key == pygame.K_F3:
+            show_memory_hud = not show_memory_hud
+            continue
+
+        if event.type == pygame.KEYDOWN and event.key == pygame.K_F9:
+            toggle_recording()
+            continue
+
         mx, my = pygame.mouse.get_pos()
 
         if event.type == pygame.MOUSEMOTION:
@@ -1921,9 +1940,7 @@ while running:
             if save_input.handle_event(event):
                 fname = save_input.text
                 if len(fname) > 0:
-                    if not fname.endswith(".json"):
-                        fname += ".json"
-                    save_project(fname)
+                    save_project(session, project_filename(fname))
                     saving_mode = False
                     pygame.key.stop_text_input()
 
@@ -1945,12 +1962,14 @@ while running:
                 if save_input.rect.collidepoint(mx, my):
                     continue
 
+                if bundle_toggle_rect(box_rect).collidepoint(mx, my):
+                    save_as_bundle = not save_as_bundle
+                    continue
+
                 if save_confirm_rect.collidepoint(mx, my):
                     fname = save_input.text
                     if len(fname) > 0:
-                        if not fname.endswith(".json"):
-                            fname += ".json"
-                        save_project(fname)
+                        save_project(session, project_filename(fname))
                         saving_mode = False
                         pygame.key.stop_text_input()
 
@@ -1982,23 +2001,28 @@ while running:
                 if load_confirm_rect.collidepoint(mx, my):
                     sel = dropdown_load_project.get_selected()
                     if sel:
-                        load_project(sel)
+                        load_project(session, sel)
 
-                        if master_bpm:
-                            input_manual_bpm.text = str(int(master_bpm))
+                        if session.master_bpm:
+                            input_manual_bpm.text = str(int(session.master_bpm))
                             input_manual_bpm.txt_surface = input_manual_bpm.font.render(
                                 input_manual_bpm.text, True, palette["text_main"]
                             )
-                        if master_key and master_key in dropdown_manual_key.options:
+                        if (
+                            session.master_key
+                            and session.master_key in dropdown_manual_key.options
+                        ):
                             dropdown_manual_key.index = (
-                                dropdown_manual_key.options.index(master_key)
+                                dropdown_manual_key.options.index(session.master_key)
                             )
                         if (
-                            master_scale
-                            and master_scale in dropdown_manual_scale.options
+                            session.master_scale
+                            and session.master_scale in dropdown_manual_scale.options
                         ):
                             dropdown_manual_scale.index = (
-                                dropdown_manual_scale.options.index(master_scale)
+                                dropdown_manual_scale.options.index(
+                                    session.master_scale
+                                )
                             )
                         loading_mode = False
 
@@ -2015,6 +2039,23 @@ while running:
                     save_config()
                 continue
 
+            if dropdown_profile.handle_event(event):
+                sel = dropdown_profile.get_selected()
+                if sel:
+                    stretch.global_profile = sel
+                    save_config()
+                continue
+
+            if dropdown_latency.handle_event(event):
+                sel = dropdown_latency.get_selected()
+                if sel == "auto":
+                    latency_manager.set_auto(True)
+                elif sel:
+                    latency_manager.set_auto(False)
+                    latency_manager.apply(int(sel))
+                save_config()
+                continue
+
             if dropdown_font.handle_event(event):
                 sel = dropdown_font.get_selected()
                 if sel:
@@ -2029,6 +2070,8 @@ while running:
                     dropdown_stem_type_select.font = FONT_SMALL
                     dropdown_manual_key.font = FONT_SMALL
                     dropdown_manual_scale.font = FONT_SMALL
+                    dropdown_profile.font = FONT_SMALL
+                    dropdown_latency.font = FONT_SMALL
                     save_config()
                 continue
 
@@ -2102,72 +2145,30 @@ while running:
                     screen.blit(sub_text, txt_rect2)
                     pygame.display.flip()
 
-                    try:
-                        master_key = dropdown_manual_key.get_selected()
-                        master_scale = dropdown_manual_scale.get_selected()
+                    def redraw_wait_box():
+                        pygame.draw.rect(screen, palette["panel_bg"], wait_rect)
+                        pygame.draw.rect(screen, palette["slider_fill"], wait_rect, 3)
+
+                        screen.blit(wait_text, txt_rect1)
+                        screen.blit(sub_text, txt_rect2)
 
+                        pygame.display.flip()
+
+                    try:
                         new_bpm = None
                         if input_manual_bpm.text and float(input_manual_bpm.text) > 0:
                             new_bpm = float(input_manual_bpm.text)
-                            master_bpm = new_bpm
-
-                        audio_engine.stop()
-
-                        slots_to_reload = []
-                        for i, slot in enumerate(slots):
-                            if not slot.empty:
-                                slots_to_reload.append(
-                                    {"id": i, "name": slot.song_name, "type": slot.type}
-                                )
-                                slot.stem = None
-
-                        audio_engine.max_length = 0
-
-                        for data in slots_to_reload:
-                            print(f"Reloading slot {data['id']}...")
-
-                            pygame.draw.rect(screen, palette["panel_bg"], wait_rect)
-                            pygame.draw.rect(
-                                screen, palette["slider_fill"], wait_rect, 3
-                            )
 
-                            screen.blit(wait_text, txt_rect1)
-                            screen.blit(sub_text, txt_rect2)
-
-                            pygame.display.flip()
-
-                            if use_relative_mode:
-                                expected_scale = (
-                                    "minor" if master_scale == "major" else "major"
-                                )
-                            else:
-                                expected_scale = master_scale
-
-                            if data["type"] == "drums":
-                                expected_scale = None
-
-                            song_path = None
-                            for folder in SONG_FOLDERS:
-                                potential_path = os.path.join(folder, data["name"])
-                                if os.path.exists(potential_path):
-                                    song_path = potential_path
-                                    break
-
-                            if song_path:
-                                add_stem_to_slot(data["id"], song_path, data["type"])
-                            else:
-                                print(
-                                    f"ERROR: Could not locate song '{data['name']}' in any known folder."
-                                )
-
-                        audio_engine.start()
+                        session.retune(
+                            dropdown_manual_key.get_selected(),
+                            dropdown_manual_scale.get_selected(),
+                            new_bpm,
+                            on_progress=redraw_wait_box,
+                        )
 
                     except Exception as e:
-                        print(f"Manual tuning error: {e}")
-                        if (
-                            audio_engine.stream is None
-                            or not audio_engine.stream.active
-                        ):
+                        log.error("Manual tuning error: %s", e)
+                        if not audio_engine.is_playing():
                             audio_engine.start()
 
                     manual_override_open = False
@@ -2195,16 +2196,31 @@ while running:
                 btn_stem_confirm = pygame.Rect(240, 325, 170, 50)
                 btn_stem_cancel = pygame.Rect(430, 325, 170, 50)
 
+                if btn_song_sort.collidepoint(mx, my):
+                    song_sort = "name" if song_sort == "fit" else "fit"
+                    refresh_song_order()
+                    save_config()
+                    continue
+
+                if btn_cue.collidepoint(mx, my):
+                    if cue_selection is None:
+                        start_cue()
+                    else:
+                        stop_cue()
+                    continue
+
                 # confirm click
                 if btn_stem_confirm.collidepoint(mx, my):
                     song_val = dropdown_song_select.get_selected()
                     stem_val = dropdown_stem_type_select.get_selected()
                     if song_val and stem_val:
-                        add_stem_to_slot(selected_slot, song_val, stem_val)
+                        stop_cue()
+                        session.add_stem_to_slot(selected_slot, song_val, stem_val)
                         panel_open = False
 
                 # cancel click
                 if btn_stem_cancel.collidepoint(mx, my):
+                    stop_cue()
                     panel_open = False
 
             continue
@@ -2214,7 +2230,7 @@ while running:
 
             # restart app
             if btn_reset_rect.collidepoint(mx, my) and event.button == 1:
-                restart_application()
+                session.restart()
 
             # expor
             if btn_exp_rect.collidepoint(mx, my) and event.button == 1:
@@ -2239,7 +2255,7 @@ while running:
                 timestamp = now.isoformat()[:19].replace(":", "-")
                 filename = f"jam_{timestamp}.wav"
 
-                export_mix_to_wav(filename)
+                export_mix_to_wav(session, filename)
                 continue
 
             # pause play restart
@@ -2247,14 +2263,14 @@ while running:
                 audio_engine.restart()
 
             if btn_play_rect.collidepoint(mx, my) and event.button == 1:
-                toggle_master_playback()
+                session.toggle_playback()
 
             # top left manual button
             if 20 <= mx <= 220 and 20 <= my <= 60 and event.button == 1:
                 manual_override_open = True
 
-                if master_bpm is not None:
-                    bpm_str = str(master_bpm)
+                if session.master_bpm is not None:
+                    bpm_str = str(session.master_bpm)
                     if bpm_str.endswith(".0"):
                         bpm_str = bpm_str[:-2]
                     input_manual_bpm.text = bpm_str
@@ -2265,24 +2281,32 @@ while running:
                     input_manual_bpm.text, True, palette["text_main"]
                 )
 
-                if master_key and master_key in dropdown_manual_key.options:
+                if (
+                    session.master_key
+                    and session.master_key in dropdown_manual_key.options
+                ):
                     dropdown_manual_key.index = dropdown_manual_key.options.index(
-                        master_key
+                        session.master_key
                     )
 
-                if master_scale and master_scale in dropdown_manual_scale.options:
+                if (
+                    session.master_scale
+                    and session.master_scale in dropdown_manual_scale.options
+                ):
                     dropdown_manual_scale.index = dropdown_manual_scale.options.index(
-                        master_scale
+                        session.master_scale
                     )
 
             if btn_opt_rect.collidepoint(mx, my):
                 options_open = True
-                available_themes = [
-                    f.replace(".json", "")
-                    for f in os.listdir("themes")
-                    if f.endswith(".json")
-                ]
+                available_themes = get_theme_list()
                 dropdown_theme.update_options(available_themes)
+                dropdown_theme.index = get_idx(available_themes, current_theme_name)
+                if dropdown_font.options != get_font_list():
+                    dropdown_font.update_options(get_font_list())
+                    dropdown_font.index = get_idx(available_fonts, FONT_SETTINGS[0])
+                # measured once per output device, after that its the kept result
+                latency_manager.tune_async()
                 continue
 
             if btn_save_rect.collidepoint(mx, my) and event.button == 1:
@@ -2291,7 +2315,7 @@ while running:
 
             if btn_load_rect.collidepoint(mx, my) and event.button == 1:
                 loading_mode = True
-                files = [f for f in os.listdir("projects") if f.endswith(".json")]
+                files = list_projects()
                 dropdown_load_project = DropdownMenu(
                     (SCREEN_W - 300) // 2,
                     (SCREEN_H - 300) // 2 + 80,
@@ -2308,7 +2332,7 @@ while running:
                     cx = 120 + (i % 4) * 200
                     cy = 150 + (i // 4) * 250
                     if (mx - cx) ** 2 + (my - cy) ** 2 < CIRCLE_RADIUS**2:
-                        clear_slot(i)
+                        session.clear_slot(i)
                         break
 
             # left click slider or open panel
@@ -2322,7 +2346,7 @@ while running:
 
                     off_x, off_y = cx + 30, cy + 30
                     if off_x <= mx <= off_x + 32 and off_y <= my <= off_y + 32:
-                        shift_slot(slot_index)
+                        session.shift_slot(slot_index)
                         slot_button_clicked = True
 
                     ms_x, ms_y = cx - 45, cy + 32
@@ -2357,7 +2381,9 @@ while running:
                             if (mx - cx) ** 2 + (my - cy) ** 2 < CIRCLE_RADIUS**2:
                                 panel_open = True
                                 selected_slot = slot_index
-                                dropdown_song_select.update_options(get_song_list())
+                                song_list = get_song_list()
+                                song_index.update(song_list)
+                                refresh_song_order()
                                 break
 
         if event.type == pygame.MOUSEBUTTONUP:
@@ -2375,8 +2401,11 @@ while running:
 
         if event.type == pygame.MOUSEWHEEL:
             if options_open:
-                if dropdown_theme.handle_event(event) or dropdown_font.handle_event(
-                    event
+                if (
+                    dropdown_theme.handle_event(event)
+                    or dropdown_font.handle_event(event)
+                    or dropdown_profile.handle_event(event)
+                    or dropdown_latency.handle_event(event)
                 ):
                     continue
 
@@ -2421,7 +2450,26 @@ while running:
                         break
 
     pygame.display.flip()
+
+    if first_frame_time is None:
+        first_frame_time = time.perf_counter() - startup_t0
+        trace.record("startup.first_frame", startup_t0, startup_t0 + first_frame_time)
+        # sound card comes after the window is up
+        with trace.span("startup.audio"):
+            audio_engine.start()
+        audio_start_time = time.perf_counter() - startup_t0
+        report_startup(first_frame_time, audio_start_time)
+        threading.Thread(target=background_startup, daemon=True).start()
+
     clock.tick(60)
 
 pygame.quit()
+if control_server is not None:
+    control_server.stop()
+latency_manager.stop()
+session.cancel_loads()
 audio_engine.stop()
+
+if trace_file:
+    trace.export_chrome_trace(trace_file)
+logs.shutdown()
@@ -0,0 +1,9 @@
+# the tests run from a checkout without installing anything, no sound card and no
+# window: the null driver plays into nothing and sdl gets the dummy video driver
+
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault("SDL_VIDEODRIVER", "dummy")
+os.environ.setdefault("SDL_AUDIODRIVER", "dummy")
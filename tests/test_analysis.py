@@ -0,0 +1,93 @@
+# the bpm and key guesses on made up audio, and on the stock song
+
+import os
+
+import numpy as np
+import pytest
+
+from jamstudio import analysis
+from jamstudio.analysis import ANALYSIS_RATE, estimate_bpm, estimate_key
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+STOCK_SONG = os.path.join(ROOT, "Stock Songs", "House (Uses Relative)")
+
+SR = ANALYSIS_RATE
+
+
+def clicks(bpm, seconds):
+    # a short noise burst on every beat
+    rng = np.random.default_rng(0)
+    out = np.zeros(int(seconds * SR), np.float32)
+    burst = rng.uniform(-1, 1, 400) * np.exp(-np.arange(400) / 60)
+    for beat in np.arange(0, seconds, 60 / bpm):
+        start = int(beat * SR)
+        piece = burst[: len(out) - start]
+        out[start : start + len(piece)] += piece
+    return out
+
+
+def chords(progression, seconds_each=2.0):
+    # each chord is midi notes played as sines, a couple of octaves each
+    t = np.arange(int(seconds_each * SR)) / SR
+    out = []
+    for notes in progression:
+        chord = np.zeros(len(t))
+        for note in notes:
+            for octave in (0, 12):
+                freq = 440 * 2 ** ((note + octave - 69) / 12)
+                chord += np.sin(2 * np.pi * freq * t)
+        out.append(chord)
+    return np.concatenate(out).astype(np.float32)
+
+
+# loops chopped to whole bars snap to the exact tempo, the 20 s ones dont
+@pytest.mark.parametrize(
+    "bpm, seconds", [(100, 8 * 4 * 60 / 100), (128, 8 * 4 * 60 / 128), (90, 20.0)]
+)
+def test_click_track_tempo(bpm, seconds):
+    guess, confidence = estimate_bpm(clicks(bpm, seconds), SR)
+    assert guess == pytest.approx(bpm, abs=0.5)
+    assert confidence > 0.5
+
+
+def test_silence_has_no_tempo():
+    assert estimate_bpm(np.zeros(SR * 4, np.float32), SR) == (None, 0.0)
+
+
+C, D, E, F, G, A, B = 48, 50, 52, 53, 55, 57, 59
+
+
+def test_major_progression():
+    # C F G C
+    audio = chords([(C, E, G), (F, A, C + 12), (G, B, D + 12), (C, E, G)])
+    assert estimate_key(audio, SR)[:2] == ("C", "major")
+
+
+def test_minor_progression():
+    # Am Dm E Am, harmonic minor
+    audio = chords([(A, C + 12, E + 12), (D, F, A), (E, G + 1, B), (A, C + 12, E + 12)])
+    assert estimate_key(audio, SR)[:2] == ("A", "minor")
+
+
+def test_drum_stem_in_any_case(tmp_path, monkeypatch):
+    for name in ("Drums.ogg", "Bass_Minor.ogg"):
+        (tmp_path / name).touch()
+    mixed = []
+
+    def mix_files(song_folder, files):
+        mixed.append(files)
+        return chords([(A, C + 12, E + 12)]), SR
+
+    monkeypatch.setattr(analysis, "mix_files", mix_files)
+    analysis.analyze_song(str(tmp_path))
+    # tempo off the drums, key off the rest
+    assert mixed == [["Drums.ogg"], ["Bass_Minor.ogg"]]
+
+
+@pytest.mark.skipif(not os.path.isdir(STOCK_SONG), reason="no stock song")
+def test_stock_song():
+    data = analysis.analyze_song(STOCK_SONG)
+    assert data["bpm"] == pytest.approx(128, abs=0.01)
+    # meta.json says C major. the bass and lead play Bb all through, which fits F
+    # major as well, so the guess lands on either (see the top of analysis.py)
+    assert (data["key"], data["scale"]) in (("C", "major"), ("F", "major"))
@@ -0,0 +1,61 @@
+# the best fit sort works out the stretch and shift for every song at once, it has
+# to come to the same numbers as plan_stem does when the song actually gets loaded
+
+import json
+
+import numpy as np
+import pytest
+import soundfile as sf
+
+from jamstudio import compat
+from jamstudio.session import plan_stem
+
+# bpm, key, scale in meta.json, the stem files it has
+SONGS = {
+    "Same": (128, "C", "major", ["vocals_major", "vocals_minor", "drums"]),
+    "Slow Minor": (70, "G", "minor", ["vocals_minor", "drums"]),
+    "Fast Major": (174, "F", "major", ["vocals_major"]),
+    "Both": (100, "A#", "minor", ["vocals_major", "vocals_minor"]),
+    "Odd Tempo": (97.5, "E", "major", ["vocals_minor", "drums"]),
+}
+
+MASTERS = [
+    (128, "C", "major"),
+    (90, "F#", "minor"),
+    (140, "A#", "major"),
+    (60, "D#", "minor"),
+    (133.3, "B", "major"),
+]
+
+
+@pytest.fixture(scope="module")
+def songs(tmp_path_factory):
+    root = tmp_path_factory.mktemp("Songs")
+    silence = np.zeros((4410, 2), np.float32)
+    folders = []
+    for name, (bpm, key, scale, stems) in SONGS.items():
+        folder = root / name
+        folder.mkdir()
+        with open(folder / "meta.json", "w") as f:
+            json.dump({"bpm": bpm, "key": key, "scale": scale}, f)
+        for stem in stems:
+            sf.write(folder / f"{stem}.ogg", silence, 44100)
+        folders.append(str(folder))
+    return folders
+
+
+@pytest.mark.parametrize("master", MASTERS)
+@pytest.mark.parametrize("stem_type", ["vocals", "drums"])
+def test_costs_agree_with_plan_stem(songs, master, stem_type):
+    index = compat.SongIndex()
+    index.update(songs)
+    ratio, semis, fallback, cost = index.costs(master, stem_type)
+    for folder in songs:
+        i = index.position[folder]
+        plan = plan_stem(folder, stem_type, None, master, say=lambda note: None)
+        if plan is None:
+            assert np.isnan(cost[i])
+            continue
+        assert not np.isnan(cost[i])
+        assert (round(ratio[i], 6), int(semis[i])) == plan["key"][3:5]
+        assert fallback[i] == (plan["scale"] not in (master[2], "neutral"))
@@ -0,0 +1,97 @@
+# the osc server against a plain udp socket standing in for a controller
+
+import socket
+import time
+
+import pytest
+
+from jamstudio import control, drivers, prefetch
+from jamstudio.session import JamSession
+
+
+@pytest.fixture
+def session(monkeypatch):
+    monkeypatch.setattr(drivers, "OUTPUT_DRIVER", "null")
+    monkeypatch.setattr(prefetch, "PREFETCH_ENABLED", False)
+    session = JamSession()
+    # playing, so mixer changes go through the engines command queue
+    session.engine.start()
+    yield session
+    session.engine.stop()
+
+
+@pytest.fixture
+def server(session):
+    server = control.start_server(session, port=0)
+    assert server.port
+    yield server
+    server.stop()
+
+
+@pytest.fixture
+def client():
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    sock.bind((control.CONTROL_HOST, 0))
+    sock.settimeout(0.1)
+    yield sock
+    sock.close()
+
+
+def send(client, server, address, *args):
+    client.sendto(
+        control.encode_message(address, *args), (control.CONTROL_HOST, server.port)
+    )
+
+
+def receive(client, seconds=2.0):
+    # address -> args of the last of each message that came in
+    got = {}
+    end = time.monotonic() + seconds
+    while time.monotonic() < end:
+        try:
+            data, _ = client.recvfrom(65536)
+        except socket.timeout:
+            continue
+        for address, args in control.decode_messages(data):
+            got[address] = args
+    return got
+
+
+def wait_for(condition, seconds=2.0):
+    end = time.monotonic() + seconds
+    while time.monotonic() < end:
+        if condition():
+            return True
+        time.sleep(0.01)
+    return False
+
+
+def test_mixer_messages_reach_slots_and_subscribers(session, server, client):
+    send(client, server, "/jam/subscribe")
+    assert receive(client, 0.3)["/jam/slot/0"][2] == pytest.approx(1.0)
+
+    slots = session.slots
+    send(client, server, "/jam/slot/0/volume", 0.25)
+    send(client, server, "/jam/slot/1/mute", 1)
+    send(client, server, "/jam/slot/2/solo", 1)
+    assert wait_for(lambda: slots[0].volume == 0.25 and slots[1].mute and slots[2].solo)
+    assert slots[0].target_volume == 0.25
+
+    # one solo at a time, like clicking S
+    send(client, server, "/jam/slot/3/solo", 1)
+    assert wait_for(lambda: slots[3].solo and not slots[2].solo)
+
+    echoed = receive(client, 4 * control.STATE_INTERVAL + 0.2)
+    # song, stem, volume, mute, solo, half, status
+    assert echoed["/jam/slot/0"][2] == pytest.approx(0.25)
+    assert echoed["/jam/slot/1"][3] == 1
+    assert echoed["/jam/slot/3"][4] == 1
+    assert echoed["/jam/slot/2"][4] == 0
+
+
+@pytest.mark.parametrize("index", ["-1", "12", "x"])
+def test_bad_slot_index_gets_an_error(session, server, client, index):
+    send(client, server, f"/jam/slot/{index}/volume", 0.5)
+    got = receive(client, 0.3)
+    assert "/jam/error" in got
+    assert all(slot.volume == 1.0 for slot in session.slots)
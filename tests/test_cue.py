@@ -0,0 +1,122 @@
+# the cues streaming resample and how it mixes, without a thread or a file
+
+import time
+
+import numpy as np
+import pytest
+import soundfile as sf
+
+from jamstudio import cue
+from jamstudio.cue import Cue
+from jamstudio.engine import CHANNELS
+
+FRAMES = 512
+
+
+def ramp(n):
+    # different on each channel so a swap would show
+    x = np.arange(n, dtype=np.float32) / n
+    return np.stack((x, -x / 2), axis=1)
+
+
+def one_shot(data, src_rate, dst_rate):
+    # linear interpolation of the whole thing, up to the last source frame
+    step = src_rate / dst_rate
+    pos = np.arange(0, len(data) - 1, step)
+    return np.stack(
+        [np.interp(pos, np.arange(len(data)), data[:, c]) for c in range(CHANNELS)],
+        axis=1,
+    )
+
+
+@pytest.mark.parametrize("src_rate, dst_rate", [(44100, 48000), (48000, 44100)])
+def test_convert_in_pieces_matches_one_shot(src_rate, dst_rate):
+    data = ramp(10000)
+    c = Cue("unused.ogg", dst_rate)
+    c.src_rate = src_rate
+    sizes = [1, 2, 333, 4096, 7, 1000, 17]
+    pieces = []
+    start = 0
+    for size in sizes * 10:
+        if start >= len(data):
+            break
+        pieces.append(c.convert(data[start : start + size]))
+        start += size
+    streamed = np.concatenate(pieces)
+    expected = one_shot(data, src_rate, dst_rate)
+    assert streamed.shape == expected.shape
+    np.testing.assert_allclose(streamed, expected, rtol=0, atol=1e-6)
+
+
+def queued(chunks):
+    c = Cue("unused.ogg", 44100)
+    for chunk in chunks:
+        c.chunks.append(chunk)
+        c.written += len(chunk)
+    c.first_audio = 0.0
+    return c
+
+
+def test_mix_reads_across_chunks():
+    data = ramp(3 * FRAMES)
+    c = queued([data[:100], data[100:700], data[700:]])
+    mix = np.ones((FRAMES, CHANNELS), np.float32)
+    assert c.mix_into(mix, FRAMES)
+    np.testing.assert_array_equal(mix, 1 + data[:FRAMES])
+    mix = np.zeros((FRAMES, CHANNELS), np.float32)
+    c.mix_into(mix, FRAMES)
+    np.testing.assert_array_equal(mix, data[FRAMES : 2 * FRAMES])
+    assert c.consumed == 2 * FRAMES and c.underruns == 0
+
+
+def test_underrun_counts_once_per_short_block():
+    c = queued([ramp(FRAMES // 2)])
+    mix = np.zeros((FRAMES, CHANNELS), np.float32)
+    assert c.mix_into(mix, FRAMES)
+    # whatever was there gets played, the rest stays silent
+    np.testing.assert_array_equal(mix[: FRAMES // 2], ramp(FRAMES // 2))
+    assert not mix[FRAMES // 2 :].any()
+    c.mix_into(mix, FRAMES)
+    assert c.underruns == 2
+
+    # before the first piece is read its just starting up, not an underrun
+    starting = Cue("unused.ogg", 44100)
+    starting.mix_into(mix, FRAMES)
+    assert starting.underruns == 0
+
+
+def test_stop_fades_out_over_one_block():
+    c = queued([np.ones((2 * FRAMES, CHANNELS), np.float32)])
+    c.stop()
+    mix = np.zeros((FRAMES, CHANNELS), np.float32)
+    assert not c.mix_into(mix, FRAMES)
+    fade = np.linspace(1.0, 0.0, FRAMES, dtype=np.float32)
+    np.testing.assert_allclose(mix, np.stack((fade, fade), axis=1), atol=1e-7)
+    assert c.underruns == 0
+
+
+# whole blocks, one frame short of them, and somewhere in between
+@pytest.mark.parametrize(
+    "length",
+    [2 * cue.BLOCK_FRAMES, 2 * cue.BLOCK_FRAMES - 1, cue.BLOCK_FRAMES + 1234],
+)
+def test_file_loops_at_the_end(tmp_path, monkeypatch, length):
+    # read a few times round, it picks up at the start with nothing lost or doubled
+    monkeypatch.setattr(cue, "QUEUE_FRAMES", 10**9)
+    data = np.stack(
+        (np.linspace(-1, 1, length), np.linspace(1, -1, length)), axis=1
+    ).astype(np.float32)
+    path = tmp_path / "loop.wav"
+    sf.write(path, data, 44100, subtype="FLOAT")
+
+    c = Cue(str(path), 44100)
+    c.start()
+    try:
+        end = time.monotonic() + 5
+        while c.written < 3 * length and time.monotonic() < end:
+            time.sleep(0.01)
+    finally:
+        c.stop()
+        c.join()
+    streamed = np.concatenate(list(c.chunks))[: 3 * length]
+    np.testing.assert_array_equal(streamed, np.tile(data, (3, 1)))
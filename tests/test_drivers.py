@@ -0,0 +1,128 @@
+# the mixer stepped a block at a time through the null driver, on made up stems
+
+import time
+
+import numpy as np
+import pytest
+
+from jamstudio import drivers, prefetch
+from jamstudio.drivers import NullStream
+from jamstudio.engine import CHANNELS, pack_stem
+from jamstudio.session import JamSession
+
+FRAMES = 512
+RATE = 44100
+# the short one fits three times in the long one, so it lines up with the loop
+LONG = 7200
+SHORT = 2400
+
+
+def ramp(length, scale):
+    # a different line on each channel, small enough that the mix never clips
+    x = np.arange(length, dtype=np.float32) / length * scale
+    return np.stack((x, -x / 2), axis=1)
+
+
+@pytest.fixture
+def session(monkeypatch):
+    monkeypatch.setattr(drivers, "OUTPUT_DRIVER", "null")
+    monkeypatch.setattr(prefetch, "PREFETCH_ENABLED", False)
+    session = JamSession(RATE)
+    yield session
+    session.engine.stop()
+
+
+@pytest.fixture
+def stems(session):
+    long, short = ramp(LONG, 0.4), ramp(SHORT, 0.3)
+    for slot, audio in zip(session.slots, (long, short)):
+        slot.stem = pack_stem(audio, "float32")
+        slot.empty = False
+    return long, short
+
+
+def step(session, blocks, **options):
+    stream = NullStream(
+        RATE, CHANNELS, FRAMES, session.engine.audio_callback, capture=True, **options
+    )
+    for _ in range(blocks):
+        stream.run_block()
+    return stream
+
+
+def looped(audio, frames, offset=0):
+    return audio[(np.arange(frames) + offset) % len(audio)]
+
+
+def test_stems_of_different_lengths_loop(session, stems):
+    long, short = stems
+    blocks = 20  # past the end of the long one
+    out = step(session, blocks).captured()
+    n = blocks * FRAMES
+    assert n > LONG
+    np.testing.assert_allclose(
+        out, looped(long, n) + looped(short, n), rtol=0, atol=1e-6
+    )
+
+
+def test_half_offset_and_mute(session, stems):
+    long, _ = stems
+    session.slots[0].half = 1
+    session.slots[1].mute = True
+    out = step(session, 20).captured()
+    np.testing.assert_allclose(
+        out, looped(long, len(out), LONG // 2), rtol=0, atol=1e-6
+    )
+
+
+def test_solo(session, stems):
+    _, short = stems
+    session.slots[1].solo = True
+    out = step(session, 20).captured()
+    np.testing.assert_allclose(out, looped(short, len(out)), rtol=0, atol=1e-6)
+
+
+def test_late_blocks_report_underflow(session, stems):
+    stream = step(session, 12, late_every=4, late_by=1.0, realtime=False)
+    # not paced, so no waiting on late_by either
+    assert stream.blocks == 12 and stream.late == 3
+    assert session.engine.xruns == 3
+    assert len(stream.captured()) == 12 * FRAMES
+
+
+def test_max_blocks_stops_by_itself(session, stems):
+    stream = NullStream(
+        RATE,
+        CHANNELS,
+        FRAMES,
+        session.engine.audio_callback,
+        realtime=False,
+        capture=True,
+        max_blocks=7,
+    )
+    stream.start()
+    stream.wait(5)
+    assert not stream.active and stream.blocks == 7
+    assert len(stream.captured()) == 7 * FRAMES
+
+
+def test_realtime_pacing_with_late_blocks(session, stems):
+    engine = session.engine
+    engine.driver_options = {
+        "capture": True,
+        "max_blocks": 40,
+        "late_every": 10,
+        "late_by": 0.05,
+    }
+    engine.blocksize = FRAMES
+    t0 = time.perf_counter()
+    engine.start()
+    engine.stream.wait(10)
+    elapsed = time.perf_counter() - t0
+
+    # a block takes a period, a late one late_by instead. the one after it doesnt
+    # wait but theres no burst to catch up either
+    period = FRAMES / RATE
+    expected = 40 * period + 4 * (0.05 - period)
+    assert engine.stream.late == 4 and engine.xruns == 4
+    assert expected - 0.01 < elapsed < expected + 0.2
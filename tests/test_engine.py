@@ -0,0 +1,89 @@
+import numpy as np
+import pytest
+
+from jamstudio.engine import CHANNELS, Slot, pack_stem
+
+FRAMES = 2048
+LENGTH = 44100
+
+
+@pytest.fixture
+def audio():
+    rng = np.random.default_rng(0)
+    # some quiet stretches too, float16 loses the most there
+    audio = rng.uniform(-1.0, 1.0, (LENGTH, CHANNELS)).astype(np.float32)
+    audio[: LENGTH // 4] *= 1e-3
+    return audio
+
+
+def error_bound(mode, stem, expected):
+    if mode == "int16":
+        # rounding to the nearest step, plus the float32 multiply on the way back
+        return stem.scale / 2 + np.abs(expected) * 2**-23
+    if mode == "float16":
+        # half a unit in the last place, fixed below the smallest normal float16
+        return np.maximum(np.abs(expected) * 2**-11, 2.0**-25)
+    return np.zeros_like(expected)
+
+
+def slot_block(stem, pos):
+    # what a slot plays for the block at pos, across the loop point if its there
+    slot = Slot(0)
+    slot.stem = stem
+    slot.empty = False
+    slot.req_pos = pos
+    slot.req_frames = FRAMES
+    slot.req_loop = len(stem)
+    slot.process_audio()
+    return slot.output_buffer.copy()
+
+
+@pytest.mark.parametrize("mode", ["float32", "float16", "int16"])
+def test_read_into(audio, mode):
+    stem = pack_stem(audio, mode)
+    for start in (0, 1000, LENGTH - FRAMES):
+        out = np.empty((FRAMES, CHANNELS), np.float32)
+        stem.read_into(start, start + FRAMES, out)
+        expected = audio[start : start + FRAMES]
+        assert np.all(np.abs(out - expected) <= error_bound(mode, stem, expected))
+
+
+@pytest.mark.parametrize("mode", ["float32", "float16", "int16"])
+def test_read_across_loop(audio, mode):
+    stem = pack_stem(audio, mode)
+    reference = pack_stem(audio, "float32")
+    pos = LENGTH - FRAMES // 3
+    out = slot_block(stem, pos)
+    expected = slot_block(reference, pos)
+    # the float32 path wraps to the start of the loop
+    assert np.array_equal(expected, np.roll(audio, -pos, axis=0)[:FRAMES])
+    assert np.all(np.abs(out - expected) <= error_bound(mode, stem, expected))
+
+
+def test_compact_storage_halves_memory(audio):
+    full = pack_stem(audio, "float32").nbytes
+    assert pack_stem(audio, "float16").nbytes == full // 2
+    assert pack_stem(audio, "int16").nbytes == full // 2
+
+
+class DroppedWhileJoining(Slot):
+    # drop_slot_stem clears join_stem right after the mixer first reads it
+    @property
+    def join_stem(self):
+        stem, self.joining = self.joining, None
+        return stem
+
+    @join_stem.setter
+    def join_stem(self, stem):
+        self.joining = stem
+
+
+def test_join_dropped_mid_block(audio):
+    slot = DroppedWhileJoining(0)
+    slot.join_stem = pack_stem(audio, "float32")
+    slot.req_pos = LENGTH - FRAMES // 2
+    slot.req_frames = FRAMES
+    slot.req_loop = LENGTH
+    slot.process_audio()
+    # it joins with the stem it saw, never a slot thats playing nothing
+    assert not slot.empty and slot.stem is not None
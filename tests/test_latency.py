@@ -0,0 +1,67 @@
+import pytest
+
+from jamstudio import drivers, latency, prefetch
+from jamstudio.session import JamSession
+
+
+@pytest.fixture
+def manager(monkeypatch):
+    monkeypatch.setattr(drivers, "OUTPUT_DRIVER", "null")
+    monkeypatch.setattr(prefetch, "PREFETCH_ENABLED", False)
+    monkeypatch.setattr(latency, "AUTO_LATENCY", True)
+    monkeypatch.setattr(latency, "BLOCK_SIZE", 1024)
+    session = JamSession()
+    session.engine.blocksize = 1024
+    session.engine.start()
+    manager = latency.LatencyManager(session)
+    benched = []
+
+    def bench(blocksize):
+        benched.append(blocksize)
+        return (0.9 if blocksize >= 512 else 0.1), 1.0
+
+    monkeypatch.setattr(manager, "bench", bench)
+    manager.benched = benched
+    yield manager
+    session.engine.stop()
+
+
+def test_slot_count_changes_dont_reopen(manager):
+    engine = manager.engine
+    stream = engine.stream
+    engine.slots[0].empty = False
+    manager.check()
+    engine.slots[0].empty = True
+    manager.check()
+    manager.apply_pending()
+    assert engine.stream is stream
+    assert manager.benched == []
+
+
+def test_underflows_wait_for_the_ui_thread(manager):
+    engine = manager.engine
+    stream = engine.stream
+    engine.xruns += 3
+    manager.check()
+    # the watcher only asks
+    assert manager.pending == 2048 and engine.stream is stream
+    manager.apply_pending()
+    assert engine.blocksize == 2048 and engine.stream is not stream
+    assert engine.is_playing() and manager.pending is None
+
+
+def test_tune_runs_once_per_device(manager):
+    manager.set_auto(True)
+    manager.check()
+    assert manager.pending == 512
+    manager.apply_pending()
+    assert manager.engine.blocksize == 512
+    runs = len(manager.benched)
+    assert runs == len(latency.BLOCK_SIZES)
+    # options opening again, and auto switched off and on
+    manager.tune_async()
+    manager.set_auto(False)
+    manager.set_auto(True)
+    manager.check()
+    assert len(manager.benched) == runs
+    assert manager.suggested == 512
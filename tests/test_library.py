@@ -0,0 +1,57 @@
+import json
+import os
+
+from jamstudio import analysis, compat, library, session
+
+
+def song(tmp_path, meta):
+    folder = tmp_path / "Song"
+    folder.mkdir()
+    (folder / "bass_major.ogg").touch()
+    with open(folder / "meta.json", "w") as f:
+        json.dump(meta, f)
+    return str(folder)
+
+
+def test_bpm_and_key_are_enough(tmp_path, monkeypatch):
+    folder = song(tmp_path, {"bpm": 128, "key": "C"})
+
+    def no_analysis(folder):
+        raise AssertionError("a complete meta.json got analyzed")
+
+    monkeypatch.setattr(analysis, "song_analysis", no_analysis)
+    assert not analysis.needs_analysis(folder)
+    assert library.read_meta(folder) == {"bpm": 128, "key": "C"}
+    bpm, key, stems = compat.song_info(folder)
+    assert (bpm, key, stems) == (128, "C", {"bass": {"major"}})
+
+
+def test_unknown_key_needs_analysis(tmp_path, monkeypatch):
+    folder = song(tmp_path, {"bpm": 128, "key": "H", "scale": "minor"})
+    monkeypatch.setattr(
+        analysis,
+        "song_analysis",
+        lambda folder: {"bpm": 100, "key": "D", "scale": "major"},
+    )
+    assert analysis.needs_analysis(folder)
+    # whatever meta.json does have still wins over the guess
+    assert library.read_meta(folder) == {"bpm": 128, "key": "D", "scale": "minor"}
+
+
+def test_stem_names_match_the_same_for_index_and_load(tmp_path):
+    folder = song(tmp_path, {"bpm": 128, "key": "C"})
+    for name in ("Vocals_Minor.ogg", "DRUMS.ogg", "notes.txt"):
+        (tmp_path / "Song" / name).touch()
+    _, _, stems = compat.song_info(folder)
+    assert stems == {"bass": {"major"}, "vocals": {"minor"}, "drums": {"neutral"}}
+    # every stem the index says is there, a load finds the file for
+    for stem_type, scales in stems.items():
+        for scale in scales:
+            name, picked = session.pick_stem_file(folder, stem_type, scale)
+            assert picked == scale
+            assert os.path.exists(os.path.join(folder, name))
+    assert session.pick_stem_file(folder, "vocals", "major") == (
+        "Vocals_Minor.ogg",
+        "minor",
+    )
+    assert session.pick_stem_file(folder, "lead", "major") == (None, None)
@@ -0,0 +1,60 @@
+# the memory budget, MemoryTracker on its own with a made up resident size
+
+import threading
+
+import pytest
+
+from jamstudio import memory
+from jamstudio.memory import MB, BudgetExceeded, MemoryTracker
+
+
+@pytest.fixture
+def budget(monkeypatch):
+    monkeypatch.setattr(memory, "MEMORY_BUDGET_MB", 10)
+
+
+def lock_is_free(tracker):
+    # from another thread, the lock is reentrant
+    got = []
+
+    def try_lock():
+        if tracker.lock.acquire(timeout=1.0):
+            got.append(True)
+            tracker.lock.release()
+
+    thread = threading.Thread(target=try_lock)
+    thread.start()
+    thread.join()
+    return bool(got)
+
+
+def test_reclaim_runs_without_the_lock(budget):
+    resident = [8 * MB]
+    seen = []
+
+    def reclaim():
+        seen.append(lock_is_free(tracker))
+        # a cache giving something back goes through the tracker itself
+        with tracker.load("released", 0):
+            pass
+        resident[0] = 0
+
+    tracker = MemoryTracker(lambda: resident[0], reclaim)
+    with tracker.load("slot 0", 5 * MB):
+        pass
+    assert seen == [True]
+
+
+def test_refused_when_reclaim_isnt_enough(budget):
+    tracker = MemoryTracker(lambda: 8 * MB, lambda: None)
+    with pytest.raises(BudgetExceeded):
+        tracker.reserve("slot 0", 5 * MB)
+    assert tracker.refused == 1 and tracker.loads == 0
+
+
+def test_no_reclaim_without_budget():
+    called = []
+    tracker = MemoryTracker(lambda: 10**12, lambda: called.append(True))
+    with tracker.load("slot 0", 10**12):
+        pass
+    assert called == []
@@ -0,0 +1,144 @@
+# the streamed preview: the same numbers as resampling the whole file, and a slot
+# that plays before its file is decoded
+
+import json
+import threading
+
+import numpy as np
+import pytest
+import soundfile as sf
+
+from jamstudio import drivers, prefetch, preview
+from jamstudio.engine import CHANNELS
+from jamstudio.preview import PreviewStream
+from jamstudio.session import JamSession, plan_stem, source_key
+from jamstudio.stretch import resample_linear
+
+RATE = 44100
+
+
+def write_ramp(path, frames, rate=RATE):
+    # different in every frame and channel, so a misplaced one shows
+    t = np.arange(frames) / frames
+    audio = np.stack((t, t[::-1]), axis=1).astype(np.float32) * 0.5
+    sf.write(str(path), audio, rate, subtype="FLOAT")
+    return sf.read(str(path), dtype="float32", always_2d=True)[0]
+
+
+def decode_all(stream):
+    while stream.decode_block():
+        pass
+    return stream
+
+
+@pytest.mark.parametrize("length", [50000, 30001])
+@pytest.mark.parametrize("start", [0, 1, 12345, 29999, 49999])
+def test_stream_matches_a_whole_resample(tmp_path, monkeypatch, length, start):
+    monkeypatch.setattr(preview, "BLOCK_FRAMES", 4096)
+    source = write_ramp(tmp_path / "ramp.wav", 40000)
+    stream = decode_all(PreviewStream(str(tmp_path / "ramp.wav"), length, start))
+    assert stream.done and stream.file.closed
+    np.testing.assert_array_equal(stream.source, source)
+    np.testing.assert_array_equal(stream.stem.data, resample_linear(source, length))
+
+
+def test_other_file_rates(tmp_path):
+    # straight from the files own rate, the hq render gets it converted
+    source = write_ramp(tmp_path / "ramp.wav", 32000, rate=32000)
+    stream = decode_all(PreviewStream(str(tmp_path / "ramp.wav"), 44100, 20000))
+    assert stream.rate == 32000
+    np.testing.assert_array_equal(stream.stem.data, resample_linear(source, 44100))
+
+
+@pytest.mark.parametrize("mode, atol", [("float16", 1e-3), ("int16", 1 / 32767)])
+def test_packed_modes(tmp_path, mode, atol):
+    source = write_ramp(tmp_path / "ramp.wav", 40000)
+    stream = decode_all(PreviewStream(str(tmp_path / "ramp.wav"), 45000, 7000, mode))
+    out = stream.stem.data.astype(np.float32) * stream.stem.scale
+    np.testing.assert_allclose(out, resample_linear(source, 45000), atol=atol)
+
+
+def test_mono_file_plays_on_both_sides(tmp_path):
+    sf.write(str(tmp_path / "mono.wav"), np.linspace(0, 0.5, 9000), RATE)
+    stream = decode_all(PreviewStream(str(tmp_path / "mono.wav"), 9000))
+    assert stream.source.shape == (9000, CHANNELS)
+    np.testing.assert_array_equal(stream.source[:, 0], stream.source[:, 1])
+
+
+@pytest.fixture
+def session(monkeypatch):
+    monkeypatch.setattr(drivers, "OUTPUT_DRIVER", "null")
+    monkeypatch.setattr(prefetch, "PREFETCH_ENABLED", False)
+    session = JamSession(RATE)
+    yield session
+    session.engine.stop()
+
+
+def test_slot_plays_before_the_file_is_decoded(session, tmp_path, monkeypatch):
+    monkeypatch.setattr(preview, "BLOCK_FRAMES", 4096)
+    song = tmp_path / "song"
+    song.mkdir()
+    (song / "meta.json").write_text(json.dumps({"bpm": 100, "key": "C"}))
+    rng = np.random.default_rng(0)
+    audio = rng.uniform(-0.3, 0.3, (RATE * 2, CHANNELS)).astype(np.float32)
+    sf.write(str(song / "Drums.ogg"), audio, RATE)
+    plan = plan_stem(str(song), "drums", "fast", (120, "C", "major"))
+    assert plan["ratio"] != 1.0
+
+    # the decode stops after its first block until the test lets it go
+    release = threading.Event()
+    blocks = []
+    decode_block = PreviewStream.decode_block
+
+    def held(stream):
+        if blocks:
+            assert release.wait(10)
+        blocks.append(stream.pos)
+        return decode_block(stream)
+
+    monkeypatch.setattr(PreviewStream, "decode_block", held)
+
+    assert session.load_planned(0, plan)
+    slot = session.slots[0]
+    assert len(blocks) == 1
+    assert slot.tier == "preview" and not slot.empty
+    assert slot.stem.data.shape == (plan["target_len"], CHANNELS)
+    # the first block is in, the rest is still silence
+    assert np.any(slot.stem.data[:1000]) and not np.any(slot.stem.data[-1000:])
+    session.engine.update_max_length()
+    assert session.engine.max_length == plan["target_len"]
+
+    release.set()
+    session.finish_renders()
+    assert slot.tier == "hq"
+    assert len(slot.stem.data) == plan["target_len"]
+    # the decoded file is kept for a retune
+    assert session.stage_cache.get(source_key(plan["path"])) is not None
+
+
+def test_clear_cancels_the_decode(session, tmp_path, monkeypatch):
+    monkeypatch.setattr(preview, "BLOCK_FRAMES", 4096)
+    song = tmp_path / "song"
+    song.mkdir()
+    (song / "meta.json").write_text(json.dumps({"bpm": 100, "key": "C"}))
+    sf.write(str(song / "Drums.ogg"), np.zeros((RATE, CHANNELS)), RATE)
+    plan = plan_stem(str(song), "drums", "fast", (120, "C", "major"))
+
+    release = threading.Event()
+    decode_block = PreviewStream.decode_block
+
+    def held(stream):
+        if stream.pos:
+            assert release.wait(10)
+        return decode_block(stream)
+
+    monkeypatch.setattr(PreviewStream, "decode_block", held)
+    rendered = []
+    monkeypatch.setattr(session, "render_job", lambda *args: rendered.append(args))
+
+    assert session.load_planned(0, plan)
+    future = session.slots[0].render_future
+    session.drop_slot_stem(session.slots[0])
+    release.set()
+    future.result()
+    assert rendered == []
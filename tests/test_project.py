@@ -0,0 +1,99 @@
+import json
+import logging
+
+import pytest
+
+from jamstudio import drivers, prefetch, project, stretch
+from jamstudio.session import JamSession
+
+
+@pytest.fixture
+def session(monkeypatch, tmp_path):
+    monkeypatch.setattr(drivers, "OUTPUT_DRIVER", "null")
+    monkeypatch.setattr(prefetch, "PREFETCH_ENABLED", False)
+    monkeypatch.setattr(project, "PROJECTS_DIR", str(tmp_path))
+    session = JamSession()
+    yield session
+    session.engine.stop()
+
+
+def test_engine_start_is_idempotent(session):
+    engine = session.engine
+    engine.start()
+    stream = engine.stream
+    engine.start()
+    assert engine.stream is stream and stream.active
+
+
+def test_load_starts_the_engine_once(session, tmp_path, caplog, monkeypatch):
+    # slot 0 loads before planning gets past slot 1, which has no file in the end.
+    # the load is only done once planning is, and the engine starts just the once
+    data = {
+        "master": {"bpm": 120, "key": "C", "scale": "major"},
+        "slots": [
+            {"index": 0, "song_name": "First", "type": "bass"},
+            {"index": 1, "song_name": "Second", "type": "bass"},
+        ],
+    }
+    with open(tmp_path / "race.json", "w") as f:
+        json.dump(data, f)
+
+    # load_project logs and swallows exceptions, so no asserts in here
+    still_loading = []
+
+    def plan_stem(song_path, stem_type, profile, loop_len=0):
+        if song_path == "Second":
+            for future in list(session.load_futures):
+                future.result()
+            still_loading.append(session.is_loading())
+            return None
+        return {"target_len": 1000, "est_len": 1000}
+
+    monkeypatch.setattr(project, "find_song", lambda name: name)
+    monkeypatch.setattr(session, "plan_stem", plan_stem)
+    monkeypatch.setattr(project, "load_slot", lambda *args: True)
+
+    streams = []
+    open_stream = drivers.open_stream
+
+    def counting(*args, **kwargs):
+        streams.append(open_stream(*args, **kwargs))
+        return streams[-1]
+
+    monkeypatch.setattr(drivers, "open_stream", counting)
+    with caplog.at_level(logging.INFO):
+        for _ in range(3):
+            project.load_project(session, "race.json")
+            assert not session.is_loading()
+            assert sum(s.active for s in streams) == 1
+
+    assert still_loading == [True] * 3
+    assert len(streams) == 3
+    assert caplog.messages.count("Project loaded successfully.") == 3
+
+
+def test_project_profile_stays_in_the_project(session, tmp_path, monkeypatch):
+    data = {
+        "master": {"bpm": 120, "key": "C", "scale": "major", "profile": "per stem"},
+        "slots": [
+            {"index": 0, "song_name": "Song", "type": "vocals"},
+            {"index": 1, "song_name": "Song", "type": "bass", "profile": "fast"},
+        ],
+    }
+    with open(tmp_path / "theirs.json", "w") as f:
+        json.dump(data, f)
+
+    planned = {}
+
+    def plan_stem(song_path, stem_type, profile, loop_len=0):
+        planned[stem_type] = profile
+        return None
+
+    monkeypatch.setattr(project, "find_song", lambda name: name)
+    monkeypatch.setattr(session, "plan_stem", plan_stem)
+    monkeypatch.setattr(stretch, "global_profile", "balanced")
+    project.load_project(session, "theirs.json")
+
+    assert planned == {"vocals": stretch.STEM_PROFILES["vocals"], "bass": "fast"}
+    # so save_config doesnt write someone elses choice into config.json
+    assert stretch.global_profile == "balanced"
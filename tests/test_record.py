@@ -0,0 +1,70 @@
+# a recorded performance rendered to a wav has to be what the mixer played live
+
+import numpy as np
+import pytest
+import soundfile as sf
+
+from jamstudio import drivers, prefetch, record
+from jamstudio.drivers import NullStream
+from jamstudio.engine import CHANNELS, pack_stem
+from jamstudio.session import JamSession
+
+FRAMES = 512
+RATE = 44100
+
+
+@pytest.fixture
+def session(monkeypatch):
+    monkeypatch.setattr(drivers, "OUTPUT_DRIVER", "null")
+    monkeypatch.setattr(prefetch, "PREFETCH_ENABLED", False)
+    session = JamSession(RATE)
+    rng = np.random.default_rng(2)
+    for slot, length in zip(session.slots, (7000, 3100, 5000)):
+        audio = rng.uniform(-0.3, 0.3, (length, CHANNELS)).astype(np.float32)
+        slot.stem = pack_stem(audio, "float32")
+        slot.empty = False
+    yield session
+    session.engine.stop()
+
+
+def test_render_matches_what_played(session, tmp_path):
+    slots = session.slots
+    stream = NullStream(
+        RATE, CHANNELS, FRAMES, session.engine.audio_callback, capture=True
+    )
+    # between blocks, like the ui thread: (block, change)
+    changes = {
+        2: lambda: setattr(slots[0], "volume", 0.8),
+        3: lambda: setattr(slots[0], "volume", 0.6),
+        4: lambda: setattr(slots[0], "volume", 0.5),
+        6: lambda: setattr(slots[1], "mute", True),
+        9: lambda: setattr(slots[2], "half", 1),
+        11: lambda: setattr(slots[1], "mute", False),
+        13: lambda: setattr(slots[0], "half", 1),
+        15: lambda: setattr(session.engine, "master_volume", 0.7),
+        17: lambda: setattr(slots[2], "solo", True),
+        19: lambda: setattr(slots[2], "solo", False),
+        21: lambda: setattr(slots[1], "volume", 0.0),
+    }
+
+    # a couple of blocks before the recording starts, so it doesnt start at 0
+    stream.run_block()
+    stream.run_block()
+    stream.chunks.clear()
+    record.start(session)
+    for block in range(24):
+        if block in changes:
+            changes[block]()
+        stream.run_block()
+    recording = record.stop(session)
+
+    live = stream.captured()
+    assert recording.frames == len(live) == 24 * FRAMES
+    fields = {field for _, _, field, _ in recording.events}
+    assert {"volume", "mute", "half", "solo", "master_volume"} <= fields
+
+    path = tmp_path / "performance.wav"
+    record.render(recording, str(path))
+    rendered, rate = sf.read(path, dtype="float32", always_2d=True)
+    assert rate == RATE
+    np.testing.assert_array_equal(rendered, live)
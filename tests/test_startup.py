@@ -0,0 +1,120 @@
+# the startup budget from main.py (STARTUP_BUDGET_FIRST_FRAME/_AUDIO), and the
+# promise in jamstudio/__init__.py that importing the engine does nothing by itself
+
+import json
+import os
+import pkgutil
+import subprocess
+import sys
+
+import pytest
+
+import jamstudio
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# imports every module then reports what that did, in a fresh interpreter
+IMPORT_CHECK = """
+import importlib, json, os, sys, threading
+sys.path.insert(0, {root!r})
+for name in {modules!r}:
+    importlib.import_module(name)
+print(json.dumps({{
+    "threads": [t.name for t in threading.enumerate()],
+    "sounddevice": "sounddevice" in sys.modules,
+    "pygame": "pygame" in sys.modules,
+    "files": os.listdir("."),
+}}))
+"""
+
+# runs main.py for a few frames and reports the timings it took. main.py starts its
+# clock after its own imports, so how long those took gets reported on the side
+RUN_MAIN = """
+import json, os, sys, time
+launch = time.perf_counter()
+sys.path.insert(0, {root!r})
+import pygame
+
+frames = [0]
+get = pygame.event.get
+
+
+def quit_after_a_few(*args, **kwargs):
+    get(*args, **kwargs)
+    frames[0] += 1
+    return [pygame.event.Event(pygame.QUIT)] if frames[0] > 3 else []
+
+
+pygame.event.get = quit_after_a_few
+app = {{"__name__": "__main__"}}
+with open(os.path.join({root!r}, "main.py")) as f:
+    exec(compile(f.read(), "main.py", "exec"), app)
+print(json.dumps({{
+    "first_frame": app["first_frame_time"],
+    "audio": app["audio_start_time"],
+    "imports": app["startup_t0"] - launch,
+    "budget_first_frame": app["STARTUP_BUDGET_FIRST_FRAME"],
+    "budget_audio": app["STARTUP_BUDGET_AUDIO"],
+    "rate": app["audio_engine"].sr,
+}}))
+"""
+
+
+def run(code, cwd):
+    env = dict(os.environ, SDL_VIDEODRIVER="dummy", SDL_AUDIODRIVER="dummy")
+    result = subprocess.run(
+        [sys.executable, "-c", code],
+        cwd=cwd,
+        env=env,
+        capture_output=True,
+        text=True,
+        timeout=120,
+    )
+    assert result.returncode == 0, result.stderr
+    return json.loads(result.stdout.strip().splitlines()[-1])
+
+
+def test_import_has_no_side_effects(tmp_path):
+    modules = ["jamstudio"] + [
+        "jamstudio." + m.name for m in pkgutil.iter_modules(jamstudio.__path__)
+    ]
+    report = run(IMPORT_CHECK.format(root=ROOT, modules=modules), tmp_path)
+    assert report["threads"] == ["MainThread"]
+    assert not report["sounddevice"]
+    assert not report["pygame"]
+    assert report["files"] == []
+
+
+def write_config(folder, **extra):
+    # a config that plays into the null driver, no song folders
+    config = {"output_driver": "null", "prefetch": {"enabled": False}}
+    config.update(extra)
+    with open(folder / "config.json", "w") as f:
+        json.dump(config, f)
+
+
+@pytest.fixture
+def app_dir(tmp_path):
+    os.symlink(os.path.join(ROOT, "themes"), tmp_path / "themes")
+    write_config(tmp_path)
+    return tmp_path
+
+
+def test_startup_budget(app_dir):
+    report = run(RUN_MAIN.format(root=ROOT), app_dir)
+    assert report["first_frame"] < report["budget_first_frame"]
+    assert report["audio"] < report["budget_audio"]
+    assert report["first_frame"] <= report["audio"]
+    # and from the top of the file, pygame/numpy imports and all
+    assert report["imports"] + report["first_frame"] < report["budget_first_frame"]
+    assert report["imports"] + report["audio"] < report["budget_audio"]
+
+
+@pytest.mark.parametrize(
+    "setting, rate",
+    [(48000, 48000), ("48k", 44100), ("48000 ", 44100), (0, 44100), (True, 44100)],
+)
+def test_bad_sample_rate_falls_back(app_dir, setting, rate):
+    # the null driver has no native rate, so "native" ends up at the default 44100
+    write_config(app_dir, sample_rate=setting)
+    assert run(RUN_MAIN.format(root=ROOT), app_dir)["rate"] == rate
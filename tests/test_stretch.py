@@ -0,0 +1,87 @@
+# the numpy stretchers (the fallback when theres no rubberband): length, level and pitch
+
+import numpy as np
+import pytest
+
+from jamstudio import stretch
+from jamstudio.stretch import pv_time_stretch, wsola_time_stretch
+
+RATE = 44100
+STRETCHERS = [pv_time_stretch, wsola_time_stretch]
+
+
+@pytest.fixture(autouse=True)
+def numpy_only(monkeypatch):
+    # the same backends whether or not rubberband is on the machine
+    monkeypatch.setattr(stretch, "rubberband_available", lambda: False)
+
+
+def sine(freq, seconds=2.0, level=0.5):
+    t = np.arange(int(seconds * RATE)) / RATE
+    x = level * np.sin(2 * np.pi * freq * t)
+    return np.stack((x, x), axis=1).astype(np.float32)
+
+
+def noise(seconds=2.0, level=0.3):
+    rng = np.random.default_rng(3)
+    return rng.normal(0, level, (int(seconds * RATE), 2)).astype(np.float32)
+
+
+def rms(audio):
+    return float(np.sqrt(np.mean(audio.astype(np.float64) ** 2)))
+
+
+def pitch(audio):
+    return stretch.dominant_freq(audio, RATE)
+
+
+@pytest.mark.parametrize("stretcher", STRETCHERS)
+@pytest.mark.parametrize("rate", [0.5, 0.8, 0.97, 1.03, 1.25, 2.0])
+def test_length_follows_rate(stretcher, rate):
+    audio = noise(1.0)
+    assert len(stretcher(audio, rate)) == int(round(len(audio) / rate))
+
+
+@pytest.mark.parametrize("stretcher", STRETCHERS)
+@pytest.mark.parametrize("rate", [0.5, 0.8, 1.25, 2.0])
+def test_tone_level_is_kept(stretcher, rate):
+    audio = sine(440)
+    assert rms(stretcher(audio, rate)) == pytest.approx(rms(audio), rel=0.02)
+
+
+# noise comes out quieter: its frames dont line up, so the overlap add sums them in
+# power instead of amplitude. the vocoder loses the most (up to ~3 dB at 2x),
+# wsola picks the best matching frame and loses less (see the top of stretch.py)
+NOISE_LEVEL = {pv_time_stretch: 0.65, wsola_time_stretch: 0.85}
+
+
+@pytest.mark.parametrize("stretcher", STRETCHERS)
+@pytest.mark.parametrize("rate", [0.5, 0.8, 1.25, 2.0])
+def test_noise_level(stretcher, rate):
+    audio = noise()
+    ratio = rms(stretcher(audio, rate)) / rms(audio)
+    assert NOISE_LEVEL[stretcher] < ratio < 1.02
+
+
+@pytest.mark.parametrize("stretcher", STRETCHERS)
+@pytest.mark.parametrize("rate", [0.8, 1.25])
+def test_stretch_keeps_pitch(stretcher, rate):
+    out = stretcher(sine(440), rate)
+    assert pitch(out) == pytest.approx(440, rel=0.005)
+
+
+@pytest.mark.parametrize("semitones", [-5, -1, 2, 7])
+def test_pitch_shift_by_pv_and_resample(semitones):
+    audio = sine(440)
+    out = stretch.pitch_shift(audio, semitones, "vocals")
+    assert len(out) == len(audio)
+    assert pitch(out) == pytest.approx(440 * 2 ** (semitones / 12), rel=0.005)
+    assert rms(out) == pytest.approx(rms(audio), rel=0.1)
+
+
+def test_stereo_image_is_kept():
+    # left only stays left only, the phases come from the mid channel
+    audio = sine(440)
+    audio[:, 1] = 0
+    out = pv_time_stretch(audio, 0.8)
+    assert rms(out[:, 1]) < 1e-3 * rms(out[:, 0])
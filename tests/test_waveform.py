@@ -0,0 +1,59 @@
+# the peak pyramid against min/max taken straight off the samples
+
+import numpy as np
+import pytest
+
+from jamstudio.engine import CHANNELS, pack_stem
+from jamstudio.waveform import BASE_BLOCK, Peaks
+
+# an odd number of whole blocks plus a partial one, so every level above has an
+# odd length somewhere and the last block is short
+LENGTH = BASE_BLOCK * 37 + 101
+
+
+@pytest.fixture
+def audio():
+    rng = np.random.default_rng(1)
+    return rng.uniform(-1.0, 1.0, (LENGTH, CHANNELS)).astype(np.float32)
+
+
+def brute_force(samples, n):
+    # the block size is the biggest BASE_BLOCK * 2**k that fits in a column (the
+    # top level is one block for the whole stem). a column covers the blocks from
+    # the one its first frame is in up to the one the next column starts in
+    length = len(samples)
+    block = BASE_BLOCK
+    while block * 2 <= length / n and block < length:
+        block *= 2
+    blocks = -(-length // block)
+    mins = np.empty(n, np.float32)
+    maxs = np.empty(n, np.float32)
+    for i in range(n):
+        first = min(int(i * length / n) // block, blocks - 1)
+        if i + 1 < n:
+            last = max(min(int((i + 1) * length / n) // block, blocks - 1), first + 1)
+        else:
+            last = blocks
+        frames = samples[first * block : last * block]
+        mins[i] = frames.min()
+        maxs[i] = frames.max()
+    return mins, maxs
+
+
+@pytest.mark.parametrize("mode", ["float32", "int16"])
+@pytest.mark.parametrize("n", [1, 2, 5, 18, 36, 37, 38, 100, 1000])
+def test_columns_match_the_samples(audio, mode, n):
+    stem = pack_stem(audio, mode)
+    samples = stem.to_array()
+    mins, maxs = Peaks(stem).columns(n)
+    expected_mins, expected_maxs = brute_force(samples, n)
+    assert len(mins) == len(maxs) == n
+    np.testing.assert_allclose(mins, expected_mins, rtol=0, atol=1e-6)
+    np.testing.assert_allclose(maxs, expected_maxs, rtol=0, atol=1e-6)
+
+
+def test_whole_stem_peak(audio):
+    peaks = Peaks(pack_stem(audio, "float32"))
+    assert peaks.peak == pytest.approx(np.abs(audio).max())
+    mins, maxs = peaks.columns(3)
+    assert mins.min() == audio.min() and maxs.max() == audio.max()